@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-15 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('academics', '0007_schoolyearconfig_termstatus_termsubjectconfig'),
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='grade',
+            index=models.Index(fields=['student', 'term'], name='academics_g_student_98f747_idx'),
+        ),
+    ]
@@ -1,6 +1,8 @@
 from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.utils import timezone
 from decimal import Decimal
 
@@ -258,6 +260,9 @@ class Grade(models.Model):
 
     class Meta:
         unique_together = ("student", "subject", "term")
+        indexes = [
+            models.Index(fields=["student", "term"]),
+        ]
         ordering = ["student__user__username", "subject__name"]
 
     def __str__(self):
@@ -286,6 +291,17 @@ class Grade(models.Model):
         super().save(*args, **kwargs)
 
 
+@receiver([post_save, post_delete], sender=Grade)
+def invalidate_cached_report_cards(sender, instance, **kwargs):
+    """
+    Toute écriture sur un Grade rend obsolètes les bulletins mis en cache.
+    Version incrémentée au commit : plus tôt, un calcul concurrent mettrait
+    en cache, sous la nouvelle version, les notes d'avant l'écriture.
+    """
+    from academics.services.report_cards import invalidate_report_cards_cache
+    transaction.on_commit(invalidate_report_cards_cache)
+
+
 # ─────────────────────────────────────────────────────────────────────────────
 #  BROUILLONS DE NOTES (enseignants)
 # ─────────────────────────────────────────────────────────────────────────────
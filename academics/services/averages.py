@@ -2,6 +2,8 @@
 import logging
 from decimal import Decimal, ROUND_HALF_UP
 
+from django.db import transaction
+
 logger = logging.getLogger(__name__)
 
 DEFAULT_NB_INTERROS = 3
@@ -43,6 +45,7 @@ def compute_averages_for_term(term_status) -> None:
       average_coeff = avg_subject × ClassSubject.coefficient
     """
     from academics.models import Grade, TermSubjectConfig, ClassSubject
+    from academics.services.report_cards import invalidate_report_cards_cache
 
     grades = list(
         Grade.objects.filter(
@@ -126,6 +129,8 @@ def compute_averages_for_term(term_status) -> None:
             average_coeff=avg_c,
         )
 
+    transaction.on_commit(invalidate_report_cards_cache)
+
     logger.info(
         "compute_averages_for_term: %d grades calculés — %s / %s",
         len(updates), term_status.school_class, term_status.term,
@@ -138,6 +143,7 @@ def reset_averages_for_term(term_status) -> None:
     Les notes brutes ne sont pas touchées.
     """
     from academics.models import Grade
+    from academics.services.report_cards import invalidate_report_cards_cache
 
     count = Grade.objects.filter(
         student__school_class=term_status.school_class,
@@ -147,6 +153,7 @@ def reset_averages_for_term(term_status) -> None:
         average_subject=None,
         average_coeff=None,
     )
+    transaction.on_commit(invalidate_report_cards_cache)
 
     logger.info(
         "reset_averages_for_term: %d grades remis à null — %s / %s",
@@ -3,12 +3,19 @@ from dataclasses import dataclass
 from decimal import Decimal, ROUND_HALF_UP
 from typing import List, Dict, Tuple, Optional, Iterable
 from collections import defaultdict
+import hashlib
 import logging
+import time
+
+from django.core.cache import cache
 
 from academics.models import Grade, ClassSubject  # ajuste si nécessaire
 
 logger = logging.getLogger(__name__)
 
+REPORT_CARDS_CACHE_SECONDS = 60
+_REPORT_CARDS_VERSION_KEY = "rc:version"
+
 
 @dataclass
 class SubjectLine:
@@ -200,6 +207,99 @@ def compute_report_cards_from_grades(
     return items
 
 
+# ─────────────────────────────────────────────────────────────────────────────
+#  Cache des bulletins calculés
+#
+#  Les clés sont préfixées par une version de namespace : toute modification
+#  d'un Grade (signal post_save/post_delete, lock/unlock d'un trimestre)
+#  incrémente la version, ce qui invalide d'un coup toutes les entrées.
+# ─────────────────────────────────────────────────────────────────────────────
+
+def report_cards_cache_version() -> int:
+    version = cache.get(_REPORT_CARDS_VERSION_KEY)
+    if version is None:
+        # Version initiale horodatée : si la clé est évincée, on ne retombe
+        # jamais sur une version déjà utilisée par des entrées encore en cache.
+        cache.add(_REPORT_CARDS_VERSION_KEY, time.time_ns(), None)
+        version = cache.get(_REPORT_CARDS_VERSION_KEY, 0)
+    return version
+
+
+def invalidate_report_cards_cache() -> None:
+    """Invalide tous les bulletins mis en cache (bump de version)."""
+    try:
+        cache.incr(_REPORT_CARDS_VERSION_KEY)
+    except ValueError:
+        cache.set(_REPORT_CARDS_VERSION_KEY, time.time_ns(), None)
+
+
+def report_cards_scope_signature(*parts) -> str:
+    """
+    Signature d'un périmètre d'élèves pour les clés de cache (ex. rôle + ids
+    triés), à calculer une fois par requête et à réutiliser.
+    """
+    return hashlib.blake2b(repr(parts).encode(), digest_size=8).hexdigest()
+
+
+def report_card_values(item: Dict) -> Dict:
+    """
+    Bulletin de compute_report_cards_from_grades() réduit à des valeurs
+    simples (ni Student ni Grade) : identité de l'élève, niveau et résultats.
+    """
+    student = item["student"]
+    user = getattr(student, "user", None)
+    return {
+        "student_id": student.pk,
+        "first_name": getattr(user, "first_name", None),
+        "last_name": getattr(user, "last_name", None),
+        "level_id": getattr(getattr(student, "school_class", None), "level_id", None),
+        "term": item.get("term"),
+        "term_average": item.get("term_average"),
+        "class_id": item.get("class_id"),
+        "class_name": item.get("class_name"),
+        "rank": item.get("rank"),
+        "best_average": item.get("best_average"),
+        "worst_average": item.get("worst_average"),
+    }
+
+
+def cached_report_cards_from_grades(
+    grades_qs,
+    scope_sig: str,
+    term: Optional[str] = None,
+    level_id=None,
+    include_missing_subjects: bool = False,
+    full_weighting: bool = True,
+) -> List[Dict]:
+    """
+    Variante mise en cache de compute_report_cards_from_grades(), qui
+    renvoie les bulletins sous forme report_card_values() : seules des
+    valeurs simples sont stockées dans le cache.
+
+    La clé dépend du trimestre, du niveau et de `scope_sig`, signature du
+    périmètre d'élèves (report_cards_scope_signature) calculée par
+    l'appelant : deux utilisateurs ayant le même périmètre partagent l'entrée.
+    Le queryset n'est évalué qu'en cas de cache miss.
+    """
+    key = (
+        f"rc:{report_cards_cache_version()}:{term}:{level_id}:{scope_sig}"
+        f":{int(include_missing_subjects)}{int(full_weighting)}"
+    )
+
+    report_cards = cache.get(key)
+    if report_cards is None:
+        report_cards = [
+            report_card_values(item)
+            for item in compute_report_cards_from_grades(
+                grades_qs,
+                include_missing_subjects=include_missing_subjects,
+                full_weighting=full_weighting,
+            )
+        ]
+        cache.set(key, report_cards, REPORT_CARDS_CACHE_SECONDS)
+    return report_cards
+
+
 # Helper wrapper utile si tu veux appeler par "user" (ancienne signature)
 def compute_report_cards_for_user(user, term=None, include_missing_subjects=False, full_weighting=True):
     # 1) Déterminer les élèves à inclure pour le calcul
@@ -0,0 +1,38 @@
+# core/authentication.py
+from django.contrib.auth import get_user_model
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+User = get_user_model()
+
+# Profils en OneToOne inverse sur User, sondés partout via hasattr(user, "...")
+USER_ROLE_RELATIONS = ("parent", "student", "teacher")
+
+
+class _RoleAwareUserModel:
+    """
+    Façade du modèle User pour JWTAuthentication.get_user() : même API
+    (.objects.get / .DoesNotExist), mais les profils sont joints dans la
+    requête d'authentification.
+    """
+    DoesNotExist = User.DoesNotExist
+
+    @property
+    def objects(self):
+        return User.objects.select_related(*USER_ROLE_RELATIONS)
+
+
+class RoleAwareJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication qui charge parent / student / teacher avec le user.
+
+    Les hasattr(request.user, "teacher") des vues et permissions deviennent
+    de simples lectures du cache de relation (aucune requête, y compris
+    quand le profil n'existe pas).
+
+    Un middleware ne conviendrait pas : avec JWT, request.user n'est connu
+    qu'après l'authentification DRF, dans la vue.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.user_model = _RoleAwareUserModel()
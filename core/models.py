@@ -144,6 +144,19 @@ def generate_parent_id():
             return new_id
 
 
+def generate_parent_ids(count):
+    """
+    Génère `count` IDs uniques P000000 pour les créations en masse
+    (bulk_create), avec une seule requête d'unicité par tirage.
+    """
+    ids = set()
+    while len(ids) < count:
+        candidates = {f"P{random.randint(0, 999999):06d}" for _ in range(count - len(ids))} - ids
+        taken = set(Parent.objects.filter(id__in=candidates).values_list("id", flat=True))
+        ids |= candidates - taken
+    return list(ids)
+
+
 class Parent(models.Model):
     id = models.CharField(max_length=7, primary_key=True, default=generate_parent_id, editable=False)
     user = models.OneToOneField(User, on_delete=models.CASCADE)
@@ -181,6 +194,19 @@ def generate_student_id():
             return new_id
 
 
+def generate_student_ids(count):
+    """
+    Génère `count` IDs uniques S000000 pour les créations en masse
+    (bulk_create), avec une seule requête d'unicité par tirage.
+    """
+    ids = set()
+    while len(ids) < count:
+        candidates = {f"S{random.randint(0, 999999):06d}" for _ in range(count - len(ids))} - ids
+        taken = set(Student.objects.filter(id__in=candidates).values_list("id", flat=True))
+        ids |= candidates - taken
+    return list(ids)
+
+
 class Student(models.Model):
     SEX_CHOICES = [
         ('M', 'Masculin'),
@@ -224,8 +250,17 @@ class Student(models.Model):
             return self.school_class.timetable.all()
         return []
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # classe telle que chargée : fees.signals saute la comparaison de niveau si elle n'a pas changé
+        if "school_class_id" in instance.__dict__:
+            instance._loaded_school_class_id = instance.school_class_id
+        return instance
+
     def save(self, *args, **kwargs):
         if self.user:
             self.first_name = self.user.first_name
             self.last_name = self.user.last_name
-        super().save(*args, **kwargs)
\ No newline at end of file
+        super().save(*args, **kwargs)
+        self._loaded_school_class_id = self.school_class_id
\ No newline at end of file
@@ -0,0 +1,42 @@
+# core/renderers.py
+from decimal import Decimal
+
+from django.utils.encoding import force_str
+from django.utils.functional import Promise
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+# Optional import : repli sur le JSONRenderer de DRF si orjson est absent
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _orjson_default(obj):
+    """Types non gérés nativement par orjson."""
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, Promise):
+        return force_str(obj)
+    raise TypeError(f"Type non sérialisable : {type(obj).__name__}")
+
+
+class ORJSONRenderer(BaseRenderer):
+    """
+    Renderer JSON basé sur orjson (C), pour les réponses volumineuses
+    des dashboards. Les Decimal sont convertis en float.
+    """
+    media_type = "application/json"
+    format = "json"
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        if orjson is None:
+            return JSONRenderer().render(data, accepted_media_type, renderer_context)
+        return orjson.dumps(
+            data,
+            default=_orjson_default,
+            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS,
+        )
@@ -0,0 +1,27 @@
+# core/signals.py
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+# Statistiques globales du dashboard (identiques pour tous les utilisateurs)
+DASHBOARD_STATS_CACHE_KEY = "dashboard:stats"
+
+
+def invalidate_dashboard_stats() -> None:
+    """
+    Purge les statistiques du dashboard en cache.
+    À appeler explicitement après un bulk_create / update() de masse,
+    qui ne déclenchent pas post_save.
+    """
+    cache.delete(DASHBOARD_STATS_CACHE_KEY)
+
+
+@receiver([post_save, post_delete], sender="core.Student")
+@receiver([post_save, post_delete], sender="core.Teacher")
+@receiver([post_save, post_delete], sender="core.Parent")
+@receiver([post_save, post_delete], sender="academics.SchoolClass")
+def bust_dashboard_stats(sender, **kwargs):
+    # après le commit : purgées plus tôt, un calcul concurrent remettrait en
+    # cache les compteurs d'avant l'écriture
+    transaction.on_commit(invalidate_dashboard_stats)
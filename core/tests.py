@@ -1,3 +1,500 @@
+import datetime
+import io
+import json
+import zipfile
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.db.models import Count
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils.translation import gettext_lazy
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from academics.models import ClassSubject, Grade, Level, SchoolClass, Subject
+from academics.services.report_cards import cached_report_cards_from_grades, report_cards_scope_signature
+from core import views
+from core.signals import DASHBOARD_STATS_CACHE_KEY, invalidate_dashboard_stats
+from core.models import Parent, Student, Teacher
+from core.renderers import ORJSONRenderer
+from core.serializers import StudentSerializer
+from core.views import _import_student_rows, _normalize_header
+
+User = get_user_model()
+
+IMPORT_URL = "/api/core/admin/students/import-csv/"
+
+
+class StudentImportEndpointTest(TestCase):
+    """Import d'élèves synchrone : rapport complet dans la réponse."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser(username="admin", password="pass"))
+
+    def upload(self, content, name="eleves.csv"):
+        return self.client.post(
+            IMPORT_URL, {"file": SimpleUploadedFile(name, content.encode("utf-8"))}, format="multipart"
+        )
+
+    def test_import_reports_each_row(self):
+        response = self.upload(
+            "first_name,last_name,email,date_of_birth,sex\n"
+            "Ana,Diallo,ana@example.com,2010-01-01,F\n"
+            ",,,,\n"
+        )
+
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual((body["total_rows"], body["success_count"], body["error_count"]), (2, 1, 1))
+        self.assertEqual([r["row"] for r in body["results"]], [1, 2])
+        self.assertTrue(Student.objects.filter(user__username="ana").exists())
+
+    def test_rejects_unsupported_format_and_too_many_rows(self):
+        self.assertEqual(self.upload("x", name="eleves.pdf").status_code, 400)
+
+        rows = "".join(f"E{i},Nom,2010-01-01\n" for i in range(views.MAX_IMPORT_ROWS + 1))
+        response = self.upload("first_name,last_name,date_of_birth\n" + rows)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Student.objects.exists())
+
+
+class StudentImportStreamTest(TestCase):
+    """Import synchrone ?stream=1 : lecture du fichier en flux, réponse NDJSON."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser(username="admin", password="pass"))
+
+    def post(self, content, name):
+        response = self.client.post(
+            f"{IMPORT_URL}?stream=1", {"file": SimpleUploadedFile(name, content)}, format="multipart"
+        )
+        self.assertEqual(response.status_code, 200)
+        return [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+
+    def test_csv_falls_back_to_cp1252(self):
+        # é valide en UTF-8 sur les premières lignes, « è » cp1252 plus loin
+        content = "first_name,last_name,date_of_birth\nAnaé,Diallo,2010-01-01\n".encode("utf-8")
+        content += "Hélène,Sow,2011-01-01\n".encode("cp1252")
+
+        lines = self.post(content, "eleves.csv")
+
+        self.assertEqual(lines[-1], {"total_rows": 2, "success_count": 2, "error_count": 0})
+        self.assertTrue(Student.objects.filter(first_name="Hélène").exists())
+
+    def test_xlsx_is_read_from_the_upload(self):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w") as z:
+            z.writestr("xl/workbook.xml", (
+                '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+                'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+                '<sheets><sheet name="S" sheetId="1" r:id="rId1"/></sheets></workbook>'
+            ))
+            z.writestr("xl/worksheets/sheet1.xml", (
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+                '<row r="1"><c r="A1" t="inlineStr"><is><t>first_name</t></is></c>'
+                '<c r="B1" t="inlineStr"><is><t>last_name</t></is></c></row>'
+                '<row r="2"><c r="A2" t="inlineStr"><is><t>Ana</t></is></c>'
+                '<c r="B2" t="inlineStr"><is><t>Diallo</t></is></c></row>'
+                '</sheetData></worksheet>'
+            ))
+
+        lines = self.post(buffer.getvalue(), "eleves.xlsx")
+
+        self.assertEqual(lines[-1]["total_rows"], 1)
+        self.assertEqual(lines[0]["username"], "ana.diallo")
+
+
+class StudentImportRowsTest(TestCase):
+    """Import en lot (_import_student_rows) : création, mise à jour, rejets."""
+
+    HEADER = _normalize_header(["first_name", "last_name", "email", "date_of_birth", "sex", "school_class", "parent_id"])
+
+    def setUp(self):
+        self.school_class = SchoolClass.objects.create(name="6A", level=Level.objects.create(name="6e"))
+        self.parent = Parent.objects.create(user=User.objects.create_user(username="papa", password="pass"))
+
+    def run_import(self, *rows):
+        return _import_student_rows(self.HEADER, [list(row) for row in rows])
+
+    def test_reimport_with_empty_columns_keeps_class_parent_and_sex(self):
+        first = self.run_import(["Ana", "Diallo", "ana@example.com", "2010-01-01", "F", str(self.school_class.pk), ""])
+        self.assertTrue(first[0]["success"], first)
+        # parent rattaché depuis l'administration
+        Student.objects.filter(pk=first[0]["student_id"]).update(parent=self.parent)
+
+        again = self.run_import(["Ana", "Diallo", "ana@example.com", "2010-02-02", "", "", ""])
+        self.assertTrue(again[0]["success"], again)
+        self.assertTrue(again[0]["updated"])
+
+        student = Student.objects.get(user__username="ana")
+        self.assertEqual(student.pk, first[0]["student_id"])
+        self.assertEqual(student.school_class_id, self.school_class.pk)
+        self.assertEqual(student.parent_id, self.parent.pk)
+        self.assertEqual(student.sex, "F")
+        self.assertEqual(student.date_of_birth, datetime.date(2010, 2, 2))
+
+    def test_new_rows_create_users_and_students(self):
+        results = self.run_import(
+            ["Ana", "Diallo", "ana@example.com", "2010-01-01", "F", str(self.school_class.pk), ""],
+            ["Moussa", "Sow", "", "2011-03-04", "m", "", ""],
+        )
+        self.assertEqual([r["success"] for r in results], [True, True], results)
+        self.assertEqual([r["updated"] for r in results], [False, False])
+        self.assertEqual([r["username"] for r in results], ["ana", "moussa.sow"])
+
+        ana = Student.objects.select_related("user").get(pk=results[0]["student_id"])
+        self.assertEqual((ana.first_name, ana.sex, ana.school_class_id), ("Ana", "F", self.school_class.pk))
+        self.assertTrue(ana.user.has_usable_password())
+        self.assertEqual(Student.objects.get(pk=results[1]["student_id"]).sex, "M")
+
+    def test_existing_user_without_student_is_attached(self):
+        user = User.objects.create_user(username="ana", email="ana@example.com", password="pass")
+
+        results = self.run_import(["Ana", "Diallo", "ana@example.com", "2010-01-01", "F", "", ""])
+
+        self.assertTrue(results[0]["success"], results)
+        self.assertFalse(results[0]["updated"])
+        self.assertEqual(Student.objects.get(pk=results[0]["student_id"]).user_id, user.pk)
+        user.refresh_from_db()
+        self.assertEqual((user.first_name, user.last_name), ("Ana", "Diallo"))
+        self.assertTrue(user.check_password("pass"))
+
+    def test_invalid_rows_are_rejected_without_writes(self):
+        results = self.run_import(
+            ["", "", "vide@example.com", "2010-01-01", "F", "", ""],
+            ["Ana", "Diallo", "ana@example.com", "2010-01-01", "F", "999", ""],
+            ["Awa", "Ba", "awa@example.com", "2010-01-01", "F", "", ""],
+            ["Awa", "Ba", "awa@example.com", "2010-01-01", "F", "", ""],
+        )
+
+        self.assertEqual([r["success"] for r in results], [False, False, True, False], results)
+        self.assertIn("vides", results[0]["error"])
+        self.assertIn("school_class_id", results[1]["error"])
+        self.assertEqual(results[3]["error"], "Cet utilisateur est déjà rattaché à un élève.")
+        self.assertFalse(User.objects.filter(username__in=["vide", "ana"]).exists())
+        self.assertEqual(Student.objects.count(), 1)
+
+    def test_username_taken_concurrently_is_reported(self):
+        hash_passwords = views._hash_passwords
+
+        def hash_then_steal(users, raw_passwords):
+            hash_passwords(users, raw_passwords)
+            User.objects.create_user(username="ana", password="pass")
+
+        with mock.patch("core.views._hash_passwords", side_effect=hash_then_steal):
+            results = self.run_import(
+                ["Ana", "Diallo", "ana@example.com", "2010-01-01", "F", "", ""],
+                ["Awa", "Ba", "awa@example.com", "2010-01-01", "F", "", ""],
+            )
+
+        self.assertFalse(results[0]["success"])
+        self.assertIn("a été pris entre-temps", results[0]["error"])
+        self.assertTrue(results[1]["success"], results)
+        self.assertFalse(Student.objects.filter(user__username="ana").exists())
+
+
+class ParentBulkRegisterTest(TestCase):
+    """Inscription en masse de parents : IDs tirés en lot, sans requête par ligne."""
+
+    URL = "/api/core/register/parents/bulk/"
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser(username="admin", password="pass"))
+
+    def payload(self, count):
+        return [
+            {
+                "user": {
+                    "username": f"parent{i}", "password": "pass",
+                    "first_name": f"Prénom{i}", "last_name": "Diallo", "email": f"parent{i}@example.com",
+                },
+                "phone": f"0600000{i:03d}",
+            }
+            for i in range(count)
+        ]
+
+    def test_bulk_register_creates_parents(self):
+        response = self.client.post(self.URL, self.payload(3), format="json")
+
+        self.assertEqual(response.status_code, 201, response.content)
+        parent_ids = [r["parent_id"] for r in response.json()]
+        self.assertEqual(len(set(parent_ids)), 3)
+        self.assertTrue(all(pid.startswith("P") and len(pid) == 7 for pid in parent_ids))
+        parent = Parent.objects.select_related("user").get(pk=parent_ids[0])
+        self.assertEqual((parent.user.username, parent.first_name, parent.phone), ("parent0", "Prénom0", "0600000000"))
+        self.assertTrue(parent.user.check_password("pass"))
+
+    def test_id_lookups_do_not_grow_with_batch_size(self):
+        with CaptureQueriesContext(connection) as small:
+            self.client.post(self.URL, self.payload(2), format="json")
+        with CaptureQueriesContext(connection) as large:
+            self.client.post(
+                self.URL,
+                [dict(r, user=dict(r["user"], username=f"big{i}")) for i, r in enumerate(self.payload(20))],
+                format="json",
+            )
+
+        def parent_lookups(ctx):
+            return [q for q in ctx.captured_queries if q["sql"].startswith("SELECT") and '"core_parent"' in q["sql"]]
+
+        self.assertEqual(Parent.objects.count(), 22)
+        self.assertEqual(len(parent_lookups(large)), len(parent_lookups(small)))
+
+
+class DashboardTopStudentsTest(TestCase):
+    """Meilleurs élèves : classements, chemin élève, périmètre par rôle, ETag."""
+
+    URL = "/api/core/dashboard/top-students/"
+
+    def setUp(self):
+        cache.clear()
+        level = Level.objects.create(name="6e")
+        self.class_a = SchoolClass.objects.create(name="6A", level=level)
+        self.class_b = SchoolClass.objects.create(name="6B", level=level)
+        maths = Subject.objects.create(name="Maths")
+        for school_class in (self.class_a, self.class_b):
+            ClassSubject.objects.create(school_class=school_class, subject=maths)
+
+        def student(username, school_class, **averages):
+            user = User.objects.create_user(username=username, password="pass", first_name=username.title())
+            s = Student.objects.create(user=user, school_class=school_class, date_of_birth=datetime.date(2010, 1, 1))
+            for term, avg in averages.items():
+                Grade.objects.create(student=s, subject=maths, term=term, average_subject=Decimal(avg))
+            return s
+
+        self.ana   = student("ana", self.class_a, T1="15", T2="12")
+        self.awa   = student("awa", self.class_a, T1="18")
+        self.binta = student("binta", self.class_b, T1="10")
+
+    def get(self, user, **params):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client.get(self.URL, params)
+
+    @staticmethod
+    def names(entries):
+        return [e["first_name"] for e in entries]
+
+    def test_staff_rankings(self):
+        admin = User.objects.create_superuser(username="admin", password="pass")
+
+        body = self.get(admin, top_n=2).json()
+
+        self.assertEqual(self.names(body["top_overall"]), ["Awa", "Ana"])
+        self.assertEqual(body["top_overall"][1]["overall_average"], 13.5)
+        per_term = {t["term"]: self.names(t["top"]) for t in body["top_per_term"]}
+        self.assertEqual(per_term, {"T1": ["Awa", "Ana"], "T2": ["Ana"]})
+        self.assertEqual(self.names(body["top_per_level"][0]["top"]), ["Awa", "Ana"])
+        by_term = body["top_per_level_by_term"][str(self.class_a.level_id)]
+        self.assertEqual(self.names(by_term["T1"]), ["Awa", "Ana"])
+        self.assertEqual(by_term["T1"][0]["rank_in_class"], 1)
+
+    def test_student_fast_path(self):
+        body = self.get(self.ana.user, top_n=3).json()
+
+        self.assertEqual(self.names(body["top_overall"]), ["Ana"])
+        self.assertEqual(body["top_overall"][0]["overall_average"], 13.5)
+        self.assertEqual(sorted(t["term"] for t in body["top_per_term"]), ["T1", "T2"])
+        self.assertEqual(self.names(body["top_per_level"][0]["top"]), ["Ana", "Ana"])
+
+    def test_teacher_and_parent_see_their_scope(self):
+        teacher = Teacher.objects.create(user=User.objects.create_user(username="prof", password="pass"))
+        teacher.classes.add(self.class_b)
+        parent = Parent.objects.create(user=User.objects.create_user(username="papa", password="pass"))
+        Student.objects.filter(pk=self.ana.pk).update(parent=parent)
+
+        self.assertEqual(self.names(self.get(teacher.user, top_n=5).json()["top_overall"]), ["Binta"])
+        self.assertEqual(self.names(self.get(parent.user, top_n=5).json()["top_overall"]), ["Ana"])
+
+        # changement de périmètre : ni cache ni ETag périmés
+        etag = self.get(parent.user, top_n=5)["ETag"]
+        Student.objects.filter(pk=self.awa.pk).update(parent=parent)
+        teacher.classes.add(self.class_a)
+
+        response = self.get(parent.user, top_n=5)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(self.names(response.json()["top_overall"]), ["Awa", "Ana"])
+        self.assertEqual(self.names(self.get(teacher.user, top_n=5).json()["top_overall"]), ["Awa", "Ana", "Binta"])
+
+    def test_etag_not_modified_until_grades_change(self):
+        client = APIClient()
+        client.force_authenticate(self.awa.user)
+        etag = client.get(self.URL)["ETag"]
+
+        self.assertEqual(client.get(self.URL, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Grade.objects.filter(student=self.awa).update(average_subject=Decimal("9"))
+            Grade.objects.get(student=self.awa).save()
+        response = client.get(self.URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["top_overall"][0]["overall_average"], 9.0)
+
+    def test_cached_report_cards_hold_plain_values(self):
+        grades = Grade.objects.select_related("student__user", "student__school_class", "subject")
+        cards = cached_report_cards_from_grades(grades, report_cards_scope_signature("test"))
+
+        self.assertEqual(len(cards), 4)
+        plain = (str, int, float, type(None))
+        self.assertTrue(all(isinstance(v, plain) for card in cards for v in card.values()), cards)
+        # deuxième appel servi par le cache, queryset non évalué
+        self.assertEqual(cached_report_cards_from_grades(Grade.objects.none(), report_cards_scope_signature("test")), cards)
+
+
+class DashboardStatsTest(TestCase):
+    """Statistiques du dashboard : requête UNION ALL comparée à l'ORM."""
+
+    URL = "/api/core/dashboard/stats/"
+
+    def setUp(self):
+        cache.clear()
+        level = Level.objects.create(name="6e")
+        classes = [SchoolClass.objects.create(name=f"6{chr(65 + i)}", level=level) for i in range(9)]
+        for i in range(12):
+            Student.objects.create(
+                user=User.objects.create_user(username=f"eleve{i}", password="pass"),
+                school_class=classes[i % 4] if i < 11 else None,
+                sex="F" if i % 3 else "M",
+                date_of_birth=datetime.date(2010, 1, 1),
+            )
+        Teacher.objects.create(user=User.objects.create_user(username="prof", password="pass"))
+        Parent.objects.create(user=User.objects.create_user(username="papa", password="pass"))
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser(username="admin", password="pass"))
+
+    def test_counts_match_orm(self):
+        data = self.client.get(self.URL).json()
+
+        self.assertEqual(data["students_count"], Student.objects.count())
+        self.assertEqual(data["teachers_count"], Teacher.objects.count())
+        self.assertEqual(data["parents_count"], Parent.objects.count())
+        self.assertEqual(
+            data["students_by_sex"],
+            dict(Student.objects.values_list("sex").annotate(n=Count("pk")).order_by()),
+        )
+        expected_top = [
+            {"id": c.pk, "name": c.name, "student_count": c.student_count}
+            for c in SchoolClass.objects.annotate(student_count=Count("students")).order_by("-student_count", "pk")[:8]
+        ]
+        self.assertEqual(data["top_classes"], expected_top)
+
+    def test_cache_invalidated_on_student_write(self):
+        first = self.client.get(self.URL)
+        self.assertIsNotNone(cache.get(DASHBOARD_STATS_CACHE_KEY))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Student.objects.create(
+                user=User.objects.create_user(username="nouvel_eleve", password="pass"),
+                sex="M",
+                date_of_birth=datetime.date(2010, 1, 1),
+            )
+
+        self.assertIsNone(cache.get(DASHBOARD_STATS_CACHE_KEY))
+        second = self.client.get(self.URL)
+        self.assertEqual(second.json()["students_count"], first.json()["students_count"] + 1)
+        self.assertNotEqual(second["ETag"], first["ETag"])
+
+    def test_invalidate_dashboard_stats_drops_cached_entry(self):
+        self.client.get(self.URL)
+        # écriture hors signaux (bulk_create / update) : le cache reste servi…
+        Student.objects.filter(sex="M").update(sex="F")
+        self.assertIn("M", self.client.get(self.URL).json()["students_by_sex"])
+        # …jusqu'à l'invalidation explicite
+        invalidate_dashboard_stats()
+        self.assertNotIn("M", self.client.get(self.URL).json()["students_by_sex"])
+
+    def test_not_modified_on_matching_etag(self):
+        etag = self.client.get(self.URL)["ETag"]
+
+        response = self.client.get(self.URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+
+        response = self.client.get(self.URL, HTTP_IF_NONE_MATCH='"autre"')
+        self.assertEqual(response.status_code, 200)
+
+
+class ORJSONRendererTest(TestCase):
+    """Le renderer orjson doit produire le même JSON que le JSONRenderer de DRF."""
+
+    DATA = {
+        "students_count": 3,
+        "students_by_sex": {"M": 1, "F": 2},
+        "results": [
+            {
+                "student_id": 1,
+                "first_name": "Awa",
+                "term_average": Decimal("14.25"),
+                "rank": None,
+                "date_of_birth": datetime.date(2010, 5, 1),
+                "label": gettext_lazy("Trimestre"),
+            },
+        ],
+    }
+
+    def test_output_matches_drf_json_renderer(self):
+        self.assertEqual(
+            json.loads(ORJSONRenderer().render(self.DATA)),
+            json.loads(JSONRenderer().render(self.DATA)),
+        )
+
+    def test_falls_back_to_drf_without_orjson(self):
+        with mock.patch("core.renderers.orjson", None):
+            self.assertEqual(ORJSONRenderer().render(self.DATA), JSONRenderer().render(self.DATA))
+
+    def test_none_renders_empty_body(self):
+        self.assertEqual(ORJSONRenderer().render(None), b"")
+
+
+class StudentRowListsTest(TestCase):
+    """Listes by-class / by-teacher construites depuis values() : même sortie que StudentSerializer."""
+
+    def setUp(self):
+        level = Level.objects.create(name="5e")
+        self.school_class = SchoolClass.objects.create(name="5A", level=level)
+        other_class = SchoolClass.objects.create(name="5B", level=level)
+        parent = Parent.objects.create(
+            user=User.objects.create_user(username="parent", password="pass", first_name="Koffi", email="p@x.bj"),
+            phone="+22990000000",
+        )
+        for i, (school_class, with_parent) in enumerate([
+            (self.school_class, True), (self.school_class, False), (other_class, True), (None, False),
+        ]):
+            Student.objects.create(
+                user=User.objects.create_user(username=f"s{i}", password="pass", first_name=f"P{i}", last_name=f"N{i % 2}"),
+                school_class=school_class,
+                parent=parent if with_parent else None,
+                sex="F" if i % 2 else "M",
+                date_of_birth=datetime.date(2011, 1, 1 + i),
+            )
+        self.teacher = Teacher.objects.create(user=User.objects.create_user(username="prof", password="pass"))
+        self.teacher.classes.add(self.school_class, other_class)
+        self.client = APIClient()
+
+    def expected(self, students):
+        students = students.order_by("user__last_name", "user__first_name")
+        return json.loads(json.dumps(StudentSerializer(students, many=True).data))
+
+    def test_by_class_matches_serializer(self):
+        self.client.force_authenticate(User.objects.create_superuser(username="admin", password="pass"))
+        response = self.client.get(f"/api/core/admin/students/by-class/{self.school_class.pk}/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), self.expected(Student.objects.filter(school_class=self.school_class)))
+
+    def test_by_teacher_matches_serializer(self):
+        self.client.force_authenticate(self.teacher.user)
+        response = self.client.get("/api/core/admin/students/by-teacher/")
 
-# Create your tests here.
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        rows = body["results"] if isinstance(body, dict) else body
+        self.assertEqual(rows, self.expected(Student.objects.filter(school_class__teachers=self.teacher)))
@@ -6,6 +6,7 @@ from .views import (
     TeacherViewSet,
     ProfileView,
     ParentRegisterView,
+    ParentBulkRegisterView,
     StudentRegisterView,
     TeacherRegisterView,
     DashboardStatsView,
@@ -27,6 +28,7 @@ urlpatterns = [
 
     # Routes publiques pour inscription
     path('register/parents/', ParentRegisterView.as_view(), name='register-parent'),
+    path('register/parents/bulk/', ParentBulkRegisterView.as_view(), name='register-parent-bulk'),
     path('register/students/', StudentRegisterView.as_view(), name='register-student'),
     path('register/teachers/', TeacherRegisterView.as_view(), name='register-teacher'),
     path('dashboard/stats/', DashboardStatsView.as_view(), name='dashboard-stats'),
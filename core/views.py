@@ -1,33 +1,56 @@
 import csv
 import datetime
+import hashlib
+import heapq
 import io
+import json
 import logging
+import os
+import re
+import secrets
 import time
-from collections import defaultdict
-from decimal import Decimal
+import zipfile
+import xml.etree.ElementTree as ET
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
+from statistics import fmean
 
 from django.contrib.auth import get_user_model
-from django.db import transaction
-from django.db.models import Count, Prefetch
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef, Prefetch, prefetch_related_objects
+from django.http import StreamingHttpResponse
 from django.utils.decorators import method_decorator
-from django.views.decorators.cache import cache_page
+from django.views.decorators.http import condition
 
 from django_filters.rest_framework import DjangoFilterBackend
 
-from rest_framework import viewsets, generics, status, filters
+from rest_framework import viewsets, generics, serializers, status, filters
 from rest_framework.decorators import action
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.parsers import MultiPartParser, FormParser
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt.tokens import RefreshToken
 
 from academics.models import SchoolClass, Grade, ClassSubject
-from academics.services.report_cards import compute_report_cards_from_grades
+from fees.signals import create_fees_for_students
+
+from academics.services.report_cards import (
+    cached_report_cards_from_grades,
+    compute_report_cards_from_grades,
+    report_card_values,
+    report_cards_cache_version,
+    report_cards_scope_signature,
+)
 
-from .models import Parent, Student, Teacher
+from .models import Parent, Student, Teacher, generate_parent_ids, generate_student_ids
 from .permissions import IsParentOrReadOnly, IsTeacherReadOnly
+from .renderers import ORJSONRenderer
+from .signals import DASHBOARD_STATS_CACHE_KEY, invalidate_dashboard_stats
 from .serializers import (
     ParentOptimizedReadSerializer,
     ParentOptimizedWriteSerializer,
@@ -45,6 +68,9 @@ logger = logging.getLogger(__name__)
 User = get_user_model()
 
 MAX_IMPORT_ROWS = 1_000
+STATS_CACHE_SECONDS = 300  # purgé par signaux, le TTL n'est qu'un filet de sécurité
+CACHE_SECONDS = 300
+BULK_CREATE_BATCH_SIZE = 1_000
 
 
 # ===========================================================================
@@ -79,67 +105,521 @@ def _to_int_maybe(val):
         return None
 
 
-def _get_or_create_user(payload: dict, existing_usernames: set, existing_emails: set):
+def _hash_passwords(users, raw_passwords):
+    """
+    Hache les mots de passe d'une création en masse en parallèle.
+    PBKDF2 (hashlib) relâche le GIL : un pool de threads occupe tous les
+    cœurs, sans les risques d'un fork depuis un process web.
+    """
+    if not users:
+        return
+    workers = min(len(users), os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for user, hashed in zip(users, pool.map(make_password, raw_passwords)):
+            user.password = hashed
+
+
+# Formats numériques Excel intégrés correspondant à des dates (ECMA-376 §18.8.30)
+_XLSX_BUILTIN_DATE_FORMATS = frozenset(range(14, 23)) | {45, 46, 47}
+_XLSX_NS       = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_XLSX_REL_NS   = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+_XLSX_EPOCH    = datetime.datetime(1899, 12, 30)
+
+
+def _xlsx_col_index(ref: str) -> int:
+    """'C12' -> 2 (index de colonne 0-based)."""
+    idx = 0
+    for ch in ref:
+        if not ch.isalpha():
+            break
+        idx = idx * 26 + (ord(ch.upper()) - 64)
+    return idx - 1
+
+
+def _xlsx_first_sheet_path(z) -> str:
+    """Chemin dans l'archive de la première feuille du classeur."""
+    try:
+        sheet = ET.parse(z.open("xl/workbook.xml")).getroot().find(f"{_XLSX_NS}sheets/{_XLSX_NS}sheet")
+        rid   = sheet.get(f"{_XLSX_REL_NS}id")
+        for rel in ET.parse(z.open("xl/_rels/workbook.xml.rels")).getroot():
+            if rel.get("Id") == rid:
+                target = rel.get("Target").lstrip("/")
+                return target if target.startswith("xl/") else f"xl/{target}"
+    except (KeyError, AttributeError):
+        pass
+    return "xl/worksheets/sheet1.xml"
+
+
+def _xlsx_date_styles(z) -> set:
+    """Index des styles de cellule (attribut 's') dont le format est une date."""
+    try:
+        root = ET.parse(z.open("xl/styles.xml")).getroot()
+    except KeyError:
+        return set()
+    date_fmts = set(_XLSX_BUILTIN_DATE_FORMATS)
+    for fmt in root.iterfind(f"{_XLSX_NS}numFmts/{_XLSX_NS}numFmt"):
+        code = re.sub(r'"[^"]*"|\[[^\]]*\]', "", fmt.get("formatCode", "")).lower()
+        if any(ch in code for ch in "dy") or "mm" in code:
+            date_fmts.add(int(fmt.get("numFmtId")))
+    return {
+        i for i, xf in enumerate(root.iterfind(f"{_XLSX_NS}cellXfs/{_XLSX_NS}xf"))
+        if int(xf.get("numFmtId", 0)) in date_fmts
+    }
+
+
+def _iter_xlsx_rows(fp):
+    """
+    Lit la première feuille d'un .xlsx en streaming (zipfile + iterparse)
+    et produit une liste de cellules (positionnelle) par ligne, en-tête
+    compris, sans charger le classeur entier comme openpyxl.
+
+    Valeurs : str (texte / partagé / inline), int / float (nombres),
+    bool, date / datetime (nombres au format date).
+    """
+    with zipfile.ZipFile(fp) as z:
+        shared = []
+        if "xl/sharedStrings.xml" in z.namelist():
+            for _event, elem in ET.iterparse(z.open("xl/sharedStrings.xml")):
+                if elem.tag == f"{_XLSX_NS}si":
+                    shared.append("".join(t.text or "" for t in elem.iter(f"{_XLSX_NS}t")))
+                    elem.clear()
+        date_styles = _xlsx_date_styles(z)
+
+        header_seen = False
+        last_row    = 0
+        for _event, elem in ET.iterparse(z.open(_xlsx_first_sheet_path(z))):
+            if elem.tag != f"{_XLSX_NS}row":
+                continue
+            row_num  = int(elem.get("r", last_row + 1))
+            gap      = row_num - last_row - 1
+            last_row = row_num
+
+            cells = {}
+            for pos, c in enumerate(elem.iterfind(f"{_XLSX_NS}c")):
+                ref   = c.get("r")
+                col   = _xlsx_col_index(ref) if ref else pos
+                ctype = c.get("t", "n")
+                v     = c.find(f"{_XLSX_NS}v")
+                raw   = v.text if v is not None else None
+
+                if ctype == "inlineStr":
+                    value = "".join(t.text or "" for t in c.iter(f"{_XLSX_NS}t"))
+                elif raw is None:
+                    value = None
+                elif ctype == "s":
+                    value = shared[int(raw)]
+                elif ctype == "b":
+                    value = raw == "1"
+                elif ctype in ("str", "e"):
+                    value = raw
+                else:
+                    num   = float(raw)
+                    value = int(num) if num.is_integer() else num
+                    if int(c.get("s", 0)) in date_styles:
+                        dt    = _XLSX_EPOCH + datetime.timedelta(days=num)
+                        value = dt.date() if num.is_integer() else dt
+                cells[col] = value
+            elem.clear()
+
+            if not header_seen:
+                if not cells:
+                    continue
+                header_seen = True
+            else:
+                # Lignes absentes du XML (vides) : conservées pour garder la numérotation
+                for _ in range(gap):
+                    yield []
+            row = [None] * (max(cells) + 1) if cells else []
+            for ci, cell in cells.items():
+                row[ci] = cell
+            yield row
+
+
+def _normalize_header(cells) -> list:
+    return [
+        str(h).strip().lower() if h is not None and str(h).strip() else f"col{i}"
+        for i, h in enumerate(cells)
+    ]
+
+
+def _read_import_rows(fp, filename: str):
+    """
+    Lit un fichier d'import (.csv / .txt / .xlsx) en (en-tête, lignes) :
+    en-tête normalisé (strip + minuscules), lignes positionnelles (listes),
+    sans dict par ligne.
+    `fp` : fichier binaire positionnable (upload Django, fichier ouvert en
+    "rb") lu en flux — le contenu n'est jamais chargé d'un bloc en mémoire.
+    La lecture s'arrête au-delà de MAX_IMPORT_ROWS (contrôle fait par l'appelant).
+    Lève ValueError si le format n'est pas supporté.
     """
-    Récupère ou crée un User à partir du payload.
+    name = filename.lower()
+
+    if name.endswith((".csv", ".txt")):
+        # Décodage incrémental ; une erreur d'encodage en cours de fichier
+        # relance la lecture depuis le début avec l'encodage suivant.
+        for encoding, errors in (("utf-8-sig", "strict"), ("cp1252", "strict"), ("utf-8", "ignore")):
+            fp.seek(0)
+            text = io.TextIOWrapper(fp, encoding=encoding, errors=errors, newline="")
+            try:
+                return _collect_import_rows(csv.reader(text), skip_empty=True)
+            except UnicodeDecodeError:
+                continue
+            finally:
+                # Rend `fp` à l'appelant sans le fermer
+                text.detach()
+    if name.endswith(".xlsx"):
+        return _collect_import_rows(_iter_xlsx_rows(fp), skip_empty=False)
+    raise ValueError("Format non supporté. Utilisez .csv ou .xlsx.")
+
+
+def _collect_import_rows(it, skip_empty):
+    """En-tête normalisé + lignes de `it`, jusqu'à MAX_IMPORT_ROWS + 1."""
+    header = _normalize_header(next(it, []))
+    rows   = []
+    for row in it:
+        # csv.DictReader ignorait les lignes vides : même comportement
+        if not row and skip_empty:
+            continue
+        rows.append(row)
+        if len(rows) > MAX_IMPORT_ROWS:
+            break
+    return header, rows
 
-    Les sets `existing_usernames` et `existing_emails` sont pré-chargés avant
-    la boucle d'import pour éviter les requêtes N+1 de vérification d'unicité.
-    Les nouveaux usernames créés sont ajoutés aux sets en mémoire afin que les
-    lignes suivantes du même import en tiennent compte.
 
-    Retourne (user, created: bool)
+def _import_column_getter(header):
+    """
+    Construit g(row, *noms) : valeur de la première colonne non vide parmi
+    `noms` (équivalent de r.get(a) or r.get(b) ... sur un dict), par index.
     """
-    username  = (payload.get("username") or "").strip() or None
-    email     = (payload.get("email") or "").strip() or None
-    first     = (payload.get("first_name") or "").strip()
-    last      = (payload.get("last_name") or "").strip()
-    password  = payload.get("password") or None
+    index = {}
+    for i, name in enumerate(header):
+        index.setdefault(name, i)
+
+    def get(row, *names):
+        for name in names:
+            i = index.get(name)
+            if i is not None and i < len(row) and row[i]:
+                return row[i]
+        return None
 
-    # 1) Recherche par username
-    user = User.objects.filter(username=username).first() if username else None
+    return get
 
-    # 2) Fallback par email
-    if not user and email:
-        user = User.objects.filter(email=email).first()
 
-    # 3) Mise à jour non-destructive si l'utilisateur existe déjà
-    if user:
-        changed = False
-        for attr, new_val in [("first_name", first), ("last_name", last), ("email", email)]:
-            if new_val and getattr(user, attr) != new_val:
-                setattr(user, attr, new_val)
-                changed = True
-        if changed:
-            user.save(update_fields=["first_name", "last_name", "email"])
-        return user, False
+def _student_field_errors(dob, sex, school_class_id, parent_id, valid_class_ids, valid_parent_ids, fields):
+    """
+    Valide les champs élève d'une ligne sans toucher la DB (les ids de
+    classes / parents valides sont pré-chargés) et renvoie
+    (valeurs validées, erreurs) avec les mêmes messages que StudentSerializer.
+    `fields` : StudentSerializer().fields, construit une fois par import.
+    """
+    values, errors = {}, {}
+
+    for name, raw in (("date_of_birth", dob or None), ("sex", sex)):
+        try:
+            values[name] = fields[name].run_validation(raw)
+        except serializers.ValidationError as exc:
+            errors[name] = exc.detail
 
-    # 4) Création — résolution de collision de username en mémoire
-    if not username:
+    for name, pk, valid_ids in (
+        ("school_class_id", school_class_id, valid_class_ids),
+        ("parent_id", parent_id, valid_parent_ids),
+    ):
+        if pk is not None and str(pk) not in valid_ids:
+            errors[name] = [fields[name].error_messages["does_not_exist"].format(pk_value=pk)]
+
+    return values, errors
+
+
+def _iter_student_import(header, rows):
+    """
+    Importe des lignes CSV/XLSX déjà lues (voir _read_import_rows) en élèves.
+
+    Trois passes :
+      1. normalisation + validation en mémoire, les lookups (users existants,
+         classes, parents) étant pré-chargés en quelques requêtes ;
+      2. résolution des users ligne par ligne, dans l'ordre du fichier, pour
+         que les lignes suivantes voient les users prévus par les précédentes ;
+      3. écriture en lot (bulk_update / bulk_create) dans une seule transaction ;
+         les élèves déjà existants sont mis à jour (upsert sur user).
+
+    Une ligne invalide n'écrit rien (ni user, ni mise à jour de user).
+    Générateur : produit le résultat de chaque ligne dès qu'il est connu
+    (rejets pendant les passes 1-2, succès après l'écriture de la passe 3),
+    donc pas dans l'ordre du fichier — chaque résultat porte son n° de ligne.
+    """
+    parsed = []
+    g      = _import_column_getter(header)
+
+    # --- Passe 1 : normalisation ---
+    for idx, r in enumerate(rows, start=1):
+        warnings = []
+
+        first_name      = _norm_cell(g(r, "first_name", "firstname", "prénom", "prenom"))
+        last_name       = _norm_cell(g(r, "last_name", "lastname", "nom"))
+        email           = _norm_cell(g(r, "email"))
+        dob             = _norm_cell(g(r, "date_of_birth", "dob", "date"))
+        sex_raw         = _norm_cell(g(r, "sex", "gender"))
+        sex             = sex_raw.upper()[:1] if sex_raw else ""
+        school_class_id = _to_int_maybe(g(r, "school_class", "school_class_id", "class"))
+        parent_id       = _to_int_maybe(g(r, "parent_id", "parent"))
+        password        = _norm_cell(g(r, "password", "passwd")) or None
+
+        # Validation minimale — rejet immédiat sans toucher la DB
+        if not first_name and not last_name:
+            yield {
+                "row": idx,
+                "success": False,
+                "error": "first_name et last_name sont tous les deux vides.",
+            }
+            continue
+
+        # Warnings non-bloquants
+        if not sex:
+            warnings.append("Champ 'sex' absent ou vide → valeur par défaut 'M' utilisée.")
+            sex = "M"
+        if not dob:
+            warnings.append("Champ 'date_of_birth' absent.")
+
+        # Construction du username
         if email:
             username = email.split("@")[0]
         else:
-            username = f"{first}.{last}".lower().replace(" ", ".").strip(".") or f"user_{int(time.time())}"
-
-    base = username
-    suffix = 0
-    while username in existing_usernames:
-        suffix += 1
-        username = f"{base}{suffix}"
-
-    # Mise à jour immédiate des sets pour les lignes suivantes du même import
-    existing_usernames.add(username)
-    if email:
-        existing_emails.add(email)
-
-    user = User.objects.create_user(
-        username=username,
-        email=email or "",
-        password=password or User.objects.make_random_password(),
-        first_name=first,
-        last_name=last,
+            username = f"{first_name}.{last_name}".lower().replace(" ", ".").strip(".")
+            if not username:
+                username = f"user{idx}"
+
+        parsed.append({
+            "idx": idx, "warnings": warnings,
+            "username": username, "email": email,
+            "first_name": first_name, "last_name": last_name, "password": password,
+            "dob": dob, "sex": sex, "sex_given": bool(sex_raw),
+            "school_class_id": school_class_id, "parent_id": parent_id,
+        })
+
+    # --- Pré-chargements (une requête chacun) ---
+    usernames = {p["username"] for p in parsed}
+    emails    = {p["email"] for p in parsed if p["email"]}
+
+    users_by_username = User.objects.filter(username__in=usernames).in_bulk(field_name="username")
+    users_by_email = {}
+    for u in User.objects.filter(email__in=emails).order_by("pk"):
+        users_by_email.setdefault(u.email, u)
+
+    # Usernames déjà pris parmi les candidats : déjà hydratés ci-dessus,
+    # pas de scan complet de la table User
+    existing_usernames = set(users_by_username)
+    probed_bases       = set()
+    valid_class_ids = {
+        str(pk) for pk in SchoolClass.objects.filter(
+            pk__in={p["school_class_id"] for p in parsed if p["school_class_id"] is not None}
+        ).values_list("pk", flat=True)
+    }
+    valid_parent_ids = set(
+        Parent.objects.filter(
+            pk__in={str(p["parent_id"]) for p in parsed if p["parent_id"] is not None}
+        ).values_list("pk", flat=True)
     )
-    return user, True
+    # Élèves existants des users connus : une ré-importation les met à jour (upsert)
+    user_ids = {u.pk for u in users_by_username.values()} | {u.pk for u in users_by_email.values()}
+    existing_students = {
+        user_id: current
+        for user_id, *current in Student.objects.filter(user_id__in=user_ids).values_list(
+            "user_id", "id", "school_class_id", "parent_id", "sex"
+        )
+    }
+    # Users déjà pris par une ligne précédente du fichier
+    claimed_usernames = set()
+    # Champs du serializer construits une fois pour tout l'import
+    student_fields = StudentSerializer().fields
+
+    # --- Passe 2 : résolution des users + validation des champs élève ---
+    new_users     = []
+    new_passwords = []   # hachés en lot après la passe 2
+    updated_users = {}
+    planned       = []   # (ligne, user, valeurs élève validées)
+
+    for p in parsed:
+        idx, warnings, username = p["idx"], p["warnings"], p["username"]
+        extra = {"warnings": warnings} if warnings else {}
+
+        values, errors = _student_field_errors(
+            p["dob"], p["sex"], p["school_class_id"], p["parent_id"],
+            valid_class_ids, valid_parent_ids, student_fields,
+        )
+        if errors:
+            yield {"row": idx, "success": False, "error": errors, "username": username, **extra}
+            continue
+
+        user = users_by_username.get(username) or (users_by_email.get(p["email"]) if p["email"] else None)
+
+        if user is not None:
+            if user.username in claimed_usernames:
+                yield {
+                    "row": idx, "success": False,
+                    "error": "Cet utilisateur est déjà rattaché à un élève.",
+                    "username": username, **extra,
+                }
+                continue
+            # Mise à jour non-destructive de l'utilisateur existant
+            for attr, new_val in (("first_name", p["first_name"]), ("last_name", p["last_name"]), ("email", p["email"])):
+                if new_val and getattr(user, attr) != new_val:
+                    setattr(user, attr, new_val)
+                    if user.pk:
+                        updated_users[user.pk] = user
+        else:
+            # Création — résolution de collision de username en mémoire
+            base, suffix = username, 0
+            if base in existing_usernames and base not in probed_bases:
+                # Collision (rare) : charger une fois les variantes suffixées de la base
+                existing_usernames.update(
+                    User.objects.filter(username__startswith=base).values_list("username", flat=True)
+                )
+                probed_bases.add(base)
+            while username in existing_usernames:
+                suffix += 1
+                username = f"{base}{suffix}"
+            existing_usernames.add(username)
+
+            user = User(
+                username=username,
+                email=p["email"],
+                first_name=p["first_name"],
+                last_name=p["last_name"],
+            )
+            new_users.append(user)
+            new_passwords.append(p["password"] or secrets.token_urlsafe(12))
+            # Les lignes suivantes du même fichier retrouvent ce user
+            users_by_username[username] = user
+            if p["email"]:
+                users_by_email.setdefault(p["email"], user)
+
+        claimed_usernames.add(user.username)
+        planned.append((p, user, values))
+
+    # --- Passe 3 : écriture en lot ---
+    _hash_passwords(new_users, new_passwords)
+    if planned:
+        try:
+            with transaction.atomic():
+                if updated_users:
+                    User.objects.bulk_update(
+                        list(updated_users.values()),
+                        ["first_name", "last_name", "email"],
+                        batch_size=BULK_CREATE_BATCH_SIZE,
+                    )
+
+                # ON CONFLICT DO NOTHING : un username pris entre-temps (import
+                # concurrent) ne fait pas échouer le lot. Les PK ne sont pas
+                # renvoyées ; on les relit, en vérifiant via le hash du mot de
+                # passe (salé, donc unique) que la ligne est bien la nôtre.
+                lost = set()
+                if new_users:
+                    User.objects.bulk_create(new_users, batch_size=BULK_CREATE_BATCH_SIZE, ignore_conflicts=True)
+                    inserted = {
+                        username: (pk, password)
+                        for username, pk, password in User.objects.filter(
+                            username__in=[u.username for u in new_users]
+                        ).values_list("username", "pk", "password")
+                    }
+                    for u in new_users:
+                        pk, password = inserted.get(u.username, (None, None))
+                        if password == u.password:
+                            u.pk = pk
+                            u._state.adding = False
+                        else:
+                            lost.add(u.username)
+
+                kept = [(p, user, values) for p, user, values in planned if user.username not in lost]
+                new_ids = iter(generate_student_ids(
+                    sum(1 for _p, user, _v in kept if user.pk not in existing_students)
+                ))
+
+                # Student.save() n'est pas appelé : noms recopiés depuis le user.
+                # Upsert sur user : une ré-importation met à jour l'élève existant,
+                # sans effacer sa classe / son parent / son sexe quand la colonne est vide.
+                students = []
+                for p, user, values in kept:
+                    student_id, class_id, parent_id, sex = existing_students.get(user.pk) or (
+                        next(new_ids), None, None, None
+                    )
+                    if p["school_class_id"] is not None:
+                        class_id = p["school_class_id"]
+                    if p["parent_id"] is not None:
+                        parent_id = str(p["parent_id"])
+                    if p["sex_given"] or sex is None:
+                        sex = values["sex"]
+                    students.append(Student(
+                        id=student_id,
+                        user=user,
+                        first_name=user.first_name,
+                        last_name=user.last_name,
+                        date_of_birth=values["date_of_birth"],
+                        sex=sex,
+                        school_class_id=class_id,
+                        parent_id=parent_id,
+                    ))
+                Student.objects.bulk_create(
+                    students,
+                    batch_size=BULK_CREATE_BATCH_SIZE,
+                    update_conflicts=True,
+                    unique_fields=["user"],
+                    update_fields=[
+                        "first_name", "last_name", "date_of_birth", "sex", "school_class", "parent",
+                    ],
+                )
+                # bulk_create ne déclenche pas post_save : frais (y compris ceux d'un
+                # éventuel nouveau niveau) et stats gérés explicitement
+                create_fees_for_students(students)
+                transaction.on_commit(invalidate_dashboard_stats)
+        except Exception as exc:
+            logger.exception("Import CSV — écriture en lot : %s", exc)
+            for p, _user, _values in planned:
+                yield {
+                    "row": p["idx"], "success": False, "error": str(exc), "username": p["username"],
+                    **({"warnings": p["warnings"]} if p["warnings"] else {}),
+                }
+        else:
+            for p, user, _values in planned:
+                if user.username in lost:
+                    yield {
+                        "row": p["idx"], "success": False,
+                        "error": f"Le nom d'utilisateur « {user.username} » a été pris entre-temps.",
+                        "username": p["username"],
+                        **({"warnings": p["warnings"]} if p["warnings"] else {}),
+                    }
+            for (p, user, _values), student in zip(kept, students):
+                yield {
+                    "row":        p["idx"],
+                    "success":    True,
+                    "student_id": student.id,
+                    "username":   user.username,
+                    "updated":    user.pk in existing_students,
+                    **({"warnings": p["warnings"]} if p["warnings"] else {}),
+                }
+
+
+def _ndjson_import_stream(header, rows):
+    """
+    Flux NDJSON d'un import : une ligne JSON par résultat, puis une ligne
+    de synthèse { total_rows, success_count, error_count }.
+    """
+    success_count = error_count = 0
+    for result in _iter_student_import(header, rows):
+        if result["success"]:
+            success_count += 1
+        else:
+            error_count += 1
+        yield json.dumps(result, ensure_ascii=False, default=str) + "\n"
+    yield json.dumps({
+        "total_rows":    len(rows),
+        "success_count": success_count,
+        "error_count":   error_count,
+    }) + "\n"
+
+
+def _import_student_rows(header, rows):
+    """Importe les lignes et retourne la liste des résultats, dans l'ordre du fichier."""
+    return sorted(_iter_student_import(header, rows), key=itemgetter("row"))
 
 
 # ===========================================================================
@@ -152,6 +632,50 @@ class StandardResultsSetPagination(PageNumberPagination):
     max_page_size = 100
 
 
+# Colonnes lues par _student_row (actions en lecture seule de StudentViewSet)
+_STUDENT_ROW_FIELDS = (
+    "id", "sex", "date_of_birth",
+    "user_id", "user__username", "user__first_name", "user__last_name", "user__email",
+    "school_class_id", "school_class__name", "school_class__level_id",
+    "parent_id", "parent__phone",
+    "parent__user__username", "parent__user__first_name", "parent__user__last_name", "parent__user__email",
+)
+
+
+def _student_row(s):
+    """
+    Même forme que StudentSerializer, construite depuis une ligne values()
+    sans instancier de serializer par élève.
+    """
+    return {
+        "id": s["id"],
+        "user": {
+            "id":         s["user_id"],
+            "username":   s["user__username"],
+            "first_name": s["user__first_name"],
+            "last_name":  s["user__last_name"],
+            "email":      s["user__email"],
+        },
+        "sex":           s["sex"],
+        "date_of_birth": s["date_of_birth"].isoformat() if s["date_of_birth"] else None,
+        "school_class": {
+            "id":    s["school_class_id"],
+            "name":  s["school_class__name"],
+            "level": s["school_class__level_id"],
+        } if s["school_class_id"] is not None else None,
+        "parent": {
+            "id": s["parent_id"],
+            "user": {
+                "username":   s["parent__user__username"],
+                "first_name": s["parent__user__first_name"],
+                "last_name":  s["parent__user__last_name"],
+                "email":      s["parent__user__email"],
+            },
+            "phone": s["parent__phone"],
+        } if s["parent_id"] is not None else None,
+    }
+
+
 # ===========================================================================
 # StudentViewSet
 # ===========================================================================
@@ -181,8 +705,12 @@ class StudentViewSet(viewsets.ModelViewSet):
         if hasattr(user, "student"):
             return queryset.filter(user=user)
         if hasattr(user, "teacher"):
-            class_ids = user.teacher.classes.values_list("id", flat=True)
-            return queryset.filter(school_class_id__in=class_ids).distinct()
+            # EXISTS corrélé sur la table M2M : ni sous-requête IN ni DISTINCT
+            teaches_class = Teacher.classes.through.objects.filter(
+                teacher_id=user.teacher.pk,
+                schoolclass_id=OuterRef("school_class_id"),
+            )
+            return queryset.filter(Exists(teaches_class))
 
         return queryset.none()
 
@@ -206,7 +734,7 @@ class StudentViewSet(viewsets.ModelViewSet):
     def import_csv(self, request):
         """
         POST /api/core/admin/students/import-csv/
-        Champ multipart : 'file' (.csv / .txt / .xlsx / .xls)
+        Champ multipart : 'file' (.csv / .txt / .xlsx)
 
         Réponse :
         {
@@ -217,64 +745,31 @@ class StudentViewSet(viewsets.ModelViewSet):
                 {
                     "row":        int,
                     "success":    bool,
-                    "student_id": int,       # si succès
-                    "username":   str,       # si succès
+                    "student_id": str,       # si succès
+                    "username":   str,
+                    "updated":    bool,      # si succès : élève existant mis à jour
                     "warnings":   [str],     # optionnel
                     "error":      str        # si échec
                 }
             ]
         }
+
+        Avec ?stream=1 : réponse NDJSON en flux
+        (application/x-ndjson) — une ligne par résultat au fur et à mesure,
+        puis une ligne de synthèse { total_rows, success_count, error_count }.
         """
         uploaded = request.FILES.get("file")
         if not uploaded:
             return Response({"detail": "Aucun fichier envoyé."}, status=400)
 
-        rows = []
-        name = uploaded.name.lower()
+        if not uploaded.name.lower().endswith((".csv", ".txt", ".xlsx")):
+            return Response(
+                {"detail": "Format non supporté. Utilisez .csv ou .xlsx."},
+                status=400,
+            )
 
-        # --- Lecture du fichier ---
         try:
-            if name.endswith((".csv", ".txt")):
-                raw = uploaded.read()
-                text = None
-                for encoding in ("utf-8-sig", "cp1252"):
-                    try:
-                        text = raw.decode(encoding)
-                        break
-                    except UnicodeDecodeError:
-                        continue
-                if text is None:
-                    text = raw.decode("utf-8", errors="ignore")
-                rows = list(csv.DictReader(io.StringIO(text)))
-
-            elif name.endswith((".xlsx", ".xls")):
-                try:
-                    import openpyxl
-                except ImportError:
-                    return Response(
-                        {"detail": "openpyxl est requis pour lire les fichiers xlsx. Installez le package."},
-                        status=500,
-                    )
-                wb = openpyxl.load_workbook(uploaded, read_only=True, data_only=True)
-                ws = wb.active
-                it = ws.iter_rows(values_only=True)
-                header_row = next(it, None)
-                if not header_row:
-                    return Response({"detail": "Fichier Excel vide."}, status=400)
-                header = [
-                    str(h).strip() if h is not None else f"col{i}"
-                    for i, h in enumerate(header_row)
-                ]
-                for row in it:
-                    rows.append({
-                        header[ci] if ci < len(header) else f"col{ci}": cell
-                        for ci, cell in enumerate(row)
-                    })
-            else:
-                return Response(
-                    {"detail": "Format non supporté. Utilisez .csv ou .xlsx."},
-                    status=400,
-                )
+            header, rows = _read_import_rows(uploaded, uploaded.name)
         except Exception as exc:
             logger.exception("Erreur lecture fichier : %s", exc)
             return Response({"detail": f"Erreur lecture fichier : {exc}"}, status=400)
@@ -286,93 +781,10 @@ class StudentViewSet(viewsets.ModelViewSet):
                 status=400,
             )
 
-        # --- Pré-chargement des usernames / emails pour éviter N+1 ---
-        existing_usernames: set = set(User.objects.values_list("username", flat=True))
-        existing_emails: set    = set(User.objects.filter(email__gt="").values_list("email", flat=True))
-
-        # --- Traitement ligne par ligne ---
-        results = []
-
-        for idx, r in enumerate(rows, start=1):
-            warnings = []
-
-            first_name      = _norm_cell(r.get("first_name") or r.get("firstname") or r.get("prénom") or r.get("prenom"))
-            last_name       = _norm_cell(r.get("last_name")  or r.get("lastname")  or r.get("nom"))
-            email           = _norm_cell(r.get("email") or "")
-            dob             = _norm_cell(r.get("date_of_birth") or r.get("dob") or r.get("date") or "")
-            sex_raw         = _norm_cell(r.get("sex") or r.get("gender") or "")
-            sex             = sex_raw.upper()[:1] if sex_raw else ""
-            school_class_id = _to_int_maybe(r.get("school_class") or r.get("school_class_id") or r.get("class"))
-            parent_id       = _to_int_maybe(r.get("parent_id") or r.get("parent"))
-            password        = _norm_cell(r.get("password") or r.get("passwd") or "") or None
-
-            # Validation minimale — rejet immédiat sans toucher la DB
-            if not first_name and not last_name:
-                results.append({
-                    "row": idx,
-                    "success": False,
-                    "error": "first_name et last_name sont tous les deux vides.",
-                })
-                continue
-
-            # Warnings non-bloquants
-            if not sex:
-                warnings.append("Champ 'sex' absent ou vide → valeur par défaut 'M' utilisée.")
-                sex = "M"
-            if not dob:
-                warnings.append("Champ 'date_of_birth' absent.")
-
-            # Construction du username
-            if email:
-                username = email.split("@")[0]
-            else:
-                username = f"{first_name}.{last_name}".lower().replace(" ", ".").strip(".")
-                if not username:
-                    username = f"user{idx}"
-
-            user_payload = {
-                "username":   username,
-                "email":      email,
-                "first_name": first_name,
-                "last_name":  last_name,
-                "password":   password,
-            }
-
-            # Transaction atomique par ligne
-            try:
-                with transaction.atomic():
-                    user_obj, _created = _get_or_create_user(
-                        user_payload, existing_usernames, existing_emails
-                    )
-                    student_payload = {
-                        "user_id":        user_obj.id,
-                        "date_of_birth":  dob or None,
-                        "sex":            sex,
-                        "school_class_id": school_class_id,
-                        "parent_id":      parent_id,
-                    }
-                    serializer = StudentSerializer(data=student_payload)
-                    serializer.is_valid(raise_exception=True)
-                    student = serializer.save()
-
-                results.append({
-                    "row":        idx,
-                    "success":    True,
-                    "student_id": student.id,
-                    "username":   student.user.username,
-                    **({"warnings": warnings} if warnings else {}),
-                })
-
-            except Exception as exc:
-                logger.exception("Import CSV — ligne %s : %s", idx, exc)
-                results.append({
-                    "row":      idx,
-                    "success":  False,
-                    "error":    getattr(exc, "detail", None) or str(exc),
-                    "username": username,
-                    **({"warnings": warnings} if warnings else {}),
-                })
+        if request.query_params.get("stream") in ("1", "true"):
+            return StreamingHttpResponse(_ndjson_import_stream(header, rows), content_type="application/x-ndjson")
 
+        results = _import_student_rows(header, rows)
         success_count = sum(1 for r in results if r["success"])
 
         return Response(
@@ -389,28 +801,31 @@ class StudentViewSet(viewsets.ModelViewSet):
     # Actions supplémentaires
     # -----------------------------------------------------------------------
 
-    @action(detail=False, methods=["get"], url_path=r"by-class/(?P<class_id>[^/.]+)")
+    @action(detail=False, methods=["get"], url_path=r"by-class/(?P<class_id>\d+)")
     def by_class(self, request, class_id=None):
+        class_id = int(class_id)
         students = (
             self.get_queryset()
             .filter(school_class_id=class_id)
             .order_by("user__last_name", "user__first_name")
+            .values(*_STUDENT_ROW_FIELDS)
         )
-        serializer = self.get_serializer(students, many=True)
-        return Response(serializer.data)
+        return Response([_student_row(s) for s in students])
 
     @action(detail=False, methods=["get"], url_path="by-teacher")
     def by_teacher(self, request):
         if not hasattr(request.user, "teacher"):
             return Response({"detail": "Vous n'êtes pas un enseignant."}, status=403)
 
-        students = self.get_queryset().order_by("user__last_name", "user__first_name")
+        students = (
+            self.get_queryset()
+            .order_by("user__last_name", "user__first_name")
+            .values(*_STUDENT_ROW_FIELDS)
+        )
         page = self.paginate_queryset(students)
         if page is not None:
-            serializer = self.get_serializer(page, many=True)
-            return self.get_paginated_response(serializer.data)
-        serializer = self.get_serializer(students, many=True)
-        return Response(serializer.data)
+            return self.get_paginated_response([_student_row(s) for s in page])
+        return Response([_student_row(s) for s in students])
 
 
 # ===========================================================================
@@ -451,11 +866,15 @@ class ParentViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         user = self.request.user
+        # StudentInParentSerializer n'expose que quelques colonnes : on ne
+        # charge que celles-ci (+ les FK nécessaires au prefetch/select_related).
+        students_qs = Student.objects.select_related("user", "school_class").only(
+            "id", "parent", "user", "school_class", "sex", "date_of_birth",
+            "user__username", "user__first_name", "user__last_name", "user__email",
+            "school_class__name", "school_class__level",
+        )
         base_qs = Parent.objects.select_related("user").prefetch_related(
-            Prefetch(
-                "students",
-                queryset=Student.objects.select_related("user", "school_class").all(),
-            )
+            Prefetch("students", queryset=students_qs)
         )
 
         if user.is_staff or user.is_superuser:
@@ -608,31 +1027,39 @@ class TeacherViewSet(viewsets.ModelViewSet):
         serializer = TeacherFullSerializer(teacher, context={"request": request})
         return Response(serializer.data, status=status.HTTP_200_OK)
 
-    @action(detail=False, methods=["get"], url_path=r"by-class/(?P<class_id>[^/.]+)")
+    @action(detail=False, methods=["get"], url_path=r"by-class/(?P<class_id>\d+)")
     def by_class(self, request, class_id=None):
+        class_id = int(class_id)
         user = request.user
-        try:
-            school_class = SchoolClass.objects.get(id=class_id)
-        except SchoolClass.DoesNotExist:
-            return Response({"detail": "Classe introuvable."}, status=404)
 
         if user.is_staff or user.is_superuser:
-            teachers = school_class.teachers.all().distinct()
+            if not SchoolClass.objects.filter(id=class_id).exists():
+                return Response({"detail": "Classe introuvable."}, status=404)
         elif hasattr(user, "teacher"):
-            if not user.teacher.classes.filter(id=class_id).exists():
+            # Classes du prof chargées une fois : sert aussi de test d'existence
+            teacher_class_ids = set(user.teacher.classes.values_list("id", flat=True))
+            if class_id not in teacher_class_ids:
+                if not SchoolClass.objects.filter(id=class_id).exists():
+                    return Response({"detail": "Classe introuvable."}, status=404)
                 return Response({"detail": "Vous n'enseignez pas dans cette classe."}, status=403)
-            teachers = school_class.teachers.all().distinct()
         else:
             return Response({"detail": "Accès non autorisé."}, status=403)
 
-        serializer = self.get_serializer(teachers.prefetch_related("classes"), many=True)
+        # Une ligne M2M par (prof, classe) : pas de doublons, donc pas de distinct()
+        teachers = (
+            Teacher.objects
+            .filter(classes__id=class_id)
+            .select_related("user", "subject")
+            .prefetch_related(Prefetch("classes", queryset=SchoolClass.objects.only("id", "name", "level_id")))
+        )
+        serializer = self.get_serializer(teachers, many=True)
         return Response(serializer.data)
 
-    @action(detail=False, methods=["get"], url_path=r"by-level/(?P<level_id>[^/.]+)")
+    @action(detail=False, methods=["get"], url_path=r"by-level/(?P<level_id>\d+)")
     def by_level(self, request, level_id=None):
         if not (request.user.is_staff or request.user.is_superuser):
             return Response({"detail": "Accès refusé."}, status=403)
-        teachers = Teacher.objects.filter(classes__level_id=level_id).distinct()
+        teachers = Teacher.objects.filter(classes__level_id=int(level_id)).distinct()
         serializer = self.get_serializer(teachers, many=True)
         return Response(serializer.data)
 
@@ -648,7 +1075,8 @@ class ParentRegisterView(generics.CreateAPIView):
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        parent = serializer.save()
+        with transaction.atomic():
+            parent = serializer.save()
         refresh = RefreshToken.for_user(parent.user)
         return Response({
             "parent_id": parent.id,
@@ -657,6 +1085,76 @@ class ParentRegisterView(generics.CreateAPIView):
         }, status=status.HTTP_201_CREATED)
 
 
+class ParentBulkRegisterView(generics.CreateAPIView):
+    """
+    Inscription en masse de parents (admin).
+    Reçoit une liste : [{"user": {...}, "phone": "..."}, ...]
+
+    Les User puis les Parent sont insérés par lots (bulk_create) dans une
+    seule transaction ; Parent.save() n'étant pas appelé, les noms sont
+    recopiés explicitement depuis le User.
+    """
+    serializer_class = ParentOptimizedWriteSerializer
+    permission_classes = [IsAuthenticated, IsAdminUser]
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        rows = serializer.validated_data
+
+        username_counts = Counter(row["user"]["username"] for row in rows)
+        duplicates = sorted(u for u, n in username_counts.items() if n > 1)
+        if duplicates:
+            return Response(
+                {"detail": f"Usernames en double dans la requête : {duplicates}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        missing_password = [i for i, row in enumerate(rows) if not row["user"].get("password")]
+        if missing_password:
+            return Response(
+                {"detail": f"Mot de passe requis (lignes {missing_password})."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        new_users, passwords = [], []
+        for row in rows:
+            user_data = dict(row["user"])
+            passwords.append(user_data.pop("password"))
+            new_users.append(User(**user_data))
+        _hash_passwords(new_users, passwords)
+
+        with transaction.atomic():
+            users = User.objects.bulk_create(new_users, batch_size=BULK_CREATE_BATCH_SIZE)
+            # IDs tirés en lot : ni requête d'unicité par ligne (défaut
+            # generate_parent_id), ni collision entre lignes d'un même lot
+            parents = Parent.objects.bulk_create(
+                [
+                    Parent(
+                        id=parent_id,
+                        user=user,
+                        first_name=user.first_name,
+                        last_name=user.last_name,
+                        phone=row.get("phone"),
+                    )
+                    for parent_id, user, row in zip(generate_parent_ids(len(users)), users, rows)
+                ],
+                batch_size=BULK_CREATE_BATCH_SIZE,
+            )
+            # bulk_create ne déclenche pas post_save
+            transaction.on_commit(invalidate_dashboard_stats)
+
+        results = []
+        for parent in parents:
+            refresh = RefreshToken.for_user(parent.user)
+            results.append({
+                "parent_id": parent.id,
+                "username":  parent.user.username,
+                "refresh":   str(refresh),
+                "access":    str(refresh.access_token),
+            })
+        return Response(results, status=status.HTTP_201_CREATED)
+
+
 class StudentRegisterView(generics.CreateAPIView):
     serializer_class = StudentSerializer
     permission_classes = [AllowAny]
@@ -664,7 +1162,8 @@ class StudentRegisterView(generics.CreateAPIView):
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        student = serializer.save()
+        with transaction.atomic():
+            student = serializer.save()
         refresh = RefreshToken.for_user(student.user)
         return Response({
             "student_id": student.id,
@@ -680,7 +1179,8 @@ class TeacherRegisterView(generics.CreateAPIView):
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        teacher = serializer.save()
+        with transaction.atomic():
+            teacher = serializer.save()
         refresh = RefreshToken.for_user(teacher.user)
         return Response({
             "teacher_id": teacher.id,
@@ -697,14 +1197,28 @@ class ProfileView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
+        # Les trois profils (reverse OneToOne) sont déjà joints au user par
+        # RoleAwareJWTAuthentication : la détection du rôle ne coûte aucune
+        # requête, on ne charge ensuite que ce dont le profil trouvé a besoin.
         user = request.user
 
-        if hasattr(user, "parent"):
-            return Response(ParentProfileSerializer(user.parent).data)
-        if hasattr(user, "student"):
-            return Response(StudentProfileSerializer(user.student).data)
-        if hasattr(user, "teacher"):
-            return Response(TeacherSerializer(user.teacher).data)
+        parent = getattr(user, "parent", None)
+        if parent is not None:
+            prefetch_related_objects(
+                [parent],
+                Prefetch("students", queryset=Student.objects.select_related("user", "school_class")),
+            )
+            return Response(ParentProfileSerializer(parent).data)
+        student = getattr(user, "student", None)
+        if student is not None:
+            student = Student.objects.select_related(
+                "user", "school_class", "parent__user",
+            ).get(pk=student.pk)
+            return Response(StudentProfileSerializer(student).data)
+        teacher = getattr(user, "teacher", None)
+        if teacher is not None:
+            prefetch_related_objects([teacher], "subject", "classes")
+            return Response(TeacherSerializer(teacher).data)
 
         return Response({"detail": "Aucun profil associé à cet utilisateur."}, status=404)
 
@@ -713,50 +1227,220 @@ class ProfileView(APIView):
 # Dashboard — statistiques générales
 # ===========================================================================
 
-# ===========================================================================
-# Dashboard — statistiques générales
-# ===========================================================================
+def _dashboard_etag(ttl, *parts):
+    """
+    ETag grossier pour les dashboards : dérivé des paramètres de la requête
+    et d'une fenêtre temporelle de `ttl` secondes, pour qu'un ETag n'expire
+    jamais moins souvent que le cache correspondant.
+    """
+    window = int(time.time() // ttl)
+    raw = ":".join(str(p) for p in (window, *parts))
+    return hashlib.md5(raw.encode()).hexdigest()
 
-class DashboardStatsView(APIView):
-    permission_classes = [IsAuthenticated]
 
-    @method_decorator(cache_page(60))  # 30 s → 60 s, stats globales peu volatiles
-    def get(self, request):
-        # ✅ Un seul aggregate() au lieu de 3 .count() séparés
-        counts = User.objects.aggregate(
-            students_count=Count("student", distinct=True),
-            teachers_count=Count("teacher", distinct=True),
-            parents_count=Count("parent", distinct=True),
-        )
+def _dashboard_stats_sql():
+    """
+    Requête unique (UNION ALL, SQL portable SQLite / PostgreSQL / MySQL) :
+    une ligne par compteur, par sexe et par classe du top 8.
+    Colonnes : (kind, key, label, value).
+    """
+    student = Student._meta.db_table
+    teacher = Teacher._meta.db_table
+    parent  = Parent._meta.db_table
+    klass   = SchoolClass._meta.db_table
+    return f"""
+        SELECT 'count' AS kind, 'students_count' AS k, NULL AS label, COUNT(*) AS value FROM {student}
+        UNION ALL
+        SELECT 'count', 'teachers_count', NULL, COUNT(*) FROM {teacher}
+        UNION ALL
+        SELECT 'count', 'parents_count', NULL, COUNT(*) FROM {parent}
+        UNION ALL
+        SELECT 'sex', sex, NULL, COUNT(*) FROM {student} GROUP BY sex
+        UNION ALL
+        SELECT * FROM (
+            SELECT 'class', CAST(c.id AS VARCHAR(20)), c.name, COUNT(s.id) AS cnt
+            FROM {klass} c
+            LEFT JOIN {student} s ON s.school_class_id = c.id
+            GROUP BY c.id, c.name
+            ORDER BY cnt DESC, c.id
+            LIMIT 8
+        ) top_classes
+    """
+
+
+def _build_dashboard_stats():
+    # ✅ Un seul aller-retour DB pour compteurs, répartition par sexe et top classes
+    counts, students_by_sex, top_classes = {}, {}, []
+    with connection.cursor() as cursor:
+        cursor.execute(_dashboard_stats_sql())
+        for kind, key, label, value in cursor.fetchall():
+            if kind == "count":
+                counts[key] = value
+            elif kind == "sex":
+                students_by_sex[key] = value
+            else:
+                top_classes.append({"id": int(key), "name": label, "student_count": value})
+
+    data = {
+        **counts,
+        "students_by_sex": students_by_sex,
+        "top_classes":     top_classes,
+    }
+    etag = hashlib.md5(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+    return {"data": data, "etag": etag}
 
-        # ✅ values/annotate déjà optimal, rien à changer
-        students_by_sex = {
-            entry["sex"]: entry["count"]
-            for entry in Student.objects.values("sex").annotate(count=Count("id"))
-        }
 
-        # ✅ only() pour ne pas charger les champs inutiles des classes
-        top_classes = list(
-            SchoolClass.objects
-            .only("id", "name")
-            .annotate(student_count=Count("students"))
-            .order_by("-student_count")[:8]
-            .values("id", "name", "student_count")
+def _dashboard_stats():
+    """
+    Statistiques globales, partagées par tous les utilisateurs dans le cache
+    et purgées par les signaux de core.signals à chaque écriture pertinente.
+    """
+    return cache.get_or_set(DASHBOARD_STATS_CACHE_KEY, _build_dashboard_stats, STATS_CACHE_SECONDS)
+
+
+def _stats_etag(request):
+    # ETag exact : empreinte des statistiques en cache
+    return _dashboard_stats()["etag"]
+
+
+def _top_students_scope(request):
+    """
+    Périmètre élèves de l'utilisateur, calculé une fois par requête (partagé
+    par l'ETag et la vue) : (rôle, signature, queryset élèves), le queryset
+    valant None pour un élève connecté ; None si le rôle n'a pas accès.
+    La signature énumère les classes (enseignant) ou les enfants (parent) :
+    une réaffectation change l'ETag et la clé de cache.
+    """
+    if "_top_students_scope" in request.__dict__:
+        return request.__dict__["_top_students_scope"]
+
+    user = request.user
+    scope = None
+    if user.is_staff or user.is_superuser:
+        scope = ("staff", report_cards_scope_signature("staff"), Student.objects.all())
+    elif hasattr(user, "teacher"):
+        class_ids = tuple(sorted(user.teacher.classes.values_list("id", flat=True)))
+        scope = (
+            "teacher",
+            report_cards_scope_signature("teacher", class_ids),
+            Student.objects.filter(school_class_id__in=class_ids),
+        )
+    elif hasattr(user, "parent"):
+        child_ids = tuple(sorted(user.parent.students.values_list("pk", flat=True)))
+        scope = (
+            "parent",
+            report_cards_scope_signature("parent", child_ids),
+            Student.objects.filter(pk__in=child_ids),
         )
+    elif hasattr(user, "student"):
+        student = user.student
+        scope = ("student", report_cards_scope_signature("student", student.pk, student.school_class_id), None)
 
-        return Response({
-            **counts,
-            "students_by_sex": students_by_sex,
-            "top_classes":     top_classes,
-        })
+    request.__dict__["_top_students_scope"] = scope
+    return scope
+
+
+def _top_students_cache_key(scope_sig, term, level_id, top_n):
+    """
+    Clé du classement mis en cache : une entrée par périmètre / paramètres,
+    préfixée par la version des bulletins (bumpée à chaque modification de
+    Grade), pour que les périmètres ne s'écrasent pas.
+    """
+    raw = f"{scope_sig}|{term}|{level_id}|{top_n}"
+    digest = hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+    return f"top:{report_cards_cache_version()}:{digest}"
+
+
+def _top_students_etag(request):
+    scope  = _top_students_scope(request)
+    params = request.GET
+    return _dashboard_etag(
+        CACHE_SECONDS,
+        report_cards_cache_version(),
+        request.user.pk,
+        scope[1] if scope else None,
+        params.get("term"),
+        params.get("level_id"),
+        params.get("top_n"),
+    )
+
+
+class DashboardStatsView(APIView):
+    permission_classes = [IsAuthenticated]
+    renderer_classes   = [ORJSONRenderer]
+
+    @method_decorator(condition(etag_func=_stats_etag))
+    def get(self, request):
+        return Response(_dashboard_stats()["data"])
 
 
 # ===========================================================================
 # Dashboard — meilleurs élèves  ⏸️  MIS EN PAUSE
 # ===========================================================================
-CACHE_SECONDS = 300
+# Colonnes réellement lues par compute_report_cards_from_grades (dont le tri
+# sur str(student), qui passe par SchoolClass.__str__ → level) et la sérialisation
+_TOP_STUDENTS_GRADE_FIELDS = (
+    "id", "term", "average_subject", "student_id", "subject_id",
+    "student__id", "student__first_name", "student__last_name", "student__school_class_id",
+    "student__user__first_name", "student__user__last_name",
+    "student__school_class__id", "student__school_class__name", "student__school_class__level_id",
+    "student__school_class__level__name",
+    "subject__id", "subject__name",
+)
+
+
+def _student_sort_name(item):
+    return f"{item['last_name'] or ''} {item['first_name'] or ''}".lower()
+
+
+def _sort_and_take(items_list, n):
+    # nlargest : O(M log n) au lieu d'un tri complet, même résultat que sorted()[:n]
+    def key(it):
+        return (it["term_average"], _student_sort_name(it))
+
+    return heapq.nlargest(
+        n,
+        (it for it in items_list if it.get("term_average") is not None),
+        key=key,
+    )
+
+
+def _push_top(heap, n, entry):
+    """
+    Maintient dans `heap` (tas min) les n plus grandes entrées
+    (clé, -ordre d'arrivée, item) : à clé égale, la première arrivée gagne,
+    comme avec un tri stable.
+    """
+    if len(heap) < n:
+        heapq.heappush(heap, entry)
+    elif entry[:2] > heap[0][:2]:
+        heapq.heapreplace(heap, entry)
+
+
+def _drain_top(heap):
+    """Charges (item, ident) d'un tas _push_top, du meilleur au moins bon."""
+    return [entry[2] for entry in sorted(heap, key=lambda e: e[:2], reverse=True)]
+
+
+def _student_ident(item):
+    """Champs d'identité de l'élève d'un bulletin (report_card_values), extraits une fois."""
+    return {"student_id": item["student_id"], "first_name": item["first_name"], "last_name": item["last_name"]}
+
+
+def _serialize_top_item(it, ident):
+    return {
+        **ident,
+        "class_id":     it.get("class_id"),
+        "class_name":   it.get("class_name"),
+        "term":         it.get("term"),
+        "term_average": it.get("term_average"),
+        "rank_in_class": it.get("rank"),
+    }
+
+
 class DashboardTopStudentsView(APIView):
     permission_classes = [IsAuthenticated]
+    renderer_classes   = [ORJSONRenderer]
 
     def get(self, request):
         # 🔴 Fonctionnalité temporairement désactivée le temps de la refonte.
@@ -779,9 +1463,8 @@ class DashboardTopStudentsView(APIView):
     #     ... (tout le code existant ici)
     permission_classes = [IsAuthenticated]
 
-    @method_decorator(cache_page(CACHE_SECONDS))
+    @method_decorator(condition(etag_func=_top_students_etag))
     def get(self, request):
-        user     = request.user
         term     = request.query_params.get("term")
         level_id = request.query_params.get("level_id")
         try:
@@ -789,133 +1472,180 @@ class DashboardTopStudentsView(APIView):
         except (ValueError, TypeError):
             top_n = 1
 
-        # Périmètre élèves selon le rôle
-        if user.is_staff or user.is_superuser:
-            students_qs = Student.objects.all()
-        elif hasattr(user, "teacher"):
-            students_qs = Student.objects.filter(school_class__in=user.teacher.classes.all()).distinct()
-        elif hasattr(user, "parent"):
-            students_qs = Student.objects.filter(parent=user.parent).distinct()
-        elif hasattr(user, "student"):
-            students_qs = Student.objects.filter(pk=user.student.pk)
-        else:
+        scope = _top_students_scope(request)
+        if scope is None:
             return Response({"detail": "Accès non autorisé."}, status=status.HTTP_403_FORBIDDEN)
+        _role, scope_sig, students_qs = scope
+
+        if students_qs is None:
+            # Périmètre d'un seul élève : pas besoin des regroupements
+            build = lambda: self._single_student_payload(request.user.student, term, level_id, top_n)
+        else:
+            build = lambda: self._build_payload(students_qs, scope_sig, term, level_id, top_n)
 
+        payload = cache.get_or_set(
+            _top_students_cache_key(scope_sig, term, level_id, top_n), build, CACHE_SECONDS
+        )
+        return Response(payload, status=status.HTTP_200_OK)
+
+    def _build_payload(self, students_qs, scope_sig, term, level_id, top_n):
         if level_id:
             students_qs = students_qs.filter(school_class__level_id=level_id)
 
         grades_qs = (
             Grade.objects
-            .select_related(
-                "student",
-                "student__school_class",
-                "student__school_class__level",
-                "subject",
-            )
+            .select_related("student__user", "student__school_class__level", "subject")
+            .only(*_TOP_STUDENTS_GRADE_FIELDS)
             .filter(student__in=students_qs)
         )
         if term:
-            grades_qs = grades_qs.filter(term__iexact=term)
+            grades_qs = grades_qs.filter(term=term.upper())
 
-        report_cards = compute_report_cards_from_grades(
+        report_cards = cached_report_cards_from_grades(
             grades_qs,
+            scope_sig,
+            term=term,
+            level_id=level_id,
             include_missing_subjects=False,
             full_weighting=True,
         )
 
-        per_level            = defaultdict(list)
-        per_term             = defaultdict(list)
-        per_student_aggregate = defaultdict(list)
-
-        for item in report_cards:
-            student  = item["student"]
-            avg      = item.get("term_average")
-            term_key = item.get("term")
+        # Un seul passage : tas bornés à top_n par niveau / trimestre / (niveau, trimestre),
+        # et somme courante par élève pour le top général.
+        # (Un tri global + groupby coûterait O(M log M) ; les tas restent en O(M log top_n)
+        # et aucun bucket n'est matérialisé ni retrié.)
+        per_level             = defaultdict(list)
+        per_term              = defaultdict(list)
+        per_level_term        = defaultdict(lambda: defaultdict(list))
+        per_student_aggregate = {}   # pk élève -> [somme, nombre, 1er bulletin] (cumul en O(1))
+        people                = {}   # pk élève -> (clé de nom, identité)
+
+        for seq, item in enumerate(report_cards):
+            student_pk = item["student_id"]
+            avg        = item.get("term_average")
+            term_key   = item.get("term")
             if avg is None:
                 continue
-            level = getattr(getattr(student, "school_class", None), "level_id", None)
-            per_term[term_key].append(item)
-            per_level[level].append(item)
-            per_student_aggregate[student.pk].append({
-                "student":    student,
-                "avg":        avg,
-                "class_id":   item.get("class_id"),
-                "class_name": item.get("class_name"),
-            })
-
-        def _sort_and_take(items_list, n):
-            return sorted(
-                [it for it in items_list if it.get("term_average") is not None],
-                key=lambda x: (
-                    x["term_average"],
-                    f"{x['student'].user.last_name or ''} {x['student'].user.first_name or ''}".lower(),
-                ),
-                reverse=True,
-            )[:n]
-
-        def _serialize_item(it):
-            s = it["student"]
-            return {
-                "student_id":   s.id,
-                "first_name":   s.user.first_name,
-                "last_name":    s.user.last_name,
-                "class_id":     it.get("class_id"),
-                "class_name":   it.get("class_name"),
-                "term":         it.get("term"),
-                "term_average": it.get("term_average"),
-                "rank_in_class": it.get("rank"),
-            }
+            level = item["level_id"]
+            # Clé de nom et identité calculées une fois par élève (et non par bulletin / trimestre)
+            person = people.get(student_pk)
+            if person is None:
+                person = people[student_pk] = (_student_sort_name(item), _student_ident(item))
+            name_key, ident = person
+            entry = ((avg, name_key), -seq, (item, ident))
+            _push_top(per_term[term_key], top_n, entry)
+            _push_top(per_level[level], top_n, entry)
+            _push_top(per_level_term[level][term_key], top_n, entry)
+
+            agg = per_student_aggregate.get(student_pk)
+            if agg is None:
+                per_student_aggregate[student_pk] = [avg, 1, item]
+            else:
+                agg[0] += avg
+                agg[1] += 1
 
         # Top par niveau
         per_level_best = [
-            {"level_id": level_key, "top": [_serialize_item(it) for it in _sort_and_take(items, top_n)]}
-            for level_key, items in per_level.items()
+            {"level_id": level_key, "top": [_serialize_top_item(it, ident) for it, ident in _drain_top(heap)]}
+            for level_key, heap in per_level.items()
         ]
 
         # Top par niveau et par trimestre
-        per_level_by_term = {}
-        for level_key, items in per_level.items():
-            by_term = defaultdict(list)
-            for it in items:
-                by_term[it["term"]].append(it)
-            per_level_by_term[str(level_key)] = {
-                t: [_serialize_item(it) for it in _sort_and_take(li, top_n)]
-                for t, li in by_term.items()
+        per_level_by_term = {
+            str(level_key): {
+                t: [_serialize_top_item(it, ident) for it, ident in _drain_top(heap)]
+                for t, heap in by_term.items()
             }
+            for level_key, by_term in per_level_term.items()
+        }
 
         # Top par trimestre
         per_term_best = [
-            {"term": t, "top": [_serialize_item(it) for it in _sort_and_take(items, top_n)]}
-            for t, items in per_term.items()
+            {"term": t, "top": [_serialize_top_item(it, ident) for it, ident in _drain_top(heap)]}
+            for t, heap in per_term.items()
         ]
 
-        # Top général (moyenne des moyennes trimestrielles)
-        overall_list = []
-        for student_pk, records in per_student_aggregate.items():
-            avgs = [r["avg"] for r in records if r["avg"] is not None]
-            if not avgs:
-                continue
-            overall_avg = float(Decimal(sum(avgs)) / Decimal(len(avgs)))
-            student = records[0]["student"]
-            overall_list.append({
-                "student_id":      student.id,
-                "first_name":      student.user.first_name,
-                "last_name":       student.user.last_name,
-                "class_id":        records[0].get("class_id"),
-                "class_name":      records[0].get("class_name"),
-                "overall_average": round(overall_avg, 2),
+        # Top général (moyenne des moyennes trimestrielles) : sélection sur des
+        # couples (clé, bulletin) légers, seuls les top_n gagnants sont sérialisés.
+        # nlargest ≡ sorted(..., reverse=True)[:n] sans trier toute la liste
+        ranked = heapq.nlargest(
+            top_n,
+            (
+                ((round(total / count, 2), people[pk][0]), pk, first)
+                for pk, (total, count, first) in per_student_aggregate.items()
+            ),
+            key=itemgetter(0),
+        )
+        top_overall = []
+        for (overall_avg, _), pk, first in ranked:
+            top_overall.append({
+                **people[pk][1],
+                "class_id":        first.get("class_id"),
+                "class_name":      first.get("class_name"),
+                "overall_average": overall_avg,
             })
 
-        overall_list.sort(
-            key=lambda x: (x["overall_average"], f"{x['last_name']} {x['first_name']}".lower()),
-            reverse=True,
+        return {
+            "requested_term":         term,
+            "requested_level_id":     level_id,
+            "top_overall":            top_overall,
+            "top_per_term":           per_term_best,
+            "top_per_level":          per_level_best,
+            "top_per_level_by_term":  per_level_by_term,
+        }
+
+    def _single_student_payload(self, student, term, level_id, top_n):
+        """
+        Chemin rapide pour un élève connecté : tous les classements portent
+        sur ses seuls bulletins, qu'on formate directement.
+        """
+        grades_qs = (
+            Grade.objects
+            .select_related("student__user", "student__school_class__level", "subject")
+            .only(*_TOP_STUDENTS_GRADE_FIELDS)
+            .filter(student=student)
         )
+        if term:
+            grades_qs = grades_qs.filter(term=term.upper())
+        if level_id:
+            grades_qs = grades_qs.filter(student__school_class__level_id=level_id)
 
-        return Response({
+        items = [
+            report_card_values(it) for it in compute_report_cards_from_grades(
+                grades_qs,
+                include_missing_subjects=False,
+                full_weighting=True,
+            )
+            if it["term_average"] is not None
+        ]
+
+        top_overall, per_term_best, per_level_best, per_level_by_term = [], [], [], {}
+        if items:
+            first = items[0]
+            level = first["level_id"]
+            avgs  = [it["term_average"] for it in items]
+            ident = _student_ident(first)
+            top_overall = [{
+                **ident,
+                "class_id":        first.get("class_id"),
+                "class_name":      first.get("class_name"),
+                "overall_average": round(fmean(avgs), 2),
+            }]
+            per_term_best = [
+                {"term": it["term"], "top": [_serialize_top_item(it, ident)]} for it in items
+            ]
+            per_level_best = [
+                {"level_id": level, "top": [_serialize_top_item(it, ident) for it in _sort_and_take(items, top_n)]}
+            ]
+            per_level_by_term = {
+                str(level): {it["term"]: [_serialize_top_item(it, ident)] for it in items}
+            }
+
+        return {
             "requested_term":         term,
             "requested_level_id":     level_id,
-            "top_overall":            overall_list[:top_n],
+            "top_overall":            top_overall,
             "top_per_term":           per_term_best,
             "top_per_level":          per_level_best,
             "top_per_level_by_term":  per_level_by_term,
-        }, status=status.HTTP_200_OK)
\ No newline at end of file
+        }
\ No newline at end of file
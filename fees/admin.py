@@ -1,4 +1,6 @@
 from django.contrib import admin
+from django.db.models import Prefetch
+
 from .models import FeeType, FeeTypeAmount, Fee, Payment
 
 
@@ -16,6 +18,12 @@ class FeeTypeAdmin(admin.ModelAdmin):
     search_fields = ["name"]
     inlines = [FeeTypeAmountInline]
 
+    def get_queryset(self, request):
+        # levels_display lit amounts + level de chaque ligne : 2 requêtes au total
+        return super().get_queryset(request).prefetch_related(
+            Prefetch("amounts", queryset=FeeTypeAmount.objects.select_related("level"))
+        )
+
     def levels_display(self, obj):
         return ", ".join([f"{fta.level.name} ({fta.amount})" for fta in obj.amounts.all()])
     levels_display.short_description = "Niveaux (montant)"
@@ -34,8 +42,12 @@ class FeeAdmin(admin.ModelAdmin):
     list_filter = ["fee_type", "paid"]
     search_fields = ["student__first_name", "student__last_name", "fee_type__name"]
 
+    def get_queryset(self, request):
+        # str(student) passe par school_class → level
+        return super().get_queryset(request).with_level().select_related("student__user")
+
     def get_level(self, obj):
-        lvl = getattr(obj, "level", None)
+        lvl = obj.level
         return lvl.name if lvl else "-"
     get_level.short_description = "Level"
 
@@ -45,3 +57,9 @@ class PaymentAdmin(admin.ModelAdmin):
     list_display = ["id", "fee", "amount", "validated", "validated_by", "paid_at"]
     list_filter = ["validated", "paid_at"]
     search_fields = ["fee__student__first_name", "fee__student__last_name", "reference"]
+
+    def get_queryset(self, request):
+        # str(fee) → str(student) + fee_type
+        return super().get_queryset(request).select_related(
+            "fee__student__user", "fee__student__school_class__level", "fee__fee_type", "validated_by"
+        )
@@ -1,5 +1,5 @@
 # fees/filters.py
-from django.db.models import Q
+from django.db.models import Exists, OuterRef, Q
 import django_filters
 from django_filters import rest_framework as filters
 
@@ -32,10 +32,11 @@ class FeeFilter(filters.FilterSet):
     def filter_by_level(self, queryset, name, value):
         # Inclut fees où l'élève est dans une classe dont level==value
         # OU où le FeeType a un FeeTypeAmount pour ce level.
+        # EXISTS plutôt qu'une jointure sur amounts : pas de lignes dupliquées, pas de distinct()
+        has_amount = FeeTypeAmount.objects.filter(fee_type_id=OuterRef("fee_type_id"), level_id=value)
         return queryset.filter(
-            Q(student__school_class__level__id=value) |
-            Q(fee_type__amounts__level__id=value)
-        ).distinct()
+            Q(student__school_class__level__id=value) | Exists(has_amount)
+        )
 
 
 class PaymentFilter(filters.FilterSet):
@@ -78,7 +79,9 @@ class FeeTypeFilter(filters.FilterSet):
         fields = ["name", "is_active", "level"]
 
     def filter_by_level(self, queryset, name, value):
-        return queryset.filter(amounts__level__id=value).distinct()
+        return queryset.filter(
+            Exists(FeeTypeAmount.objects.filter(fee_type_id=OuterRef("pk"), level_id=value))
+        )
 
 
 class FeeTypeAmountFilter(filters.FilterSet):
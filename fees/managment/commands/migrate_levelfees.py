@@ -23,14 +23,17 @@ class Command(BaseCommand):
                 if ft_created:
                     created_ft += 1
 
-                students = Student.objects.filter(school_class__level=level)
-                for s in students:
-                    fee_obj, fee_created = Fee.objects.get_or_create(
-                        student=s,
-                        fee_type=ft,
-                        defaults={"amount": lf.total_amount}
-                    )
-                    if fee_created:
-                        created_fees += 1
+                # élèves du niveau sans Fee pour ce type : une seule insertion
+                missing = (
+                    Student.objects.filter(school_class__level=level)
+                    .exclude(fees__fee_type=ft)
+                    .values_list("pk", flat=True)
+                )
+                created = Fee.objects.bulk_create(
+                    # bulk_create n'appelle pas Fee.save() : due_date reportée ici
+                    [Fee(student_id=pk, fee_type=ft, amount=lf.total_amount, due_date=ft.due_date) for pk in missing],
+                    ignore_conflicts=True,
+                )
+                created_fees += len(created)
 
         self.stdout.write(self.style.SUCCESS(f"FeeTypes créés: {created_ft} | Fees créés: {created_fees}"))
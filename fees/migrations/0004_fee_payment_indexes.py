@@ -0,0 +1,33 @@
+# Generated by Django 5.2.5 on 2026-10-15 23:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fees', '0003_fee_due_date_feetype_due_date'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='fee',
+            index=models.Index(fields=['paid', 'created_at'], name='fees_fee_paid_a3b016_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fee',
+            index=models.Index(fields=['fee_type', 'paid'], name='fees_fee_fee_typ_024441_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='feetypeamount',
+            index=models.Index(fields=['level', 'is_active'], name='fees_feetyp_level_i_3bd0e6_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['validated', 'paid_at'], name='fees_paymen_validat_b3d302_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(condition=models.Q(('validated', True)), fields=['fee'], name='payment_fee_validated_idx'),
+        ),
+    ]
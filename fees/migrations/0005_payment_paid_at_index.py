@@ -0,0 +1,17 @@
+# Generated by Django 5.2.5 on 2026-10-15 23:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fees', '0004_fee_payment_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['paid_at'], name='payment_paid_at_idx'),
+        ),
+    ]
@@ -5,11 +5,12 @@ import logging
 from django.conf import settings
 from django.db import models, transaction
 from django.utils import timezone
+from django.utils.functional import cached_property
 from django.core.exceptions import PermissionDenied, ValidationError
 from django.apps import apps
 
 from core.models import Student
-from django.db.models import Sum
+from django.db.models import Q, Sum
 
 from academics.models import Level
 
@@ -49,12 +50,21 @@ class FeeTypeAmount(models.Model):
 
     class Meta:
         unique_together = ("fee_type", "level")
+        indexes = [
+            models.Index(fields=["level", "is_active"]),
+        ]
         ordering = ["level__id", "fee_type__name"]
 
     def __str__(self):
         return f"{self.fee_type.name} - {self.level.name}: {self.amount}"
 
 
+class FeeQuerySet(models.QuerySet):
+    def with_level(self):
+        """Joint élève → classe → niveau et le FeeType : Fee.level sans requête."""
+        return self.select_related("student__school_class__level", "fee_type")
+
+
 class Fee(models.Model):
     student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name="fees")
     fee_type = models.ForeignKey(
@@ -74,8 +84,14 @@ class Fee(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = FeeQuerySet.as_manager()
+
     class Meta:
         unique_together = ("student", "fee_type")
+        indexes = [
+            models.Index(fields=["paid", "created_at"]),
+            models.Index(fields=["fee_type", "paid"]),
+        ]
         ordering = ["fee_type__name"]
 
     def __str__(self):
@@ -87,7 +103,11 @@ class Fee(models.Model):
         """
         Somme des paiements VALIDÉS pour ce fee.
         Retourne Decimal('0') si aucun paiement validé.
+        Réutilise annotated_total_paid quand le queryset l'a annoté (FeeViewSet).
         """
+        annotated = getattr(self, "annotated_total_paid", None)
+        if annotated is not None:
+            return Decimal(annotated)
         s = self.payments.filter(validated=True).aggregate(total=Sum('amount'))['total']
         return Decimal(s) if s is not None else Decimal('0')
 
@@ -113,18 +133,25 @@ class Fee(models.Model):
 
     def save(self, *args, **kwargs):
         # si pas de due_date sur le Fee, récupérer depuis FeeType (si présent)
-        if not self.due_date and self.fee_type and getattr(self.fee_type, "due_date", None):
-            self.due_date = self.fee_type.due_date
+        if not self.due_date and self.fee_type_id:
+            if Fee.fee_type.is_cached(self):
+                due_date = self.fee_type.due_date
+            else:
+                # FeeType non chargé : on ne lit que sa due_date
+                due_date = FeeType.objects.filter(pk=self.fee_type_id).values_list("due_date", flat=True).first()
+            if due_date:
+                self.due_date = due_date
         super().save(*args, **kwargs)
 
-    @property
+    @cached_property
     def level(self):
+        """
+        Niveau de la classe de l'élève, mémorisé par instance.
+        (Un FeeTypeAmount de ce niveau renverrait le même Level : inutile de
+        le chercher.) Fee.objects.with_level() joint le niveau d'avance.
+        """
         try:
-            student_level = getattr(getattr(self.student, "school_class", None), "level", None)
-            if not student_level:
-                return None
-            fta = self.fee_type.amounts.filter(level=student_level).first()
-            return fta.level if fta else student_level
+            return getattr(getattr(self.student, "school_class", None), "level", None)
         except Exception:
             return None
 
@@ -140,6 +167,15 @@ class Payment(models.Model):
     validated_by = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL)
     validated_at = models.DateTimeField(null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["validated", "paid_at"]),
+            # index partiel : SUM(amount) des paiements validés d'un fee (total_paid)
+            models.Index(fields=["fee"], condition=Q(validated=True), name="payment_fee_validated_idx"),
+            # filtres paid_after / paid_before de la liste, sans critère validated
+            models.Index(fields=["paid_at"], name="payment_paid_at_idx"),
+        ]
+
     def validate(self, user=None):
         """
         Valide le paiement, met à jour le Fee (paid/payment_date) et déclenche notification de validation.
@@ -170,12 +206,8 @@ class Payment(models.Model):
             self.validated_at = timezone.now()
             self.save(update_fields=['validated', 'validated_by', 'validated_at'])
 
-            # recalculer statut du Fee (somme des paiements validés)
-            total_paid = Decimal('0')
-            # utilise Decimal pour éviter surprises
-            for p in self.fee.payments.filter(validated=True):
-                if p.amount is not None:
-                    total_paid += Decimal(p.amount)
+            # recalculer statut du Fee (somme des paiements validés, un seul SUM SQL)
+            total_paid = fee.total_paid
 
             # mettre à jour le Fee selon le total validé
             try:
@@ -189,20 +221,25 @@ class Payment(models.Model):
             else:
                 fee.paid = False
                 fee.payment_date = None
-            fee.save(update_fields=['paid', 'payment_date'])
+            # UPDATE ciblé : ni Fee.save() (lookup due_date) ni post_save sur Fee.
+            # Seul receiver concerné : bust_fees_stats (cache des statistiques),
+            # déjà déclenché par la sauvegarde du Payment ci-dessus, dans la même
+            # transaction. updated_at (auto_now) est renseigné explicitement.
+            Fee.objects.filter(pk=fee.pk).update(
+                paid=fee.paid, payment_date=fee.payment_date, updated_at=timezone.now()
+            )
 
         # Notifications : la partie notification est secondaire — on la protège pour ne pas casser la validation
         try:
             Notification = apps.get_model('notifications', 'Notification')
-            NotificationTemplate = apps.get_model('notifications', 'NotificationTemplate')
-            UserNotificationPreference = apps.get_model('notifications', 'UserNotificationPreference')
             try:
-                from notifications.delivery import send_notification as send_notification_fn
+                from notifications.tasks import enqueue_notifications_delivery
             except Exception:
-                send_notification_fn = None
+                enqueue_notifications_delivery = None
+            from notifications.service import get_preferences, get_template_by_key
         except Exception:
             Notification = None
-            send_notification_fn = None
+            enqueue_notifications_delivery = None
 
         if not Notification:
             # notifications app non installée : on quitte proprement
@@ -230,104 +267,77 @@ class Payment(models.Model):
         # récupérer template (silencieux en cas d'erreur)
         tpl = None
         try:
-            tpl = NotificationTemplate.objects.filter(key='payment_validated').first()
+            tpl = get_template_by_key('payment_validated')
         except Exception:
             tpl = None
 
         default_channels = getattr(tpl, 'default_channels', None) or ['inapp']
 
-        # notifier parents
+        # notifier le parent (Student.parent : ForeignKey, parent unique)
+        parent = getattr(student, 'parent', None) if student is not None else None
+        parent_recipients = [(parent, parent.user)] if parent is not None and getattr(parent, 'user', None) else []
+        user_ids = [user_obj.id for _, user_obj in parent_recipients]
+        if student_user:
+            user_ids.append(student_user.id)
+
+        # préférences (en cache) et doublons de tous les destinataires : 1 à 2 requêtes (protégées)
+        # canaux par destinataire ayant une préférence (None = notifications désactivées)
         try:
-            parents_qs = fee.student.parents.all()
+            channels_by_user = {
+                user_id: (channels or default_channels) if enabled else None
+                for user_id, (enabled, channels) in get_preferences(user_ids, 'fees').items()
+            }
         except Exception:
-            parents_qs = []
-
-        for parent in parents_qs:
-            user_obj = getattr(parent, 'user', None)
-            if not user_obj:
-                continue
-
-            # empêcher doublon (protégé)
-            try:
-                existed = Notification.objects.filter(
+            channels_by_user = {}
+        try:
+            already_notified = set(
+                Notification.objects.filter(
                     topic='fees',
-                    recipient_user=user_obj,
-                    payload__payment_id=self.id
-                ).exists()
-            except Exception:
-                existed = False
+                    recipient_user_id__in=user_ids,
+                    payment_id=self.id,
+                    # pas les notifications 'payment_received' du même paiement
+                    template__key='payment_validated',
+                ).values_list('recipient_user_id', flat=True)
+            ) if user_ids else set()
+        except Exception:
+            already_notified = set()
 
-            if existed:
+        # destinataires retenus : (user, payload, channels)
+        targets = []
+        for parent, user_obj in parent_recipients:
+            # empêcher doublon
+            if user_obj.id in already_notified:
                 continue
 
-            channels = list(default_channels)
-            try:
-                pref = UserNotificationPreference.objects.get(user=user_obj, topic='fees')
-                if not pref.enabled:
-                    continue
-                channels = pref.channels or channels
-            except Exception:
-                # si pb sur preference -> on laisse channels par défaut
-                pass
-
-            try:
-                notif = Notification.objects.create(
-                    template=tpl,
-                    topic='fees',
-                    recipient_user=user_obj,
-                    payload={**payload, "parent_name": getattr(parent, 'name', '')},
-                    channels=channels
-                )
-            except Exception:
-                # si création de notification échoue on skip ce destinataire
-                logger.exception("Échec création notification parent for payment_id=%s parent=%r", self.id, parent)
+            channels = channels_by_user.get(user_obj.id, default_channels)
+            if channels is None:
                 continue
 
-            if send_notification_fn:
-                try:
-                    send_notification_fn(notif)
-                except Exception:
-                    logger.exception("Échec envoi notification parent for payment_id=%s notif_id=%r", self.id, getattr(notif, 'id', None))
+            targets.append((user_obj, {**payload, "parent_name": getattr(parent, 'name', '')}, channels))
 
         # notifier l'élève (s'il a user)
-        if student_user:
-            try:
-                existed = Notification.objects.filter(
-                    topic='fees',
-                    recipient_user=student_user,
-                    payload__payment_id=self.id
-                ).exists()
-            except Exception:
-                existed = False
-
-            if not existed:
-                channels = list(default_channels)
-                try:
-                    pref = UserNotificationPreference.objects.get(user=student_user, topic='fees')
-                    if not pref.enabled:
-                        channels = []
-                    else:
-                        channels = pref.channels or channels
-                except Exception:
-                    pass
-
-                notif = None
-                try:
-                    notif = Notification.objects.create(
-                        template=tpl,
-                        topic='fees',
-                        recipient_user=student_user,
-                        payload=payload,
-                        channels=channels
-                    )
-                except Exception:
-                    logger.exception("Échec création notification student for payment_id=%s student=%r", self.id, student_user)
-
-                if notif and send_notification_fn:
-                    try:
-                        send_notification_fn(notif)
-                    except Exception:
-                        logger.exception("Échec envoi notification student for payment_id=%s notif_id=%r", self.id, getattr(notif, 'id', None))
+        if student_user and student_user.id not in already_notified:
+            channels = channels_by_user.get(student_user.id, default_channels)
+            # préférence désactivée : l'élève garde une notification sans canal
+            targets.append((student_user, payload, [] if channels is None else channels))
+
+        if not targets:
+            return
+
+        try:
+            notifs = Notification.objects.bulk_create([
+                Notification(template=tpl, topic='fees', recipient_user=user_obj, payload=data, payment_id=self.id, channels=channels)
+                for user_obj, data, channels in targets
+            ])
+        except Exception:
+            logger.exception("Échec création notifications for payment_id=%s", self.id)
+            return
+
+        # envoi (email / SMS / push) en arrière-plan, une fois les lignes commitées :
+        # la requête qui valide le paiement n'attend pas les I/O réseau
+        if enqueue_notifications_delivery:
+            notif_ids = [notif.pk for notif in notifs]
+            transaction.on_commit(lambda: enqueue_notifications_delivery(notif_ids))
 
     def __str__(self):
         return f"Payment {self.amount} for {self.fee}"
@@ -11,6 +11,19 @@ class IsStudentOrParentOrAdmin(permissions.BasePermission):
         return bool(request.user and request.user.is_authenticated)
 
     def has_object_permission(self, request, view, obj):
+        # Décision mémorisée sur la requête : DRF peut réévaluer la permission
+        # (composition OR / AND, get_object() appelé plusieurs fois).
+        # Clé sur (modèle, pk) et non id(obj) : un id() peut être réutilisé
+        # par un autre objet une fois le premier libéré.
+        if obj.pk is None:
+            return self._check_object(request, obj)
+        cache = request.__dict__.setdefault("_fees_perm_cache", {})
+        key = (type(obj), obj.pk)
+        if key not in cache:
+            cache[key] = self._check_object(request, obj)
+        return cache[key]
+
+    def _check_object(self, request, obj):
         user = request.user
 
         if user.is_staff or user.is_superuser:
@@ -25,22 +38,13 @@ class IsStudentOrParentOrAdmin(permissions.BasePermission):
         if not student:
             return False
 
-        # 2. Vérification pour l'Étudiant
-        if hasattr(user, "student") and student == user.student:
+        # 2. Vérification pour l'Étudiant (comparaison de clés, sans requête)
+        if hasattr(user, "student") and student.pk == user.student.pk:
             return request.method in permissions.SAFE_METHODS
 
-        # 3. Vérification pour le Parent
-        # Attention : Assure-toi que la relation student.parent est correcte (OneToOne ou ForeignKey).
-        # Si c'est du ManyToMany, il faudra utiliser: user.parent in student.parents.all()
-        if hasattr(user, "parent"):
-            # On suppose ici que student.parent existe comme dans ton code original
-            # On utilise 'student' récupéré plus haut au lieu de 'obj.student'
-            parent_of_student = getattr(student, "parent", None)
-            if parent_of_student == user.parent:
-                return request.method in permissions.SAFE_METHODS
-            
-            # Alternative si relation ManyToMany (plus fréquent) :
-            # if hasattr(student, "parents") and user.parent in student.parents.all():
-            #    return request.method in permissions.SAFE_METHODS
-
-        return False
\ No newline at end of file
+        # 3. Vérification pour le Parent : student.parent est une ForeignKey,
+        # on compare parent_id sans charger le Parent.
+        if hasattr(user, "parent") and student.parent_id == user.parent.pk:
+            return request.method in permissions.SAFE_METHODS
+
+        return False
@@ -1,3 +1,5 @@
+from copy import deepcopy
+
 from rest_framework import serializers
 from django.utils import timezone
 
@@ -6,7 +8,24 @@ from academics.models import Level
 from core.models import Student
 
 
-class FeeTypeAmountSerializer(serializers.ModelSerializer):
+class CachedFieldsMixin:
+    """
+    Mémorise par classe les champs construits par ModelSerializer.get_fields()
+    (introspection du modèle, coûteuse) et en donne une copie profonde par
+    instance, comme DRF pour _declared_fields : validators, error_messages et
+    liaison parent / field_name ne sont jamais partagés entre instances ou threads.
+    """
+
+    def get_fields(self):
+        cls = self.__class__
+        template = cls.__dict__.get("_fields_template")
+        if template is None:
+            template = super().get_fields()
+            cls._fields_template = template
+        return deepcopy(template)
+
+
+class FeeTypeAmountSerializer(CachedFieldsMixin, serializers.ModelSerializer):
     level_name = serializers.CharField(source="level.name", read_only=True)
 
     class Meta:
@@ -14,7 +33,7 @@ class FeeTypeAmountSerializer(serializers.ModelSerializer):
         fields = ["id", "fee_type", "level", "level_name", "amount", "is_active"]
 
 
-class FeeTypeSerializer(serializers.ModelSerializer):
+class FeeTypeSerializer(CachedFieldsMixin, serializers.ModelSerializer):
     amounts = FeeTypeAmountSerializer(many=True, read_only=True)
     due_date = serializers.DateField(required=False, allow_null=True)
 
@@ -32,39 +51,37 @@ class UserPublicSmallSerializer(serializers.Serializer):
 
 
 class StudentMiniSerializer(serializers.Serializer):
-    id = serializers.CharField()
-    first_name = serializers.SerializerMethodField()
-    last_name = serializers.SerializerMethodField()
-    full_name = serializers.SerializerMethodField()
-    class_name = serializers.SerializerMethodField()
-    level = serializers.SerializerMethodField()
-
-    def get_first_name(self, student):
-        return getattr(getattr(student, "user", None), "first_name", None) or getattr(student, "first_name", None)
-
-    def get_last_name(self, student):
-        return getattr(getattr(student, "user", None), "last_name", None) or getattr(student, "last_name", None)
+    """
+    Élève en lecture seule : id, first_name, last_name, full_name, class_name, level.
+    Construit en un seul to_representation (user / classe / niveau résolus une
+    fois) plutôt que via un SerializerMethodField par clé.
+    """
 
-    def get_full_name(self, student):
-        fn = self.get_first_name(student) or ""
-        ln = self.get_last_name(student) or ""
-        return (fn + " " + ln).strip() or None
+    def to_representation(self, student):
+        user = getattr(student, "user", None)
+        first_name = getattr(user, "first_name", None) or getattr(student, "first_name", None)
+        last_name = getattr(user, "last_name", None) or getattr(student, "last_name", None)
 
-    def get_class_name(self, student):
-        school_class = getattr(student, "school_class", None)
-        if school_class:
-            return getattr(school_class, "name", None) or getattr(school_class, "label", None)
-        return getattr(student, "class_name", None)
-
-    def get_level(self, student):
         school_class = getattr(student, "school_class", None)
         if school_class:
+            class_name = getattr(school_class, "name", None) or getattr(school_class, "label", None)
             lvl = getattr(school_class, "level", None)
-            return getattr(lvl, "name", None) if lvl else None
-        return None
+            level = getattr(lvl, "name", None) if lvl else None
+        else:
+            class_name = getattr(student, "class_name", None)
+            level = None
+
+        return {
+            "id": str(student.id),
+            "first_name": first_name,
+            "last_name": last_name,
+            "full_name": ((first_name or "") + " " + (last_name or "")).strip() or None,
+            "class_name": class_name,
+            "level": level,
+        }
 
 
-class FeeSerializer(serializers.ModelSerializer):
+class FeeSerializer(CachedFieldsMixin, serializers.ModelSerializer):
     # Lecture : objet complet
     student = StudentMiniSerializer(read_only=True)
 
@@ -105,7 +122,7 @@ class FeeSerializer(serializers.ModelSerializer):
         return attrs
 
 
-class PaymentSerializer(serializers.ModelSerializer):
+class PaymentSerializer(CachedFieldsMixin, serializers.ModelSerializer):
     fee_detail = FeeSerializer(source="fee", read_only=True)
     student = StudentMiniSerializer(source="fee.student", read_only=True)
     validated_by = serializers.SerializerMethodField()
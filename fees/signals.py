@@ -1,16 +1,101 @@
 # fees/signals.py
 import logging
-from django.db.models.signals import post_save, pre_save
+from collections import defaultdict
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
 from django.db import transaction
 from django.apps import apps
 
+from .utils.statistics import invalidate_fees_stats_cache
+
 logger = logging.getLogger(__name__)
 
 
 # ---------- Fees creation hooks (student / fee type amount) ----------
+# dispatch_uid : un seul enregistrement par receiver, même si le module est importé deux fois
+
+def create_fees_for_students(students):
+    """
+    Équivalent en lot de create_fees_for_new_student, pour les élèves créés
+    via bulk_create (qui ne déclenche pas post_save) : crée les Fee des
+    FeeTypeAmount actifs du niveau de chaque élève, en une seule insertion.
+    """
+    students = [s for s in students if s.school_class_id]
+    if not students:
+        return
+
+    SchoolClass = apps.get_model('academics', 'SchoolClass')
+    FeeTypeAmount = apps.get_model('fees', 'FeeTypeAmount')
+    Fee = apps.get_model('fees', 'Fee')
+
+    class_levels = dict(
+        SchoolClass.objects.filter(pk__in={s.school_class_id for s in students})
+        .values_list("pk", "level_id")
+    )
+    amounts_by_level = defaultdict(list)
+    for fta in FeeTypeAmount.objects.filter(
+        level_id__in=set(class_levels.values()), is_active=True
+    ).select_related("fee_type"):
+        amounts_by_level[fta.level_id].append(fta)
+
+    fees = [
+        # Fee.save() n'est pas appelé : on reporte la due_date du FeeType ici
+        Fee(student=student, fee_type=fta.fee_type, amount=fta.amount, due_date=fta.fee_type.due_date)
+        for student in students
+        for fta in amounts_by_level.get(class_levels.get(student.school_class_id), [])
+    ]
+    Fee.objects.bulk_create(fees, ignore_conflicts=True)
+    transaction.on_commit(invalidate_fees_stats_cache)
+
 
-@receiver(post_save, sender=apps.get_model('core', 'Student'))
+def _create_missing_fees(student_ids, fee_type_amounts, log_context):
+    """
+    Crée en une seule insertion les Fee (élève, type de frais) manquants.
+    Les paires existantes sont lues en une requête et écartées ;
+    unique_together (student, fee_type) + ignore_conflicts couvre les
+    insertions concurrentes.
+    Fee.save() n'est pas appelé : la due_date du FeeType est reportée ici.
+    Comme create_fees_for_students (import en lot), l'insertion a lieu tout
+    de suite, dans la transaction de l'appelant : les Fee sont visibles dès
+    l'écriture de l'élève et commités (ou annulés) avec elle. Pas de
+    savepoint : ignore_conflicts écarte déjà les doublons, et toute autre
+    erreur doit annuler l'écriture de l'appelant.
+    """
+    Fee = apps.get_model('fees', 'Fee')
+    if not fee_type_amounts:
+        return
+    # paires déjà présentes (cas courant d'un re-save) : une lecture plutôt
+    # que l'envoi de lignes que l'INSERT ignorerait
+    existing = set(
+        Fee.objects.filter(
+            student_id__in=student_ids,
+            fee_type_id__in={fta.fee_type_id for fta in fee_type_amounts},
+        ).values_list("student_id", "fee_type_id")
+    )
+    fees = [
+        Fee(student_id=student_id, fee_type_id=fta.fee_type_id, amount=fta.amount, due_date=fta.fee_type.due_date)
+        for student_id in student_ids
+        for fta in fee_type_amounts
+        if (student_id, fta.fee_type_id) not in existing
+    ]
+    if not fees:
+        return
+    Fee.objects.bulk_create(fees, ignore_conflicts=True, batch_size=500)
+    logger.debug("%d Fee créés (%s)", len(fees), log_context)
+    # bulk_create ne déclenche pas post_save
+    transaction.on_commit(invalidate_fees_stats_cache)
+
+
+def _active_fee_type_amounts(level_id):
+    FeeTypeAmount = apps.get_model('fees', 'FeeTypeAmount')
+    return list(
+        FeeTypeAmount.objects.filter(level_id=level_id, is_active=True)
+        .select_related("fee_type")
+        .only("fee_type_id", "amount", "fee_type__due_date")
+    )
+
+
+@receiver(post_save, sender=apps.get_model('core', 'Student'), dispatch_uid="fees.create_fees_for_new_student")
 def create_fees_for_new_student(sender, instance, created, **kwargs):
     """
     Quand un Student est créé : si il a une classe -> récupérer son level
@@ -20,30 +105,14 @@ def create_fees_for_new_student(sender, instance, created, **kwargs):
         return
 
     school_class = getattr(instance, "school_class", None)
-    level = getattr(school_class, "level", None) if school_class else None
-    if not level:
+    level_id = getattr(school_class, "level_id", None) if school_class else None
+    if not level_id:
         return
 
-    FeeTypeAmount = apps.get_model('fees', 'FeeTypeAmount')
-    Fee = apps.get_model('fees', 'Fee')
+    _create_missing_fees([instance.pk], _active_fee_type_amounts(level_id), f"student {instance.pk}")
+
 
-    fee_type_amounts = FeeTypeAmount.objects.filter(level=level, is_active=True).select_related("fee_type")
-    with transaction.atomic():
-        for fta in fee_type_amounts:
-            try:
-                Fee.objects.get_or_create(
-                    student=instance,
-                    fee_type=fta.fee_type,
-                    defaults={"amount": fta.amount}
-                )
-            except Exception as e:
-                logger.exception(
-                    "Erreur lors de la création de Fee pour student %s et fee_type %s: %s",
-                    instance.pk, getattr(fta.fee_type, 'pk', None), e
-                )
-
-
-@receiver(pre_save, sender=apps.get_model('core', 'Student'))
+@receiver(pre_save, sender=apps.get_model('core', 'Student'), dispatch_uid="fees.handle_student_level_change")
 def handle_student_level_change(sender, instance, **kwargs):
     """
     Si l'élève change de niveau (update), créer les fees du nouveau niveau s'ils manquent.
@@ -53,37 +122,28 @@ def handle_student_level_change(sender, instance, **kwargs):
         # nouvel enregistrement : post_save gère la création
         return
 
+    # classe inchangée depuis le chargement (Student.from_db) : rien à comparer
+    if getattr(instance, "_loaded_school_class_id", object()) == instance.school_class_id:
+        return
+
     Student = apps.get_model('core', 'Student')
-    try:
-        old = Student.objects.get(pk=instance.pk)
-    except Student.DoesNotExist:
+    # une seule colonne lue, sans instancier l'ancien Student
+    old = Student.objects.filter(pk=instance.pk).values_list("school_class__level_id", flat=True)[:1]
+    if not old:
         return
 
-    old_level = getattr(getattr(old, "school_class", None), "level", None)
-    new_level = getattr(getattr(instance, "school_class", None), "level", None)
-    if old_level == new_level or new_level is None:
+    old_level_id = old[0]
+    new_level_id = getattr(getattr(instance, "school_class", None), "level_id", None)
+    if old_level_id == new_level_id or new_level_id is None:
         return
 
-    FeeTypeAmount = apps.get_model('fees', 'FeeTypeAmount')
-    Fee = apps.get_model('fees', 'Fee')
+    _create_missing_fees(
+        [instance.pk], _active_fee_type_amounts(new_level_id),
+        f"changement de niveau, student {instance.pk}",
+    )
+
 
-    fee_type_amounts = FeeTypeAmount.objects.filter(level=new_level, is_active=True).select_related("fee_type")
-    with transaction.atomic():
-        for fta in fee_type_amounts:
-            try:
-                Fee.objects.get_or_create(
-                    student=instance,
-                    fee_type=fta.fee_type,
-                    defaults={"amount": fta.amount}
-                )
-            except Exception as e:
-                logger.exception(
-                    "Erreur lors de la création de Fee après changement de niveau pour student %s: %s",
-                    instance.pk, e
-                )
-
-
-@receiver(post_save, sender=apps.get_model('fees', 'FeeTypeAmount'))
+@receiver(post_save, sender=apps.get_model('fees', 'FeeTypeAmount'), dispatch_uid="fees.create_fees_for_existing_students")
 def create_fees_for_existing_students_on_new_fee_type_amount(sender, instance, created, **kwargs):
     """
     Si on ajoute (ou ré-active) un FeeTypeAmount pour un level,
@@ -94,30 +154,27 @@ def create_fees_for_existing_students_on_new_fee_type_amount(sender, instance, c
         return
 
     Student = apps.get_model('core', 'Student')
-    Fee = apps.get_model('fees', 'Fee')
+    student_ids = Student.objects.filter(school_class__level_id=instance.level_id).values_list("pk", flat=True)
+    _create_missing_fees(student_ids, [instance], f"FeeTypeAmount {instance.pk}")
+
+
+# ---------- Cache des statistiques ----------
 
-    level = instance.level
-    fee_type = instance.fee_type
-
-    students_qs = Student.objects.filter(school_class__level=level)
-    with transaction.atomic():
-        for student in students_qs:
-            try:
-                Fee.objects.get_or_create(
-                    student=student,
-                    fee_type=fee_type,
-                    defaults={"amount": instance.amount}
-                )
-            except Exception as e:
-                logger.exception(
-                    "Erreur lors de la création de Fee pour student %s suite à FeeTypeAmount %s: %s",
-                    student.pk, getattr(instance, 'pk', None), e
-                )
+@receiver([post_save, post_delete], sender="fees.Fee", dispatch_uid="fees.stats.fee")
+@receiver([post_save, post_delete], sender="fees.Payment", dispatch_uid="fees.stats.payment")
+@receiver([post_save, post_delete], sender="fees.FeeType", dispatch_uid="fees.stats.fee_type")
+@receiver([post_save, post_delete], sender="fees.FeeTypeAmount", dispatch_uid="fees.stats.fee_type_amount")
+@receiver([post_save, post_delete], sender="core.Student", dispatch_uid="fees.stats.student")
+@receiver([post_save, post_delete], sender="academics.SchoolClass", dispatch_uid="fees.stats.school_class")
+def bust_fees_stats(sender, **kwargs):
+    # après le commit : invalidée plus tôt, une lecture concurrente remettrait
+    # en cache (sous la nouvelle version) les données d'avant l'écriture
+    transaction.on_commit(invalidate_fees_stats_cache)
 
 
 # ---------- Payment notifications (parent unique) ----------
 
-@receiver(post_save, sender=apps.get_model('fees', 'Payment'))
+@receiver(post_save, sender=apps.get_model('fees', 'Payment'), dispatch_uid="fees.payment_created_signal")
 def payment_created_signal(sender, instance, created, **kwargs):
     """
     Lorsque un Payment est créé (même non validé), on génère une notification 'payment_received'
@@ -129,20 +186,19 @@ def payment_created_signal(sender, instance, created, **kwargs):
     # Récupère les modèles notifications via apps.get_model pour éviter circular imports
     try:
         Notification = apps.get_model('notifications', 'Notification')
-        NotificationTemplate = apps.get_model('notifications', 'NotificationTemplate')
-        UserNotificationPreference = apps.get_model('notifications', 'UserNotificationPreference')
-        # tentative d'import de la fonction d'envoi (peut être absent en dev)
+        from notifications.service import get_preferences, get_template_by_key
+        # tentative d'import de l'envoi en arrière-plan (peut être absent en dev)
         try:
-            from notifications.delivery import send_notification as send_notification_fn
+            from notifications.tasks import enqueue_notifications_delivery
         except Exception:
-            send_notification_fn = None
+            enqueue_notifications_delivery = None
     except LookupError:
         # notifications app absente -> on sort proprement
         logger.debug("notifications app non disponible — pas de notif envoyée pour payment %s", instance.pk)
         return
 
     fee = instance.fee
-    tpl = NotificationTemplate.objects.filter(key='payment_received').first()
+    tpl = get_template_by_key('payment_received')
     default_channels = tpl.default_channels if tpl else ['inapp']
 
     # payload commun
@@ -163,89 +219,55 @@ def payment_created_signal(sender, instance, created, **kwargs):
         "student_name": student_name,
     }
 
-    # notifier le parent unique (champ 'parent' sur Student)
+    # destinataires : parent unique (champ 'parent' sur Student) puis l'élève (si user)
     parent = getattr(fee.student, 'parent', None)
-    if parent:
-        user_obj = getattr(parent, 'user', None)
-        if user_obj:
-            # éviter doublon pour ce payment
-            existed = Notification.objects.filter(
-                topic='fees',
-                recipient_user=user_obj,
-                payload__payment_id=instance.id
-            ).exists()
-            if not existed:
-                channels = list(default_channels)
-                try:
-                    pref = UserNotificationPreference.objects.get(user=user_obj, topic='fees')
-                    if not pref.enabled:
-                        channels = []
-                    else:
-                        channels = pref.channels or channels
-                except UserNotificationPreference.DoesNotExist:
-                    pass
-
-                try:
-                    notif = Notification.objects.create(
-                        template=tpl,
-                        topic='fees',
-                        recipient_user=user_obj,
-                        payload={**payload, "parent_name": getattr(parent, 'name', '')},
-                        channels=channels
-                    )
-                except Exception as e:
-                    logger.exception(
-                        "Impossible de créer Notification pour parent user %s sur payment %s: %s",
-                        getattr(user_obj, 'pk', None), instance.pk, e
-                    )
-                else:
-                    # tenter d'envoyer immédiatement (si send_notification disponible)
-                    if send_notification_fn:
-                        try:
-                            send_notification_fn(notif)
-                        except Exception as e:
-                            logger.exception(
-                                "Erreur d'envoi de notif initiale pour payment %s -> parent %s: %s",
-                                instance.pk, getattr(user_obj, 'pk', None), e
-                            )
-
-    # notifier l'élève si user attaché
+    recipients = []
+    parent_user = getattr(parent, 'user', None) if parent else None
+    if parent_user:
+        recipients.append((parent_user, {**payload, "parent_name": getattr(parent, 'name', '')}))
     if student_user:
-        existed = Notification.objects.filter(
+        recipients.append((student_user, payload))
+    if not recipients:
+        return
+
+    user_ids = [user_obj.pk for user_obj, _ in recipients]
+    # préférences (en cache) et doublons de tous les destinataires : 1 à 2 requêtes
+    # (préférence désactivée -> notification sans canal)
+    channels_by_user = {
+        user_id: (channels or list(default_channels)) if enabled else []
+        for user_id, (enabled, channels) in get_preferences(user_ids, 'fees').items()
+    }
+    already_notified = set(
+        Notification.objects.filter(
+            topic='fees',
+            recipient_user_id__in=user_ids,
+            payment_id=instance.id
+        ).values_list('recipient_user_id', flat=True)
+    )
+
+    new_notifs = [
+        Notification(
+            template=tpl,
             topic='fees',
-            recipient_user=student_user,
-            payload__payment_id=instance.id
-        ).exists()
-        if not existed:
-            channels = list(default_channels)
-            try:
-                pref = UserNotificationPreference.objects.get(user=student_user, topic='fees')
-                if not pref.enabled:
-                    channels = []
-                else:
-                    channels = pref.channels or channels
-            except UserNotificationPreference.DoesNotExist:
-                pass
-
-            try:
-                notif = Notification.objects.create(
-                    template=tpl,
-                    topic='fees',
-                    recipient_user=student_user,
-                    payload=payload,
-                    channels=channels
-                )
-            except Exception as e:
-                logger.exception(
-                    "Impossible de créer Notification pour student user %s sur payment %s: %s",
-                    getattr(student_user, 'pk', None), instance.pk, e
-                )
-            else:
-                if send_notification_fn:
-                    try:
-                        send_notification_fn(notif)
-                    except Exception as e:
-                        logger.exception(
-                            "Erreur d'envoi de notif initiale pour payment %s -> student %s: %s",
-                            instance.pk, getattr(student_user, 'pk', None), e
-                        )
+            recipient_user=user_obj,
+            payload=data,
+            payment_id=instance.id,
+            channels=channels_by_user.get(user_obj.pk, list(default_channels)),
+        )
+        for user_obj, data in recipients
+        if user_obj.pk not in already_notified
+    ]
+    if not new_notifs:
+        return
+
+    try:
+        notifs = Notification.objects.bulk_create(new_notifs)
+    except Exception as e:
+        logger.exception("Impossible de créer les notifications du payment %s: %s", instance.pk, e)
+        return
+
+    # envoi (email / SMS / push) dans un thread, une fois les lignes commitées :
+    # la requête qui crée le Payment n'attend pas les I/O réseau
+    if enqueue_notifications_delivery:
+        notif_ids = [notif.pk for notif in notifs]
+        transaction.on_commit(lambda: enqueue_notifications_delivery(notif_ids))
@@ -1,9 +1,24 @@
 # fees/tests.py
+import datetime
+import json
+from decimal import Decimal
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import transaction
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
 from django.contrib.auth import get_user_model
-from core.models import Student, Parent, SchoolClass
-from academics.models import Level
-from fees.models import FeeType, Fee
+from core.models import Parent, Student
+from academics.models import Level, SchoolClass
+from fees.models import FeeType, FeeTypeAmount, Fee, Payment
+from fees.serializers import FeeSerializer, PaymentSerializer
+from fees.signals import create_fees_for_students
+from fees.utils import statistics
+from notifications.models import Notification, NotificationTemplate
+from notifications.tasks import generate_fee_reminders_once
 
 User = get_user_model()
 
@@ -13,14 +28,302 @@ class FeeSignalsTest(TestCase):
         self.level = Level.objects.create(name="L1")
         self.school_class = SchoolClass.objects.create(name="Class A", level=self.level)
         self.user = User.objects.create_user(username="stu", password="pass")
-        self.student = Student.objects.create(user=self.user, school_class=self.school_class)
+        self.student = Student.objects.create(
+            user=self.user, school_class=self.school_class, date_of_birth=datetime.date(2010, 1, 1)
+        )
 
     def test_fee_created_on_student_create(self):
-        # créer fee_type puis nouvel étudiant
-        ft = FeeType.objects.create(name="Inscription", level=self.level, default_amount=100.00)
+        # créer fee_type (+ montant du niveau) puis nouvel étudiant
+        ft = FeeType.objects.create(name="Inscription")
+        FeeTypeAmount.objects.create(fee_type=ft, level=self.level, amount=Decimal("100.00"))
         # nouveau student (setUp a déjà créé un student sans ft présent)
         new_user = User.objects.create_user(username="stu2", password="pass")
-        new_student = Student.objects.create(user=new_user, school_class=self.school_class)
+        # garde-fou contre les N+1 du signal
+        with self.assertNumQueries(6):
+            new_student = Student.objects.create(
+                user=new_user, school_class=self.school_class, date_of_birth=datetime.date(2010, 1, 1)
+            )
         fees = Fee.objects.filter(student=new_student)
         self.assertTrue(fees.exists())
-        self.assertEqual(fees.first().amount, ft.default_amount)
+        self.assertEqual(fees.first().amount, Decimal("100.00"))
+
+    def test_fees_visible_inside_the_creating_transaction(self):
+        ft = FeeType.objects.create(name="Inscription")
+        FeeTypeAmount.objects.create(fee_type=ft, level=self.level, amount=Decimal("100.00"))
+        other = Student(
+            user=User.objects.create_user(username="stu3", password="pass"),
+            school_class=self.school_class, date_of_birth=datetime.date(2010, 1, 1),
+        )
+
+        # même visibilité pour le signal (création unitaire) et l'import en lot
+        with transaction.atomic():
+            created = Student.objects.create(
+                user=User.objects.create_user(username="stu2", password="pass"),
+                school_class=self.school_class, date_of_birth=datetime.date(2010, 1, 1),
+            )
+            Student.objects.bulk_create([other])
+            create_fees_for_students([other])
+            self.assertEqual(Fee.objects.filter(student__in=[created, other]).count(), 2)
+            transaction.set_rollback(True)
+        self.assertFalse(Fee.objects.filter(fee_type=ft).exclude(student=self.student).exists())
+
+    def test_fees_created_for_existing_students_on_new_fee_type_amount(self):
+        ft = FeeType.objects.create(name="Cantine")
+        FeeTypeAmount.objects.create(fee_type=ft, level=self.level, amount=Decimal("50.00"))
+        self.assertEqual(Fee.objects.filter(student=self.student, fee_type=ft).count(), 1)
+
+        # re-save : les Fee existants sont détectés, aucune insertion
+        fta = FeeTypeAmount.objects.get(fee_type=ft, level=self.level)
+        fta.save()
+        self.assertEqual(Fee.objects.filter(student=self.student, fee_type=ft).count(), 1)
+
+
+class FeesStatsManyTest(TestCase):
+    """cached_stats_many : sections calculées en séquence puis servies par le cache."""
+
+    def setUp(self):
+        # envoi des notifications (payment_received) hors test : pas de thread d'envoi
+        patcher = mock.patch("notifications.tasks.enqueue_notifications_delivery")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        cache.clear()
+        level = Level.objects.create(name="L1")
+        school_class = SchoolClass.objects.create(name="Class A", level=level)
+        ft = FeeType.objects.create(name="Inscription")
+        FeeTypeAmount.objects.create(fee_type=ft, level=level, amount=Decimal("100.00"))
+        for i in range(2):
+            user = User.objects.create_user(username=f"stu{i}", password="pass")
+            Student.objects.create(user=user, school_class=school_class, date_of_birth=datetime.date(2010, 1, 1))
+        self.fee = Fee.objects.first()
+        Payment.objects.create(fee=self.fee, amount=Decimal("40.00"), validated=True)
+
+    def calls(self):
+        return {
+            "global": (statistics.get_global_stats, {"validated_only": True}),
+            "by_class": (statistics.get_stats_by_class, {"validated_only": True}),
+            "top_students": (statistics.get_top_students, {"n": 10, "validated_only": True}),
+        }
+
+    def test_matches_direct_calls_and_is_cached(self):
+        stats = statistics.cached_stats_many(self.calls())
+        self.assertEqual(stats["global"], statistics.get_global_stats())
+        self.assertEqual(stats["by_class"], statistics.get_stats_by_class())
+        self.assertEqual(stats["top_students"], statistics.get_top_students())
+        self.assertEqual(stats["global"]["total_paid"], 40.0)
+
+        # deuxième appel servi par le cache : aucune requête d'agrégation
+        with self.assertNumQueries(0):
+            self.assertEqual(statistics.cached_stats_many(self.calls()), stats)
+
+    def test_sees_uncommitted_writes_inside_atomic(self):
+        with transaction.atomic():
+            Payment.objects.create(fee=self.fee, amount=Decimal("10.00"), validated=True)
+            stats = statistics.cached_stats_many(self.calls())
+            transaction.set_rollback(True)
+        self.assertEqual(stats["global"]["total_paid"], 50.0)
+
+
+class FeesStatsInvalidationTest(TestCase):
+    """Le cache des statistiques n'est invalidé qu'au commit de l'écriture."""
+
+    def setUp(self):
+        patcher = mock.patch("notifications.tasks.enqueue_notifications_delivery")
+        self.enqueue = patcher.start()
+        self.addCleanup(patcher.stop)
+        cache.clear()
+
+        level = Level.objects.create(name="L1")
+        school_class = SchoolClass.objects.create(name="Class A", level=level)
+        ft = FeeType.objects.create(name="Inscription")
+        FeeTypeAmount.objects.create(fee_type=ft, level=level, amount=Decimal("100.00"))
+        user = User.objects.create_user(username="stu", password="pass")
+        Student.objects.create(user=user, school_class=school_class, date_of_birth=datetime.date(2010, 1, 1))
+        self.payment = Payment.objects.create(fee=Fee.objects.get(), amount=Decimal("40.00"))
+
+        self.admin = User.objects.create_superuser(username="admin", password="pass")
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def total_paid(self):
+        response = self.client.get(reverse("fees-statistics"))
+        self.assertEqual(response.status_code, 200)
+        return response.json()["global"]["total_paid"]
+
+    def test_validated_payment_shows_in_statistics(self):
+        self.assertEqual(self.total_paid(), 0.0)  # mis en cache
+
+        version = statistics.fees_stats_cache_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.payment.validate(user=self.admin)
+            # transaction encore ouverte : la version du cache n'a pas bougé
+            self.assertEqual(statistics.fees_stats_cache_version(), version)
+
+        self.assertNotEqual(statistics.fees_stats_cache_version(), version)
+        self.assertEqual(self.total_paid(), 40.0)
+
+    def test_conditional_get_returns_304_until_stats_change(self):
+        for name in ("fees-statistics", "fees-statistics-monthly"):
+            etag = self.client.get(reverse(name))["ETag"]
+            self.assertEqual(self.client.get(reverse(name), HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            # autres paramètres : autre ETag
+            self.assertEqual(
+                self.client.get(reverse(name), {"validated": "0"}, HTTP_IF_NONE_MATCH=etag).status_code, 200
+            )
+
+        etag = self.client.get(reverse("fees-statistics"))["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.payment.validate(user=self.admin)
+        response = self.client.get(reverse("fees-statistics"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["global"]["total_paid"], 40.0)
+
+    def test_validate_marks_fee_paid_and_touches_updated_at(self):
+        fee = Fee.objects.get()
+        self.payment.amount = Decimal("100.00")
+        self.payment.save(update_fields=["amount"])
+
+        self.payment.validate(user=self.admin)
+        updated = Fee.objects.get(pk=fee.pk)
+        self.assertTrue(updated.paid)
+        self.assertGreater(updated.updated_at, fee.updated_at)
+
+    def test_validation_notifications_are_sent_in_background_after_commit(self):
+        NotificationTemplate.objects.create(
+            key="payment_validated", topic="fees", title_template="-", body_template="-", default_channels=["inapp"]
+        )
+        self.enqueue.reset_mock()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.payment.validate(user=self.admin)
+            self.enqueue.assert_not_called()
+
+        notif_ids = set(
+            Notification.objects.filter(payment_id=self.payment.pk, template__key="payment_validated")
+            .values_list("pk", flat=True)
+        )
+        self.assertTrue(notif_ids)
+        self.assertIn(notif_ids, [set(call.args[0]) for call in self.enqueue.call_args_list])
+
+
+class ParentFeeNotificationsTest(TestCase):
+    """Les notifications de frais atteignent le parent de l'élève (Student.parent)."""
+
+    def setUp(self):
+        patcher = mock.patch("notifications.tasks.enqueue_notifications_delivery")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        cache.clear()
+
+        for key in ("payment_validated", "fees_due_0"):
+            NotificationTemplate.objects.create(
+                key=key, topic="fees", title_template=key, body_template=key, default_channels=["inapp"]
+            )
+        level = Level.objects.create(name="L1")
+        school_class = SchoolClass.objects.create(name="Class A", level=level)
+        ft = FeeType.objects.create(name="Inscription")
+        self.parent = Parent.objects.create(user=User.objects.create_user(username="papa", password="pass"))
+        FeeTypeAmount.objects.create(fee_type=ft, level=level, amount=Decimal("100.00"))
+        Student.objects.create(
+            user=User.objects.create_user(username="stu", password="pass"),
+            school_class=school_class, parent=self.parent, date_of_birth=datetime.date(2010, 1, 1),
+        )
+        self.fee = Fee.objects.get()
+        self.admin = User.objects.create_superuser(username="admin", password="pass")
+
+    def parent_notifications(self, template_key):
+        return Notification.objects.filter(recipient_user=self.parent.user, template__key=template_key)
+
+    def test_payment_validation_notifies_parent(self):
+        payment = Payment.objects.create(fee=self.fee, amount=Decimal("40.00"))
+        payment.validate(user=self.admin)
+
+        notif = self.parent_notifications("payment_validated").get()
+        self.assertEqual(notif.payment_id, payment.pk)
+
+    def test_trigger_reminder_notifies_parent(self):
+        client = APIClient()
+        client.force_authenticate(self.admin)
+
+        response = client.post(reverse("fee-trigger-reminder", args=[self.fee.pk]))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(self.parent_notifications("fees_due_0").exists())
+
+    def test_scheduled_reminders_notify_parent(self):
+        Fee.objects.filter(pk=self.fee.pk).update(due_date=timezone.now().date())
+
+        generate_fee_reminders_once()
+
+        self.assertEqual(self.parent_notifications("fees_due_0").get().payload["fee_id"], self.fee.pk)
+
+
+class CachedFieldsMixinTest(TestCase):
+    def test_fields_are_not_shared_between_instances(self):
+        first, second = PaymentSerializer(), PaymentSerializer()
+
+        self.assertEqual(list(first.fields), list(second.fields))
+        for name, field in first.fields.items():
+            other = second.fields[name]
+            self.assertIsNot(field, other)
+            self.assertIsNot(field.validators, other.validators)
+            self.assertIsNot(field.error_messages, other.error_messages)
+            self.assertIs(field.parent, first)
+            self.assertIs(other.parent, second)
+
+
+class FeeListRowsTest(TestCase):
+    """Les listes fees / payments construites depuis values() gardent la sortie des serializers."""
+
+    def setUp(self):
+        patcher = mock.patch("notifications.tasks.enqueue_notifications_delivery")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        level = Level.objects.create(name="L1")
+        school_class = SchoolClass.objects.create(name="Class A", level=level)
+        for name, amount in (("Inscription", "100.00"), ("Cantine", "35.50")):
+            FeeTypeAmount.objects.create(
+                fee_type=FeeType.objects.create(name=name), level=level, amount=Decimal(amount)
+            )
+        Student.objects.create(
+            user=User.objects.create_user(username="stu", password="pass", first_name="Awa", last_name="Kone"),
+            school_class=school_class, date_of_birth=datetime.date(2010, 1, 1),
+        )
+        Student.objects.create(
+            user=User.objects.create_user(username="stu2", password="pass"),
+            date_of_birth=datetime.date(2010, 1, 1),
+        )
+        Fee.objects.create(
+            student=Student.objects.get(user__username="stu2"),
+            fee_type=FeeType.objects.get(name="Cantine"), amount=Decimal("10.00"),
+        )
+
+        self.admin = User.objects.create_superuser(username="admin", password="pass", first_name="Ade")
+        fee = Fee.objects.get(fee_type__name="Inscription", student__user__username="stu")
+        Payment.objects.create(fee=fee, amount=Decimal("40.00"), method="cash", reference="R1").validate(user=self.admin)
+        Payment.objects.create(fee=fee, amount=Decimal("15.25"), note="en attente")
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    @staticmethod
+    def by_id(rows):
+        return sorted(json.loads(json.dumps(rows)), key=lambda row: row["id"])
+
+    def test_fee_list_matches_fee_serializer(self):
+        response = self.client.get(reverse("fee-list"))
+
+        self.assertEqual(response.status_code, 200)
+        expected = FeeSerializer(Fee.objects.all(), many=True).data
+        self.assertEqual(len(expected), 3)
+        self.assertEqual(self.by_id(response.json()), self.by_id(expected))
+
+    def test_payment_list_matches_payment_serializer(self):
+        response = self.client.get(reverse("payment-list"))
+
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        rows = body["results"] if isinstance(body, dict) else body
+        expected = PaymentSerializer(Payment.objects.all(), many=True).data
+        self.assertEqual(len(expected), 2)
+        self.assertEqual(self.by_id(rows), self.by_id(expected))
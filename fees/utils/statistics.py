@@ -1,9 +1,11 @@
 # fees/utils/statistics.py
+import time
 from collections import OrderedDict
 from decimal import Decimal
 
-from django.db.models import Sum, Value, DecimalField
-from django.db.models.functions import Coalesce, TruncMonth
+from django.core.cache import cache
+from django.db.models import Case, CharField, Count, DecimalField, ExpressionWrapper, FloatField, IntegerField, OuterRef, Prefetch, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce, Concat, TruncMonth
 from django.utils import timezone
 
 from fees.models import Fee, Payment, FeeType, FeeTypeAmount
@@ -11,12 +13,87 @@ from academics.models import SchoolClass
 from core.models import Student
 
 
+FEES_STATS_CACHE_SECONDS = 300
+_FEES_STATS_VERSION_KEY = "fees-stats:version"
+
+# Expressions communes, construites une fois (l'ORM les copie en compilant
+# chaque requête) : montant décimal, zéro, somme des montants (0 si aucune ligne)
+_MONEY = DecimalField(max_digits=12, decimal_places=2)
+_ZERO_MONEY = Value(0, output_field=_MONEY)
+_SUM_AMOUNT = Coalesce(Sum("amount"), _ZERO_MONEY)
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+#  Cache des statistiques
+#
+#  Les clés sont préfixées par une version de namespace : toute écriture sur
+#  Fee / Payment / FeeType / FeeTypeAmount / Student / SchoolClass (signaux de
+#  fees.signals, et appels explicites après bulk_create) incrémente la version,
+#  ce qui invalide d'un coup toutes les entrées (global, par classe, par type,
+#  top élèves, séries mensuelles de toutes les années).
+# ─────────────────────────────────────────────────────────────────────────────
+
+def fees_stats_cache_version() -> int:
+    version = cache.get(_FEES_STATS_VERSION_KEY)
+    if version is None:
+        # Version initiale horodatée : si la clé est évincée, on ne retombe
+        # jamais sur une version déjà utilisée par des entrées encore en cache.
+        cache.add(_FEES_STATS_VERSION_KEY, time.time_ns(), None)
+        version = cache.get(_FEES_STATS_VERSION_KEY, 0)
+    return version
+
+
+def invalidate_fees_stats_cache() -> None:
+    """Invalide toutes les statistiques mises en cache (bump de version)."""
+    try:
+        cache.incr(_FEES_STATS_VERSION_KEY)
+    except ValueError:
+        cache.set(_FEES_STATS_VERSION_KEY, time.time_ns(), None)
+
+
+def _stats_cache_key(version, fn, kwargs) -> str:
+    args = ":".join(f"{name}={value}" for name, value in sorted(kwargs.items()))
+    return f"fees-stats:{version}:{fn.__name__}:{args}"
+
+
+def cached_stats(fn, **kwargs):
+    """Résultat de fn(**kwargs), servi depuis le cache (clé : fonction + arguments)."""
+    key = _stats_cache_key(fees_stats_cache_version(), fn, kwargs)
+    return cache.get_or_set(key, lambda: fn(**kwargs), FEES_STATS_CACHE_SECONDS)
+
+
+def cached_stats_many(calls):
+    """
+    calls : {nom: (fn, kwargs)} -> {nom: résultat}.
+    Entrées en cache lues en un get_many ; les manquantes sont calculées
+    l'une après l'autre sur la connexion de la requête, puis mises en cache
+    en un set_many.
+    """
+    version = fees_stats_cache_version()
+    keys = {name: _stats_cache_key(version, fn, kwargs) for name, (fn, kwargs) in calls.items()}
+    cached = cache.get_many(list(keys.values()))
+    results = {name: cached[key] for name, key in keys.items() if key in cached}
+
+    fresh = {name: fn(**kwargs) for name, (fn, kwargs) in calls.items() if name not in results}
+    if fresh:
+        cache.set_many({keys[name]: value for name, value in fresh.items()}, FEES_STATS_CACHE_SECONDS)
+
+    results.update(fresh)
+    return {name: results[name] for name in calls}
+
+
 def _decimal(n):
     if n is None:
         return Decimal("0.00")
     return Decimal(n)
 
 
+def _payments(validated_only=True):
+    """Paiements pris en compte dans les statistiques (validés seulement, par défaut)."""
+    qs = Payment.objects.all()
+    return qs.filter(validated=True) if validated_only else qs
+
+
 def get_global_stats(validated_only=True):
     """
     total_due: somme des montants demandés (sum Fee.amount)
@@ -25,12 +102,10 @@ def get_global_stats(validated_only=True):
     rate: percentage
     """
     fees_qs = Fee.objects.all()
-    payments_qs = Payment.objects.all()
-    if validated_only:
-        payments_qs = payments_qs.filter(validated=True)
+    payments_qs = _payments(validated_only)
 
-    total_due = fees_qs.aggregate(total=Coalesce(Sum("amount"), Value(0, output_field=DecimalField())))["total"]
-    total_paid = payments_qs.aggregate(total=Coalesce(Sum("amount"), Value(0, output_field=DecimalField())))["total"]
+    total_due = fees_qs.aggregate(total=_SUM_AMOUNT)["total"]
+    total_paid = payments_qs.aggregate(total=_SUM_AMOUNT)["total"]
 
     total_due = _decimal(total_due)
     total_paid = _decimal(total_paid)
@@ -45,23 +120,50 @@ def get_global_stats(validated_only=True):
     }
 
 
+def _sum_by(qs, key):
+    """
+    {valeur de key: somme des montants} en une seule requête GROUP BY.
+    Les groupes absents (aucune ligne) ne figurent pas dans le dict.
+    """
+    return dict(
+        qs.order_by().values(key)
+        .annotate(total=_SUM_AMOUNT)
+        .values_list(key, "total")
+    )
+
+
+def _sum_subquery(qs, outer_field):
+    """Somme des montants de qs pour la ligne externe (OuterRef("pk")), 0 si aucune."""
+    total = (
+        qs.filter(**{outer_field: OuterRef("pk")}).order_by()
+        .values(outer_field).annotate(total=Sum("amount")).values("total")
+    )
+    return Coalesce(Subquery(total, output_field=_MONEY), _ZERO_MONEY)
+
+
 def get_stats_by_class(validated_only=True):
     """
     Retourne la liste des stats par SchoolClass.
+    Montants dus / payés et effectif de chaque classe calculés par
+    sous-requêtes indépendantes (pas de jointure fees × paiements qui
+    gonflerait les sommes) : une seule requête, quel que soit le nombre de classes.
     """
-    payments_qs = Payment.objects.all()
-    if validated_only:
-        payments_qs = payments_qs.filter(validated=True)
+    payments_qs = _payments(validated_only)
+
+    students_count = (
+        Student.objects.filter(school_class=OuterRef("pk")).order_by()
+        .values("school_class").annotate(count=Count("pk")).values("count")
+    )
+    classes = SchoolClass.objects.select_related("level").annotate(
+        due=_sum_subquery(Fee.objects.all(), "student__school_class"),
+        paid=_sum_subquery(payments_qs, "fee__student__school_class"),
+        students_count=Coalesce(Subquery(students_count, output_field=IntegerField()), Value(0)),
+    )
 
     class_stats = []
-    classes = SchoolClass.objects.select_related("level").all()
     for cls in classes:
-        fees = Fee.objects.filter(student__school_class=cls)
-        class_due = fees.aggregate(total=Coalesce(Sum("amount"), Value(0, output_field=DecimalField())))["total"]
-        class_paid = payments_qs.filter(fee__in=fees).aggregate(total=Coalesce(Sum("amount"), Value(0, output_field=DecimalField())))["total"]
-
-        class_due = _decimal(class_due)
-        class_paid = _decimal(class_paid)
+        class_due = _decimal(cls.due)
+        class_paid = _decimal(cls.paid)
         remaining = class_due - class_paid
         rate = (class_paid / class_due * 100) if class_due > 0 else Decimal("0.00")
 
@@ -77,7 +179,7 @@ def get_stats_by_class(validated_only=True):
             "class_id": cls.id,
             "class_name": cls.name,
             "level": getattr(cls.level, "name", None),
-            "students_count": Student.objects.filter(school_class=cls).count(),
+            "students_count": cls.students_count,
             "total_due": float(class_due),
             "total_paid": float(class_paid),
             "remaining": float(remaining),
@@ -91,30 +193,39 @@ def get_stats_by_feetype(validated_only=True):
     """
     Agrégation du total dû / payé par FeeType.
     Renvoie aussi les montants configurés par niveau (via FeeTypeAmount).
+    Fees et paiements agrégés par type en deux requêtes GROUP BY, montants
+    par niveau préchargés : nombre de requêtes constant.
     """
-    payments_qs = Payment.objects.all()
-    if validated_only:
-        payments_qs = payments_qs.filter(validated=True)
+    payments_qs = _payments(validated_only)
+
+    # Somme et nombre des fees réellement créés (assignés aux élèves), par type
+    fees_by_type = {
+        row["fee_type"]: row
+        for row in Fee.objects.order_by().values("fee_type").annotate(
+            due=_SUM_AMOUNT,
+            count=Count("pk"),
+        )
+    }
+    paid_by_type = _sum_by(payments_qs, "fee__fee_type")
+    fee_types = FeeType.objects.prefetch_related(
+        Prefetch("amounts", queryset=FeeTypeAmount.objects.select_related("level"))
+    )
 
     data = []
-    for ft in FeeType.objects.all():
-        # Somme des fees réellement créés (assignés aux élèves)
-        fees_qs = Fee.objects.filter(fee_type=ft)
-        due = fees_qs.aggregate(total=Coalesce(Sum("amount"), Value(0, output_field=DecimalField())))["total"]
-        paid = payments_qs.filter(fee__in=fees_qs).aggregate(total=Coalesce(Sum("amount"), Value(0, output_field=DecimalField())))["total"]
-
-        due = _decimal(due)
-        paid = _decimal(paid)
+    for ft in fee_types:
+        fees_row = fees_by_type.get(ft.id, {})
+        due = _decimal(fees_row.get("due"))
+        paid = _decimal(paid_by_type.get(ft.id))
         remaining = due - paid
         rate = (paid / due * 100) if due > 0 else Decimal("0.00")
 
         # récupérer montants par niveau configurés
         amounts = []
-        for fta in ft.amounts.select_related("level").all():
+        for fta in ft.amounts.all():
             amounts.append({
                 "level_id": fta.level.id,
                 "level_name": getattr(fta.level, "name", None),
-                "amount": float(_decimal(fta.amount)),
+                "amount": float(fta.amount),
                 "is_active": bool(fta.is_active),
             })
 
@@ -126,7 +237,7 @@ def get_stats_by_feetype(validated_only=True):
             "total_paid": float(paid),
             "remaining": float(remaining),
             "rate": round(float(rate), 2),
-            "count_fees": fees_qs.count(),
+            "count_fees": fees_row.get("count", 0),
         })
     return data
 
@@ -134,37 +245,43 @@ def get_stats_by_feetype(validated_only=True):
 def get_top_students(n=10, validated_only=True):
     """
     Retourne les top n élèves par montant restant dû (ordre décroissant).
+    Dû / payé calculés par sous-requêtes (pas de jointure fees × paiements
+    qui gonflerait les sommes) ; tri et LIMIT faits par la base.
     """
-    payments_qs = Payment.objects.all()
-    if validated_only:
-        payments_qs = payments_qs.filter(validated=True)
-
-    result = []
-    students = Student.objects.all()
-    for s in students:
-        fees = Fee.objects.filter(student=s)
-        due = _decimal(fees.aggregate(total=Coalesce(Sum("amount"), Value(0, output_field=DecimalField())))["total"])
-        paid = _decimal(payments_qs.filter(fee__in=fees).aggregate(total=Coalesce(Sum("amount"), Value(0, output_field=DecimalField())))["total"])
-        remaining = due - paid
-        name = ""
-        if getattr(s, "first_name", None) or getattr(s, "last_name", None):
-            name = f"{getattr(s, 'first_name', '')} {getattr(s, 'last_name', '')}".strip()
-        else:
-            # fallback if Student proxies user
-            user = getattr(s, "user", None)
-            name = f"{getattr(user, 'first_name', '')} {getattr(user, 'last_name', '')}".strip() if user else str(s)
-
-        result.append({
-            "student_id": s.id,
-            "student_name": name,
-            "total_due": float(due),
-            "total_paid": float(paid),
-            "remaining": float(remaining),
-        })
-
-    # sort by remaining desc
-    result = sorted(result, key=lambda x: x["remaining"], reverse=True)
-    return result[:n]
+    payments_qs = _payments(validated_only)
+
+    due = _sum_subquery(Fee.objects.all(), "student")
+    paid = _sum_subquery(payments_qs, "fee__student")
+    students = (
+        Student.objects
+        # montants convertis en float par la base (reste calculé en décimal
+        # avant conversion) : aucun Decimal intermédiaire par élève
+        .annotate(
+            due=Cast(due, FloatField()),
+            paid=Cast(paid, FloatField()),
+            remaining=Cast(ExpressionWrapper(due - paid, output_field=_MONEY), FloatField()),
+            # nom de l'élève s'il est renseigné, sinon celui de son user
+            name=Case(
+                When(first_name="", last_name="", then=Concat("user__first_name", Value(" "), "user__last_name")),
+                default=Concat("first_name", Value(" "), "last_name"),
+                output_field=CharField(),
+            ),
+        )
+        # à reste égal : ordre par défaut des élèves, comme le tri stable précédent
+        .order_by("-remaining", *Student._meta.ordering, "pk")
+        .values("id", "name", "due", "paid", "remaining")[:n]
+    )
+
+    return [
+        {
+            "student_id": row["id"],
+            "student_name": row["name"].strip(),
+            "total_due": row["due"],
+            "total_paid": row["paid"],
+            "remaining": row["remaining"],
+        }
+        for row in students
+    ]
 
 
 def get_monthly_payments(year=None, validated_only=True):
@@ -172,20 +289,15 @@ def get_monthly_payments(year=None, validated_only=True):
     Série temporelle : total payé par mois (grouped by month).
     Returns list of {month: 'YYYY-MM', total_paid: float}
     """
-    payments_qs = Payment.objects.all()
-    if validated_only:
-        payments_qs = payments_qs.filter(validated=True)
+    payments_qs = _payments(validated_only)
 
     if year is None:
         year = timezone.now().year
 
+    # total converti en float par la base : pas de Decimal intermédiaire par ligne
     qs = payments_qs.filter(paid_at__year=year)
-    qs = qs.annotate(month=TruncMonth("paid_at")).values("month").annotate(total=Coalesce(Sum("amount"), Value(0, output_field=DecimalField()))).order_by("month")
-
-    data = []
-    for row in qs:
-        month = row["month"]
-        total = _decimal(row["total"])
-        data.append({"month": month.strftime("%Y-%m"), "total_paid": float(total)})
+    qs = qs.annotate(month=TruncMonth("paid_at")).values("month").annotate(
+        total=Coalesce(Cast(Sum("amount"), FloatField()), Value(0.0))
+    ).order_by("month")
 
-    return data
+    return [{"month": row["month"].strftime("%Y-%m"), "total_paid": row["total"]} for row in qs]
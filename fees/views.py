@@ -1,10 +1,14 @@
+import hashlib
+
 from rest_framework import viewsets, status, filters as drf_filters
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
+from django.views.decorators.http import condition
 from django.apps import apps
+from django.db.models import Prefetch
 
 from django_filters.rest_framework import DjangoFilterBackend
 
@@ -16,7 +20,9 @@ from .filters import FeeFilter, PaymentFilter, FeeTypeFilter, FeeTypeAmountFilte
 
 
 class FeeTypeViewSet(viewsets.ModelViewSet):
-    queryset = FeeType.objects.all().order_by("name")
+    queryset = FeeType.objects.prefetch_related(
+        Prefetch("amounts", queryset=FeeTypeAmount.objects.select_related("level"))
+    ).order_by("name")
     serializer_class = FeeTypeSerializer
     permission_classes = [IsAdminUser]
     pagination_class = None
@@ -56,12 +62,13 @@ class FeeTypeAmountViewSet(viewsets.ModelViewSet):
 
 
 from decimal import Decimal
-from django.db import models
+from django.db import models, transaction
 from django.db.models import Sum, F, Value, Q, DecimalField, ExpressionWrapper
 from django.db.models.functions import Coalesce
 from rest_framework import viewsets, status, filters as drf_filters
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework import serializers
 from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from django_filters.rest_framework import DjangoFilterBackend
 from django.shortcuts import get_object_or_404
@@ -73,9 +80,117 @@ from .permissions import IsStudentOrParentOrAdmin
 from .filters import FeeFilter
 
 
+# ---------------------------------------------------------------------------
+# Listes en lecture seule : lignes values() mises en forme à la main, même
+# sortie que FeeSerializer / PaymentSerializer sans instancier un serializer
+# (ni ses champs) par ligne. Les champs DRF ci-dessous ne servent qu'au format.
+# ---------------------------------------------------------------------------
+
+_MONEY    = serializers.DecimalField(max_digits=12, decimal_places=2)
+_DATE     = serializers.DateField()
+_DATETIME = serializers.DateTimeField()
+
+_FEE_ROW_FIELDS = (
+    "id", "fee_type_id", "fee_type__name", "amount", "due_date", "paid", "payment_date", "created_at",
+    "student_id", "student__first_name", "student__last_name",
+    "student__user__first_name", "student__user__last_name",
+    "student__school_class_id", "student__school_class__name", "student__school_class__level__name",
+)
+
+_PAYMENT_ROW_FIELDS = (
+    "id", "amount", "paid_at", "method", "reference", "note", "validated", "validated_at",
+    "validated_by_id", "validated_by__username", "validated_by__first_name", "validated_by__last_name",
+) + tuple(f"fee__{name}" for name in _FEE_ROW_FIELDS)
+
+
+# Retrieve / update / actions : colonnes des tables jointes que ni les
+# serializers ni les permissions ne lisent (hash du mot de passe, description
+# du FeeType, ...) sont exclues du SELECT. Les colonnes propres à Fee / Payment
+# restent chargées : save() les réécrit toutes.
+_USER_UNUSED_FIELDS = ("password", "last_login", "is_superuser", "email", "is_staff", "is_active", "date_joined")
+
+_FEE_DEFERRED_FIELDS = (
+    "fee_type__description", "fee_type__is_active", "fee_type__created_at",
+    "student__date_of_birth", "student__sex", "student__fees_initialized",
+) + tuple(f"student__user__{name}" for name in _USER_UNUSED_FIELDS)
+
+_PAYMENT_DEFERRED_FIELDS = tuple(f"fee__{name}" for name in _FEE_DEFERRED_FIELDS) + tuple(
+    f"validated_by__{name}" for name in _USER_UNUSED_FIELDS
+)
+
+# Listes : lignes lues par lots (curseur serveur sous PostgreSQL), sans cache
+# de résultats du queryset en plus des dicts de la réponse
+_LIST_CHUNK_SIZE = 2000
+
+
+def _money(value):
+    return _MONEY.to_representation(value) if value is not None else None
+
+
+def _date(value, field=_DATE):
+    return field.to_representation(value) if value is not None else None
+
+
+def _student_row(f, prefix=""):
+    """Même forme que StudentMiniSerializer."""
+    first_name = f[prefix + "student__user__first_name"] or f[prefix + "student__first_name"]
+    last_name  = f[prefix + "student__user__last_name"] or f[prefix + "student__last_name"]
+    has_class  = f[prefix + "student__school_class_id"] is not None
+    return {
+        "id":         str(f[prefix + "student_id"]),
+        "first_name": first_name,
+        "last_name":  last_name,
+        "full_name":  ((first_name or "") + " " + (last_name or "")).strip() or None,
+        "class_name": (f[prefix + "student__school_class__name"] or None) if has_class else None,
+        "level":      f[prefix + "student__school_class__level__name"] if has_class else None,
+    }
+
+
+def _fee_row(f, total_paid, prefix=""):
+    """Même forme que FeeSerializer (lecture)."""
+    amount = f[prefix + "amount"]
+    return {
+        "id":              f[prefix + "id"],
+        "fee_type":        f[prefix + "fee_type_id"],
+        "fee_type_name":   f[prefix + "fee_type__name"],
+        "student":         _student_row(f, prefix),
+        "amount":          _money(amount),
+        "due_date":        _date(f[prefix + "due_date"]),
+        "paid":            f[prefix + "paid"],
+        "payment_date":    _date(f[prefix + "payment_date"]),
+        "created_at":      _date(f[prefix + "created_at"], _DATETIME),
+        "total_paid":      _money(total_paid),
+        "total_remaining": _money(amount - total_paid),
+    }
+
+
+def _payment_row(p, fee_total_paid):
+    """Même forme que PaymentSerializer."""
+    fee = _fee_row(p, fee_total_paid, prefix="fee__")
+    return {
+        "id":         p["id"],
+        "fee":        fee["id"],
+        "fee_detail": fee,
+        "student":    fee["student"],
+        "amount":     _money(p["amount"]),
+        "paid_at":    _date(p["paid_at"], _DATETIME),
+        "method":     p["method"],
+        "reference":  p["reference"],
+        "note":       p["note"],
+        "validated":  p["validated"],
+        "validated_by": {
+            "id":         p["validated_by_id"],
+            "username":   p["validated_by__username"],
+            "first_name": p["validated_by__first_name"],
+            "last_name":  p["validated_by__last_name"],
+        } if p["validated_by_id"] is not None else None,
+        "validated_at": _date(p["validated_at"], _DATETIME),
+    }
+
+
 class FeeViewSet(viewsets.ModelViewSet):
     queryset = (
-        Fee.objects.select_related("fee_type", "student", "student__user")
+        Fee.objects.select_related("fee_type", "student__user", "student__school_class__level")
         .annotate(
             annotated_total_paid=Coalesce(
                 Sum('payments__amount', filter=Q(payments__validated=True)),
@@ -89,7 +204,7 @@ class FeeViewSet(viewsets.ModelViewSet):
                 output_field=DecimalField(max_digits=12, decimal_places=2),
             )
         )
-        .all()
+        .defer(*_FEE_DEFERRED_FIELDS)
     )
 
     serializer_class = FeeSerializer
@@ -109,6 +224,9 @@ class FeeViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         user = self.request.user
         qs = self.queryset
+        if self.action == "trigger_reminder":
+            # destinataires du rappel (Student.parent est une ForeignKey) : joints avec le fee
+            qs = qs.select_related("student__parent__user")
 
         if user.is_staff or user.is_superuser:
             return qs
@@ -121,6 +239,10 @@ class FeeViewSet(viewsets.ModelViewSet):
 
         return qs.none()
 
+    def list(self, request, *args, **kwargs):
+        rows = self.filter_queryset(self.get_queryset()).values(*_FEE_ROW_FIELDS, "annotated_total_paid")
+        return Response([_fee_row(f, f["annotated_total_paid"]) for f in rows.iterator(chunk_size=_LIST_CHUNK_SIZE)])
+
     def create(self, request, *args, **kwargs):
         data = request.data.copy()
 
@@ -227,17 +349,15 @@ class FeeViewSet(viewsets.ModelViewSet):
         fee = self.get_object()
 
         Notification = None
-        NotificationTemplate = None
-        UserNotificationPreference = None
-        send_notification = None
+        get_preferences = None
+        get_template_by_key = None
+        enqueue_notifications_delivery = None
 
         try:
             Notification = apps.get_model('notifications', 'Notification')
-            NotificationTemplate = apps.get_model('notifications', 'NotificationTemplate')
-            UserNotificationPreference = apps.get_model('notifications', 'UserNotificationPreference')
+            from notifications.service import get_preferences, get_template_by_key
 
-            from notifications.delivery import send_notification as _send
-            send_notification = _send
+            from notifications.tasks import enqueue_notifications_delivery
 
         except Exception:
             Notification = None
@@ -246,120 +366,81 @@ class FeeViewSet(viewsets.ModelViewSet):
             return Response({"detail": "notifications app not available"},
                             status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        try:
-            template = NotificationTemplate.objects.get(key="fees_due_0")
-        except NotificationTemplate.DoesNotExist:
+        template = get_template_by_key("fees_due_0")
+        if template is None:
             return Response({"detail": "template fees_due_0 missing"},
                             status=status.HTTP_400_BAD_REQUEST)
 
-        created_count = 0
-
-        for parent in fee.student.parents.all():
-            user_obj = getattr(parent, "user", None)
-            if not user_obj:
-                continue
-
-            existed = Notification.objects.filter(
+        student = fee.student
+        student_user = getattr(student, "user", None)
+        payload = {
+            "fee_id": fee.id,
+            "fee_type": fee.fee_type.name,
+            "student_name": student_user.get_full_name()
+            if student_user
+            else f"{student.first_name} {student.last_name}",
+            "amount_due": float(fee.amount),
+            "due_date": fee.due_date.isoformat() if fee.due_date else None,
+            "reminder_offset": 0
+        }
+
+        # destinataires : parent unique (Student.parent, ForeignKey) puis l'élève
+        parent = getattr(student, "parent", None)
+        parent_user = getattr(parent, "user", None) if parent else None
+        recipients = [(user_obj, is_parent) for user_obj, is_parent in ((parent_user, True), (student_user, False)) if user_obj]
+        user_ids = [user_obj.pk for user_obj, _ in recipients]
+
+        # doublons et préférences de tous les destinataires en une fois
+        existing = set(
+            Notification.objects.filter(
                 topic='fees',
-                recipient_user=user_obj,
+                recipient_user_id__in=user_ids,
                 payload__fee_id=fee.id,
                 payload__reminder_offset=0
-            ).exists()
+            ).values_list('recipient_user_id', flat=True)
+        ) if user_ids else set()
+        try:
+            prefs = get_preferences(user_ids, 'fees')
+        except Exception:
+            prefs = {}
 
-            if existed:
+        new_notifs = []
+        for user_obj, is_parent in recipients:
+            if user_obj.pk in existing:
                 continue
 
             channels = template.default_channels or ['inapp']
-
-            try:
-                pref = UserNotificationPreference.objects.get(user=user_obj, topic='fees')
-                if not pref.enabled:
-                    continue
-                channels = pref.channels or channels
-            except Exception:
-                pass
-
-            payload = {
-                "fee_id": fee.id,
-                "fee_type": fee.fee_type.name,
-                "student_name": fee.student.user.get_full_name()
-                if getattr(fee.student, "user", None)
-                else f"{fee.student.first_name} {fee.student.last_name}",
-                "amount_due": float(fee.amount),
-                "due_date": fee.due_date.isoformat() if fee.due_date else None,
-                "reminder_offset": 0
-            }
-
-            notif = Notification.objects.create(
+            if user_obj.pk in prefs:
+                enabled, pref_channels = prefs[user_obj.pk]
+                if not enabled:
+                    if is_parent:
+                        continue
+                    # préférence désactivée : l'élève garde une notification sans canal
+                    channels = []
+                else:
+                    channels = pref_channels or channels
+
+            new_notifs.append(Notification(
                 template=template,
                 topic='fees',
                 recipient_user=user_obj,
                 payload=payload,
                 channels=channels
-            )
-
-            if send_notification:
-                try:
-                    send_notification(notif)
-                except Exception:
-                    pass
+            ))
 
-            created_count += 1
+        notifs = Notification.objects.bulk_create(new_notifs) if new_notifs else []
 
-        student_user = getattr(fee.student, "user", None)
+        if notifs and enqueue_notifications_delivery:
+            notif_ids = [notif.pk for notif in notifs]
+            transaction.on_commit(lambda: enqueue_notifications_delivery(notif_ids))
 
-        if student_user:
-            existed = Notification.objects.filter(
-                topic='fees',
-                recipient_user=student_user,
-                payload__fee_id=fee.id,
-                payload__reminder_offset=0
-            ).exists()
-
-            if not existed:
-                channels = template.default_channels or ['inapp']
-
-                try:
-                    pref = UserNotificationPreference.objects.get(user=student_user, topic='fees')
-                    if not pref.enabled:
-                        channels = []
-                    else:
-                        channels = pref.channels or channels
-                except Exception:
-                    pass
-
-                payload = {
-                    "fee_id": fee.id,
-                    "fee_type": fee.fee_type.name,
-                    "student_name": fee.student.user.get_full_name()
-                    if getattr(fee.student, "user", None)
-                    else f"{fee.student.first_name} {fee.student.last_name}",
-                    "amount_due": float(fee.amount),
-                    "due_date": fee.due_date.isoformat() if fee.due_date else None,
-                    "reminder_offset": 0
-                }
-
-                notif = Notification.objects.create(
-                    template=template,
-                    topic='fees',
-                    recipient_user=student_user,
-                    payload=payload,
-                    channels=channels
-                )
-
-                if send_notification:
-                    try:
-                        send_notification(notif)
-                    except Exception:
-                        pass
-
-                created_count += 1
-
-        return Response({"detail": "reminders triggered", "created": created_count})
+        return Response({"detail": "reminders triggered", "created": len(notifs)})
 
 
 class PaymentViewSet(viewsets.ModelViewSet):
-    queryset = Payment.objects.select_related("fee", "fee__fee_type", "fee__student", "fee__student__user", "validated_by").all()
+    queryset = Payment.objects.select_related(
+        "fee__fee_type", "fee__student__user", "fee__student__school_class__level", "validated_by"
+    ).defer(*_PAYMENT_DEFERRED_FIELDS)
     serializer_class = PaymentSerializer
     permission_classes = [IsStudentOrParentOrAdmin]
     pagination_class = None
@@ -385,6 +466,16 @@ class PaymentViewSet(viewsets.ModelViewSet):
             return qs.filter(fee__student__parent=user.parent)
         return qs.none()
 
+    def list(self, request, *args, **kwargs):
+        qs = self.filter_queryset(self.get_queryset())
+        # total validé de chaque Fee affiché : un seul GROUP BY, fees listés en sous-requête
+        totals = dict(
+            Payment.objects.filter(fee_id__in=qs.values("fee_id"), validated=True)
+            .order_by().values("fee_id").annotate(total=Sum("amount")).values_list("fee_id", "total")
+        )
+        rows = qs.values(*_PAYMENT_ROW_FIELDS).iterator(chunk_size=_LIST_CHUNK_SIZE)
+        return Response([_payment_row(p, totals.get(p["fee__id"]) or Decimal("0")) for p in rows])
+
     @action(detail=True, methods=["post"], permission_classes=[IsAdminUser])
     def validate_payment(self, request, pk=None):
         payment = get_object_or_404(Payment, pk=pk)
@@ -407,6 +498,9 @@ class PaymentViewSet(viewsets.ModelViewSet):
 
 
 from .utils.statistics import (
+    cached_stats,
+    cached_stats_many,
+    fees_stats_cache_version,
     get_global_stats,
     get_stats_by_class,
     get_stats_by_feetype,
@@ -415,21 +509,35 @@ from .utils.statistics import (
 )
 
 
+
+def _stats_etag(request, *args, **kwargs):
+    """
+    ETag des statistiques : version du cache (incrémentée à chaque écriture
+    sur les données sources) + paramètres et format demandés. Un GET
+    conditionnel inchangé reçoit un 304 sans qu'aucune agrégation ne tourne.
+    L'année courante couvre les séries mensuelles sans ?year=.
+    """
+    varying = f"{request.get_full_path()}|{request.META.get('HTTP_ACCEPT', '')}|{timezone.now().year}"
+    return f"{fees_stats_cache_version()}-{hashlib.sha1(varying.encode()).hexdigest()[:16]}"
+
+
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
+@condition(etag_func=_stats_etag)
 def fees_statistics(request):
     validated = request.query_params.get("validated", "1") != "0"
-    stats = {
-        "global": get_global_stats(validated_only=validated),
-        "by_class": get_stats_by_class(validated_only=validated),
-        "by_fee_type": get_stats_by_feetype(validated_only=validated),
-        "top_students": get_top_students(n=10, validated_only=validated),
-    }
+    stats = cached_stats_many({
+        "global": (get_global_stats, {"validated_only": validated}),
+        "by_class": (get_stats_by_class, {"validated_only": validated}),
+        "by_fee_type": (get_stats_by_feetype, {"validated_only": validated}),
+        "top_students": (get_top_students, {"n": 10, "validated_only": validated}),
+    })
     return Response(stats)
 
 
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
+@condition(etag_func=_stats_etag)
 def fees_monthly(request):
     year = request.query_params.get("year")
     try:
@@ -437,5 +545,5 @@ def fees_monthly(request):
     except ValueError:
         year = None
     validated = request.query_params.get("validated", "1") != "0"
-    data = get_monthly_payments(year=year, validated_only=validated)
+    data = cached_stats(get_monthly_payments, year=year, validated_only=validated)
     return Response({"year": year or timezone.now().year, "monthly": data})
\ No newline at end of file
@@ -1,8 +1,19 @@
 # notifications/delivery.py
+#
+# Callers sending many notifications should preload them, e.g.
+#   Notification.objects.select_related("recipient_user", "template")
+#                       .prefetch_related("recipient_user__devices")
+# or simply use send_notifications_bulk(), so that each send does no extra
+# lookup for the recipient, the template or the push devices.
 import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
 from typing import Dict, List, Tuple
 
 from django.core.mail import send_mail, BadHeaderError
+from django.db import close_old_connections, transaction
+from django.db.models import prefetch_related_objects
 from django.utils import timezone
 
 from .models import Notification, NotificationAttempt, Channel, UserDevice
@@ -66,6 +77,7 @@ def _send_push(notification: Notification, title: str, body: str) -> Tuple[bool,
     """
     user = notification.recipient_user
     devices_qs = getattr(user, "devices", None)
+    # single evaluation (served from the prefetch cache when preloaded)
     devices = list(devices_qs.all()) if devices_qs is not None else []
 
     if not devices:
@@ -100,14 +112,74 @@ def _normalize_channel(ch) -> str:
     return str(ch).lower()
 
 
+_EXTERNAL_CHANNELS = frozenset(
+    _normalize_channel(c) for c in (Channel.EMAIL, Channel.SMS, Channel.PUSH)
+)
+
+# The one executor for notification network I/O in a web process: channel sends
+# of a notification and background batches (notifications.tasks) share it.
+_DELIVERY_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="notif-delivery")
+_pool_state = threading.local()
+
+
+def _in_delivery_pool() -> bool:
+    return getattr(_pool_state, "active", False)
+
+
+def _run_pooled(fn, args):
+    _pool_state.active = True
+    # same connection lifecycle as a request: drop stale / broken connections
+    # before the job, and release them after it once past CONN_MAX_AGE
+    close_old_connections()
+    try:
+        return fn(*args)
+    finally:
+        close_old_connections()
+        _pool_state.active = False
+
+
+def submit_delivery(fn, *args):
+    """
+    Run fn(*args) on the shared delivery pool and return its Future,
+    or None (logged) if the pool no longer accepts work (process exiting).
+    Jobs still queued when the process dies are lost: the notifications
+    they carry stay sent=False, for `manage.py resend_notifications`.
+    """
+    try:
+        return _DELIVERY_POOL.submit(_run_pooled, fn, args)
+    except RuntimeError:
+        logger.error("Delivery pool shut down, dropped %s%r", getattr(fn, "__name__", fn), args)
+        return None
+
+
+def _deliver(notification: Notification, ch: str, raw_ch, title: str, body: str) -> Tuple[bool, str]:
+    """Deliver through one normalized channel. Returns (success, response_message)."""
+    if ch == _normalize_channel(Channel.INAPP):
+        # In-app attempt still recorded by the caller
+        return _send_inapp(notification)
+    if ch == _normalize_channel(Channel.EMAIL):
+        return _send_email(notification, title, body)
+    if ch == _normalize_channel(Channel.SMS):
+        return _send_sms(notification, body)
+    if ch == _normalize_channel(Channel.PUSH):
+        return _send_push(notification, title, body)
+    # unknown channel string: try to match verbose names
+    if raw_ch and str(raw_ch).lower() in ("inapp", "email", "sms", "push"):
+        # already normalized above; this branch reachable only for odd types
+        return False, f"unhandled-channel:{raw_ch}"
+    return False, f"unknown-channel:{raw_ch}"
+
+
 def send_notification(notification: Notification) -> Dict[str, bool]:
     """
     Harmonized delivery pipeline.
-    - For each configured channel, attempt delivery and create a NotificationAttempt.
+    - For each configured channel, attempt delivery and record a NotificationAttempt
+      (all attempts are inserted together at the end).
     - If at least one channel succeeds, mark the Notification as sent.
     - Returns a dict mapping channel -> bool (success).
     """
     results: Dict[str, bool] = {}
+    attempts: List[NotificationAttempt] = []
     any_success = False
 
     title = ""
@@ -131,41 +203,39 @@ def send_notification(notification: Notification) -> Dict[str, bool]:
     if not raw_channels:
         raw_channels = ["inapp"]
 
-    for raw_ch in raw_channels:
-        ch = _normalize_channel(raw_ch)
+    channels = [(raw_ch, _normalize_channel(raw_ch)) for raw_ch in raw_channels]
+
+    # Network-bound channels (email / sms / push) are dispatched concurrently when
+    # there are several of them. The recipient and its push devices are loaded here,
+    # in the caller's thread: the pool threads never touch the database.
+    external = [ch for _, ch in channels if ch in _EXTERNAL_CHANNELS]
+    if external:
+        recipient = notification.recipient_user
+        if _normalize_channel(Channel.PUSH) in external:
+            prefetch_related_objects([recipient], "devices")
+    # Already on the pool (background batch): send inline, since waiting on
+    # jobs queued behind ourselves could deadlock the pool.
+    concurrent = len(external) > 1 and not _in_delivery_pool()
+
+    outcomes = []
+    for raw_ch, ch in channels:
+        future = None
+        if concurrent and ch in _EXTERNAL_CHANNELS:
+            future = submit_delivery(_deliver, notification, ch, raw_ch, title, body)
+        outcomes.append(future or partial(_deliver, notification, ch, raw_ch, title, body))
+
+    # collect in channel order, so attempts and results keep the configured order
+    for (raw_ch, ch), outcome in zip(channels, outcomes):
         try:
-            success = False
-            response = ""
-
-            if ch == _normalize_channel(Channel.INAPP):
-                success, response = _send_inapp(notification)
-                # In-app attempt still recorded below
-            elif ch == _normalize_channel(Channel.EMAIL):
-                success, response = _send_email(notification, title, body)
-            elif ch == _normalize_channel(Channel.SMS):
-                success, response = _send_sms(notification, body)
-            elif ch == _normalize_channel(Channel.PUSH):
-                success, response = _send_push(notification, title, body)
-            else:
-                # unknown channel string: try to match verbose names
-                if raw_ch and str(raw_ch).lower() in ("inapp", "email", "sms", "push"):
-                    # already normalized above; this branch reachable only for odd types
-                    success = False
-                    response = f"unhandled-channel:{raw_ch}"
-                else:
-                    success = False
-                    response = f"unknown-channel:{raw_ch}"
-
-            # create NotificationAttempt record (store the original channel representation for clarity)
-            try:
-                NotificationAttempt.objects.create(
-                    notification=notification,
-                    channel=raw_ch if not isinstance(raw_ch, Channel) else raw_ch.value,
-                    success=bool(success),
-                    response=str(response)
-                )
-            except Exception as e:
-                logger.exception("Failed to create NotificationAttempt for notif %s channel %s: %s", getattr(notification, "id", None), raw_ch, e)
+            success, response = outcome.result() if isinstance(outcome, Future) else outcome()
+
+            # queue NotificationAttempt record (store the original channel representation for clarity)
+            attempts.append(NotificationAttempt(
+                notification=notification,
+                channel=raw_ch if not isinstance(raw_ch, Channel) else raw_ch.value,
+                success=bool(success),
+                response=str(response)
+            ))
 
             results[str(raw_ch)] = bool(success)
             if success:
@@ -174,17 +244,21 @@ def send_notification(notification: Notification) -> Dict[str, bool]:
         except Exception as e:
             # unexpected per-channel failure: log and record a failed attempt
             logger.exception("Unexpected error delivering notification %s via %s: %s", getattr(notification, "id", None), raw_ch, e)
-            try:
-                NotificationAttempt.objects.create(
-                    notification=notification,
-                    channel=raw_ch if not isinstance(raw_ch, Channel) else raw_ch.value,
-                    success=False,
-                    response=str(e)
-                )
-            except Exception:
-                logger.exception("Also failed to create NotificationAttempt after exception for notif %s", getattr(notification, "id", None))
+            attempts.append(NotificationAttempt(
+                notification=notification,
+                channel=raw_ch if not isinstance(raw_ch, Channel) else raw_ch.value,
+                success=False,
+                response=str(e)
+            ))
             results[str(raw_ch)] = False
 
+    # persist all attempts in a single INSERT
+    try:
+        with transaction.atomic():
+            NotificationAttempt.objects.bulk_create(attempts)
+    except Exception as e:
+        logger.exception("Failed to create NotificationAttempts for notif %s: %s", getattr(notification, "id", None), e)
+
     # finalize notification status
     try:
         if any_success:
@@ -196,3 +270,15 @@ def send_notification(notification: Notification) -> Dict[str, bool]:
         logger.exception("Failed to update notification.sent/error for notif %s: %s", getattr(notification, "id", None), e)
 
     return results
+
+
+def send_notifications_bulk(notifications) -> Dict[str, Dict[str, bool]]:
+    """
+    Send several notifications in a row.
+    Recipients, templates and push devices are loaded once for the whole list
+    instead of once per notification.
+    Returns a dict mapping notification id -> send_notification() results.
+    """
+    notifications = list(notifications)
+    prefetch_related_objects(notifications, "template", "recipient_user__devices")
+    return {str(notification.id): send_notification(notification) for notification in notifications}
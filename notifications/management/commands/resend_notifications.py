@@ -0,0 +1,32 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from notifications.delivery import send_notifications_bulk
+from notifications.models import Notification
+
+
+class Command(BaseCommand):
+    help = "Renvoie les notifications non envoyées (échec ou envoi en arrière-plan interrompu)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=7, help="Ancienneté maximale des notifications (jours).")
+        parser.add_argument("--batch-size", type=int, default=200)
+
+    def handle(self, *args, **options):
+        since = timezone.now() - timedelta(days=options["days"])
+        pending = (
+            Notification.objects.filter(sent=False, created_at__gte=since)
+            .exclude(channels=[])
+            .order_by("created_at")
+            .values_list("pk", flat=True)
+        )
+        ids = list(pending)
+        batch_size = options["batch_size"]
+        sent = 0
+        for start in range(0, len(ids), batch_size):
+            batch = Notification.objects.filter(pk__in=ids[start:start + batch_size]).select_related("recipient_user")
+            results = send_notifications_bulk(batch)
+            sent += sum(1 for channels in results.values() if any(channels.values()))
+        self.stdout.write(self.style.SUCCESS(f"{sent}/{len(ids)} notification(s) renvoyée(s)."))
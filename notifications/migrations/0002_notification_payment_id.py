@@ -0,0 +1,42 @@
+# Generated by Django 5.2.5 on 2026-10-15 23:37
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_payment_id(apps, schema_editor):
+    """Copy payload['payment_id'] into the new column for existing fees notifications."""
+    Notification = apps.get_model('notifications', 'Notification')
+    batch = []
+    for notif in Notification.objects.filter(topic='fees', payload__has_key='payment_id').only('id', 'payload').iterator():
+        try:
+            notif.payment_id = int(notif.payload['payment_id'])
+        except (TypeError, ValueError):
+            continue
+        batch.append(notif)
+        if len(batch) >= 500:
+            Notification.objects.bulk_update(batch, ['payment_id'])
+            batch = []
+    if batch:
+        Notification.objects.bulk_update(batch, ['payment_id'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='payment_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['recipient_user', 'topic', 'payment_id'], name='notificatio_recipie_78b5ae_idx'),
+        ),
+        migrations.RunPython(backfill_payment_id, migrations.RunPython.noop),
+    ]
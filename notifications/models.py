@@ -34,6 +34,8 @@ class Notification(models.Model):
     topic = models.CharField(max_length=50, choices=NotificationTopic.choices)
     recipient_user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='notifications')
     payload = models.JSONField(default=dict)
+    # copy of payload['payment_id'] (fees notifications): indexed duplicate check
+    payment_id = models.BigIntegerField(null=True, blank=True)
     channels = models.JSONField(default=list)
     sent = models.BooleanField(default=False)
     read = models.BooleanField(default=False)
@@ -45,6 +47,7 @@ class Notification(models.Model):
         indexes = [
             models.Index(fields=['recipient_user', 'created_at']),
             models.Index(fields=['topic', 'created_at']),
+            models.Index(fields=['recipient_user', 'topic', 'payment_id']),
         ]
         ordering = ['-created_at']
 
@@ -1,6 +1,7 @@
 # notifications/service.py
 import logging
-from typing import List, Tuple
+from typing import Dict, List, Tuple
+from django.core.cache import cache
 from django.db import transaction
 from django.utils import timezone
 from django.apps import apps  # <--- INDISPENSABLE pour éviter l'erreur
@@ -11,6 +12,68 @@ from .delivery import send_notification
 
 logger = logging.getLogger(__name__)
 
+# Templates are near-static: cache lookups by key, purged by notifications.signals on change
+TEMPLATE_CACHE_SECONDS = 300
+_MISSING = "missing"
+
+
+def _template_cache_key(key: str) -> str:
+    return f"notif-tpl:{key}"
+
+
+def get_template_by_key(key: str):
+    """
+    Return the NotificationTemplate with this key (or None), served from the cache.
+    Missing templates are cached too, so repeated lookups never hit the DB.
+    """
+    cached = cache.get(_template_cache_key(key))
+    if cached is None:
+        cached = NotificationTemplate.objects.filter(key=key).first() or _MISSING
+        cache.set(_template_cache_key(key), cached, TEMPLATE_CACHE_SECONDS)
+    return None if cached == _MISSING else cached
+
+
+def invalidate_template_cache(key: str) -> None:
+    cache.delete(_template_cache_key(key))
+
+
+# Preferences change rarely and are read for every recipient of every notification:
+# short-lived cache, purged by notifications.signals on save / delete
+PREFERENCE_CACHE_SECONDS = 60
+
+
+def _preference_cache_key(user_id, topic: str) -> str:
+    return f"notif-pref:{user_id}:{topic}"
+
+
+def get_preferences(user_ids, topic: str) -> Dict[int, Tuple[bool, list]]:
+    """
+    Return {user_id: (enabled, channels)} for the given users having a preference on this topic.
+    Served from the cache; users without preference are cached as missing too,
+    so only unknown users cost a (single) query.
+    """
+    keys = {_preference_cache_key(user_id, topic): user_id for user_id in user_ids}
+    if not keys:
+        return {}
+    cached = cache.get_many(list(keys))
+    unknown = [user_id for key, user_id in keys.items() if key not in cached]
+    if unknown:
+        found = {
+            user_id: (enabled, channels)
+            for user_id, enabled, channels in UserNotificationPreference.objects.filter(
+                user_id__in=unknown, topic=topic
+            ).values_list('user_id', 'enabled', 'channels')
+        }
+        fresh = {_preference_cache_key(user_id, topic): found.get(user_id, _MISSING) for user_id in unknown}
+        cache.set_many(fresh, PREFERENCE_CACHE_SECONDS)
+        cached.update(fresh)
+    return {user_id: cached[key] for key, user_id in keys.items() if cached[key] != _MISSING}
+
+
+def invalidate_preference_cache(user_id, topic: str) -> None:
+    cache.delete(_preference_cache_key(user_id, topic))
+
+
 def _resolve_parents_from_student(student):
     """
     Try several common relations to return a list of User instances that represent parents/guardians.
@@ -58,9 +121,9 @@ def _determine_channels_for_user(user, topic, explicit_channels=None, tpl: Notif
     """
     if explicit_channels:
         return explicit_channels
-    pref = UserNotificationPreference.objects.filter(user=user, topic=topic, enabled=True).first()
-    if pref and pref.channels:
-        return pref.channels
+    enabled, channels = get_preferences([user.pk], topic).get(user.pk, (False, None))
+    if enabled and channels:
+        return channels
     if tpl and tpl.default_channels:
         return tpl.default_channels
     return ['inapp']
@@ -74,7 +137,7 @@ def create_notification_for_user(recipient_user, topic: str, payload: dict = Non
     payload = payload or {}
     tpl = None
     if template_key:
-        tpl = NotificationTemplate.objects.filter(key=template_key).first()
+        tpl = get_template_by_key(template_key)
     if not tpl:
         tpl = NotificationTemplate.objects.filter(topic=topic).first()
 
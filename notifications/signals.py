@@ -0,0 +1,15 @@
+# notifications/signals.py
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .service import invalidate_preference_cache, invalidate_template_cache
+
+
+@receiver([post_save, post_delete], sender="notifications.NotificationTemplate")
+def bust_template_cache(sender, instance, **kwargs):
+    invalidate_template_cache(instance.key)
+
+
+@receiver([post_save, post_delete], sender="notifications.UserNotificationPreference")
+def bust_preference_cache(sender, instance, **kwargs):
+    invalidate_preference_cache(instance.user_id, instance.topic)
@@ -1,17 +1,21 @@
+import logging
 from django.utils import timezone
 from datetime import timedelta
 from fees.models import Fee  # chemin correct
 from .models import NotificationTemplate, Notification, UserNotificationPreference
-from .delivery import send_notification
+from .delivery import send_notification, send_notifications_bulk, submit_delivery
+
+logger = logging.getLogger(__name__)
 
 REMINDER_OFFSETS = [30, 14, 3, 0, -3, -7]
 
+
 def generate_fee_reminders_once():
     today = timezone.now().date()
     for offset in REMINDER_OFFSETS:
         target_date = today + timedelta(days=offset)
         # chercher Fees dont due_date == target_date et non payés
-        fees = Fee.objects.filter(due_date=target_date, paid=False)
+        fees = Fee.objects.filter(due_date=target_date, paid=False).select_related("fee_type", "student__user", "student__parent__user")
         for fee in fees:
             try:
                 template_key = f"fees_due_{abs(offset)}"
@@ -19,46 +23,75 @@ def generate_fee_reminders_once():
             except NotificationTemplate.DoesNotExist:
                 continue
 
-            # notify each parent
-            for parent in fee.student.parents.all():
-                user_obj = getattr(parent, 'user', None)
-                if not user_obj:
-                    continue
+            # notify the parent (Student.parent: single ForeignKey)
+            parent = fee.student.parent
+            user_obj = getattr(parent, 'user', None) if parent else None
+            if not user_obj:
+                continue
+
+            # prevent duplicates: check if notif for this fee + offset already exists
+            existed = Notification.objects.filter(
+                topic='fees',
+                recipient_user=user_obj,
+                payload__fee_id=fee.id,
+                payload__reminder_offset=offset
+            ).exists()
+            if existed:
+                continue
 
-                # prevent duplicates: check if notif for this fee + offset already exists
-                existed = Notification.objects.filter(
-                    topic='fees',
-                    recipient_user=user_obj,
-                    payload__fee_id=fee.id,
-                    payload__reminder_offset=offset
-                ).exists()
-                if existed:
+            # user preference
+            try:
+                pref = UserNotificationPreference.objects.get(user=user_obj, topic='fees')
+                if not pref.enabled:
                     continue
+                channels = pref.channels or template.default_channels
+            except UserNotificationPreference.DoesNotExist:
+                channels = template.default_channels
+
+            payload = {
+                "fee_id": fee.id,
+                "fee_type": fee.fee_type.name,
+                "student_name": getattr(getattr(fee.student,'user',None),'get_full_name', lambda: '')() or f"{getattr(fee.student,'first_name','')} {getattr(fee.student,'last_name','')}",
+                "amount_due": float(fee.amount),
+                "due_date": fee.due_date.isoformat() if fee.due_date else None,
+                "reminder_offset": offset
+            }
+
+            notif = Notification.objects.create(
+                template=template,
+                topic='fees',
+                recipient_user=user_obj,
+                payload=payload,
+                channels=channels
+            )
+            # Optionnel: envoyer tout de suite
+            send_notification(notif)
+
 
-                # user preference
-                try:
-                    pref = UserNotificationPreference.objects.get(user=user_obj, topic='fees')
-                    if not pref.enabled:
-                        continue
-                    channels = pref.channels or template.default_channels
-                except UserNotificationPreference.DoesNotExist:
-                    channels = template.default_channels
+def _deliver_notifications(notification_ids):
+    try:
+        notifications = Notification.objects.filter(pk__in=notification_ids).select_related("recipient_user")
+        send_notifications_bulk(notifications)
+    except Exception as exc:
+        logger.exception("Background delivery failed for notifications %s", notification_ids)
+        # keep the failure on the rows: resend_notifications picks them up
+        try:
+            Notification.objects.filter(pk__in=notification_ids, sent=False).update(
+                error=f"background delivery failed: {exc}"
+            )
+        except Exception:
+            logger.exception("Could not record delivery failure for notifications %s", notification_ids)
 
-                payload = {
-                    "fee_id": fee.id,
-                    "fee_type": fee.fee_type.name,
-                    "student_name": getattr(getattr(fee.student,'user',None),'get_full_name', lambda: '')() or f"{getattr(fee.student,'first_name','')} {getattr(fee.student,'last_name','')}",
-                    "amount_due": float(fee.amount),
-                    "due_date": fee.due_date.isoformat() if fee.due_date else None,
-                    "reminder_offset": offset
-                }
 
-                notif = Notification.objects.create(
-                    template=template,
-                    topic='fees',
-                    recipient_user=user_obj,
-                    payload=payload,
-                    channels=channels
-                )
-                # Optionnel: envoyer tout de suite
-                send_notification(notif)
+def enqueue_notifications_delivery(notification_ids):
+    """
+    Send already-stored notifications (email / SMS / push) on the shared
+    delivery pool (delivery.submit_delivery), so the request that created
+    them does not wait on network I/O.
+    Call it from transaction.on_commit() so the rows are visible to the pool thread.
+    Unsent notifications (process restart, failure) stay sent=False and can be
+    retried with `manage.py resend_notifications`.
+    """
+    notification_ids = list(notification_ids)
+    if notification_ids:
+        submit_delivery(_deliver_notifications, notification_ids)